@@ -37,40 +37,138 @@ __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
 
-import re
+import re, json, itertools, multiprocessing
 from mosespy.corpus import ReferenceCorpus
 from mosespy.system import Path
 import xml.etree.cElementTree as ET
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-def generateHTML(refCorpus, corpusProcessor):
+def generateHTML(refCorpus, corpusProcessor, nbProcesses=None, chunkSize=200, sharded=False):
     """Generates the webpage for the given aligned corpus containing 
     source, (reference) targets and actual translation. The method 
     generates the webpage and returns its local path.
     
+    The XML data for the aligned pairs is computed in chunks by a pool of
+    processes and streamed directly into the webpage.  In sharded mode, 
+    the chunks are instead written as JSONP shards in a directory next to the
+    webpage, and the webpage only embeds an index of the shards.  The shards
+    are then loaded on demand by the browser through script tags, which also
+    works when the webpage is opened from the local file system.
+    
+    Args:
+        refCorpus (ReferenceCorpus): reference corpus with translations
+        corpusProcessor (CorpusProcessor): processor used to revert the corpus
+        nbProcesses (int): number of processes (default: number of CPUs)
+        chunkSize (int): number of aligned pairs per chunk (or shard)
+        sharded (bool): whether to write the data as JSONP shards
+    
     """ 
 
     if not isinstance(refCorpus, ReferenceCorpus) or not refCorpus.translation:
         raise RuntimeError(str(refCorpus) + " is not a reference corpus with translations")
 
     readCorpus = corpusProcessor.revertReferenceCorpus(refCorpus)
-    tokenisedAligns = refCorpus.getAlignments()
-    untokenisedAligns = readCorpus.getAlignments()
     bleu, _ = corpusProcessor.getBleuScore(refCorpus)
-
-    doc = "<html>\n"
     
-    doc += "<head>\n"
-    doc += head
+    htmlFile = refCorpus.getStem() + ".html"
+    o = open(htmlFile, 'w')
+    o.write("<html>\n")
+    o.write("<head>\n")
+    o.write(head)
     javascript = open(Path(__file__).getUp() + "/data/analyser.js", 'r').read()
-    doc += "<script>" + javascript + "</script>\n"
-    doc += """<script id="transdata" type="text/xmldata">"""
-    doc += _generateXML(tokenisedAligns, untokenisedAligns)
-    doc += "</script>\n" 
-    doc += "</head>\n"
+    o.write("<script>" + javascript + "</script>\n")
+    if sharded:
+        shardIndex = _writeJSONShards(refCorpus, readCorpus, nbProcesses, chunkSize)
+        nbPairs = shardIndex["nbPairs"]
+        o.write("""<script id="transindex" type="application/json">""")
+        o.write(json.dumps(shardIndex))
+        o.write("</script>\n")
+    else:
+        o.write("""<script id="transdata" type="text/xmldata">""")
+        o.write("<translations>")
+        nbPairs = 0
+        for chunkXML, chunkLength in _iterChunks(refCorpus, readCorpus, _generateXMLChunk,
+                                                 nbProcesses, chunkSize):
+            o.write(chunkXML)
+            nbPairs += chunkLength
+        o.write("</translations>")
+        o.write("</script>\n")
+    o.write("</head>\n")
+    o.write(_generateBody(refCorpus, bleu, nbPairs))
+    o.close()
+    return htmlFile
+
+
+def _iterChunks(refCorpus, readCorpus, function, nbProcesses=None, chunkSize=200):
+    """Iterates over the results of the function applied on successive chunks 
+    of aligned pairs from the (tokenised) reference corpus and its reverted 
+    version.  The chunks are processed in parallel and the results are yielded
+    in order, together with the number of pairs in each chunk.
+    
+    """
+    nbProcesses = nbProcesses or multiprocessing.cpu_count()
+    pairs = itertools.izip(refCorpus.iterAlignments(), readCorpus.iterAlignments())
+    chunks = iter(lambda : list(itertools.islice(pairs, chunkSize)), [])
+    if nbProcesses == 1:
+        for chunk in chunks:
+            yield function(chunk), len(chunk)
+        return
+    
+    pool = multiprocessing.Pool(nbProcesses)
+    try:
+        lengths = []
+        def countedChunks():
+            for chunk in chunks:
+                lengths.append(len(chunk))
+                yield chunk
+        for i, result in enumerate(pool.imap(function, countedChunks())):
+            yield result, lengths[i]
+    finally:
+        pool.terminate()
+        pool.join()
+    
+
+def _writeJSONShards(refCorpus, readCorpus, nbProcesses=None, chunkSize=200):
+    """Writes the data for the aligned pairs as a sequence of JSONP shards in 
+    the directory {stem}.shards, and returns the index of the shards.  Each 
+    shard is a script calling analyserShard(number, rows), where the rows
+    contain the lengths of the source, translation and references, the WER 
+    scores of each reference, and the XML representation of the pair.  The 
+    index specifies the file, first row, size and range of WER scores for 
+    each shard.
     
-    doc += """<body>\n<form action="">"""
-    doc += """<h2>Evaluation results (<span id="nblines">%i</span> translations):</h2>\n"""%len(tokenisedAligns)
+    """
+    shardDir = Path(refCorpus.getStem() + ".shards")
+    shardDir.resetdir()
+    shardIndex = {"directory": shardDir.basename(), "nbPairs": 0, "shards": []}
+    for rows, chunkLength in _iterChunks(refCorpus, readCorpus, _generateJSONChunk,
+                                         nbProcesses, chunkSize):
+        shardNumber = len(shardIndex["shards"])
+        shardFile = "%05i.js"%shardNumber
+        with open(shardDir + "/" + shardFile, 'w') as shard:
+            shard.write("analyserShard(%i, "%shardNumber)
+            json.dump(rows, shard)
+            shard.write(");\n")
+        wers = [ref[2] for row in rows for ref in row["references"]] or [0]
+        wers_punct = [ref[3] for row in rows for ref in row["references"]] or [0]
+        shardIndex["shards"].append({"file": shardFile, "first": shardIndex["nbPairs"], 
+                                     "size": chunkLength, "wer": [min(wers), max(wers)], 
+                                     "wer_punct": [min(wers_punct), max(wers_punct)]})
+        shardIndex["nbPairs"] += chunkLength
+    return shardIndex
+    
+
+def _generateBody(refCorpus, bleu, nbPairs):
+    """Generates the body of the webpage, given the reference corpus, its
+    BLEU score and the number of aligned pairs.
+    
+    """
+    doc = """<body>\n<form action="">"""
+    doc += """<h2>Evaluation results (<span id="nblines">%i</span> translations):</h2>\n"""%nbPairs
     doc += """<table id="outputsinfo">\n"""
     pathTag = lambda p : """<i style="font-size:0.8em;"><a href="%s">%s</a></i>"""%(p,p)
     doc += """<tr><td><b>Source file: </b></td><td>%s</td></tr>\n"""%(pathTag(refCorpus.sourceCorpus))
@@ -79,7 +177,7 @@ def generateHTML(refCorpus, corpusProcessor):
     doc += """<tr><td><b>Total BLEU score: </b></td><td>%.2f</td></tr>\n"""%(bleu)
     doc += "</table><br>\n"
     doc += """<h4 style="display: inline-block;">Filtered translation outputs"""
-    doc += """(<span id="nboutputs">0</span>/%i):</h4>"""%len(tokenisedAligns)
+    doc += """(<span id="nboutputs">0</span>/%i):</h4>"""%nbPairs
     doc += """<span style="margin-left:250px;">Maximum table size:&nbsp;&nbsp;</span>"""
     doc += """<select name="tablesize" onchange="this.form.submit()">
               <option selected="true">100</option> <option>500</option>
@@ -96,77 +194,91 @@ def generateHTML(refCorpus, corpusProcessor):
     doc += filterbox
     doc += "</body>\n"
     doc += "</html>"
-    
-    htmlFile = refCorpus.getStem() + ".html"
-    o = open(htmlFile, 'w')
-    o.write(doc)
-    o.close()
-    return htmlFile
+    return doc
 
         
-def _generateXML(tokenisedAligns, untokenisedAligns):
-    """Generate the XML representation of the reference corpus.  The corpus must be
-    a reference corpus with associated translations. The generated XML can then
-    be included as data to display the translation outputs in a web page.
+def _generateXMLChunk(alignPairs):
+    """Generates the XML representation of a list of (tokenised, untokenised)
+    aligned pairs, as a concatenation of <pair> elements.
     
     """
-       
-    root = ET.Element("translations")
+    return "".join([ET.tostring(_generatePairElement(tokAlign, untokAlign)) 
+                    for tokAlign, untokAlign in alignPairs])
 
+
+def _generateJSONChunk(alignPairs):
+    """Generates the JSON rows for a list of (tokenised, untokenised) aligned
+    pairs.  Each row contains the number of tokens and words for the source 
+    and translation, the number of tokens, words and the WER scores (with and
+    without punctuation) for each reference, and the XML element of the pair.
+    
+    """
+    getLengths = lambda el : [int(el.get("nbtokens")), int(el.get("nbwords"))]
+    rows = []
+    for tokAlign, untokAlign in alignPairs:
+        pairEl = _generatePairElement(tokAlign, untokAlign)
+        references = [getLengths(refEl) + [int(refEl.get("wer")), int(refEl.get("wer_punct"))]
+                      for refEl in pairEl.findall("reference")]
+        rows.append({"source": getLengths(pairEl.find("source")),
+                     "translation": getLengths(pairEl.find("translation")),
+                     "references": references, "pair": ET.tostring(pairEl)})
+    return rows
+
+
+def _generatePairElement(tokAlign, untokAlign):
+    """Generates the XML element for a tokenised aligned pair (with reference
+    targets and translation) and its untokenised version.
+    
+    """
     countTokens = lambda s : str(len([t for t in s.split(" ")]))
     wordTokens = lambda s : [t for t in s.split(" ") if re.compile(r'[\w_]+', re.UNICODE).search(t)]
     countWords = lambda s : str(len(wordTokens(s)))
     contiguousTokens = lambda t,u : ",".join([str(k) for k in _getContiguousTokens(t,u)])
     
-    for i in range(0, len(tokenisedAligns)):         
-        
-        tokAlign = tokenisedAligns[i]
-        untokAlign = untokenisedAligns[i]
- 
-        pairEl = ET.SubElement(root, "pair")
-       
-        tokAlign.source = _clean(tokAlign.source)
-        sourceEl = ET.SubElement(pairEl, "source")
-        sourceEl.text = tokAlign.source.decode("UTF-8")   
-        sourceEl.set("nbtokens", countTokens(tokAlign.source))
-        sourceEl.set("nbwords", countWords(tokAlign.source))
-        sourceEl.set("contiguous", contiguousTokens(tokAlign.source, untokAlign.source))
-      
-        tokAlign.translation = _clean(tokAlign.translation)
-        translation_words = wordTokens(tokAlign.translation)
-        
-        bestGrid = None
-        bestGrid_punct = None
-        for j in range(0, len(tokAlign.target)):
-            reference = _clean(tokAlign.target[j])
-            refEl = ET.SubElement(pairEl, "reference")
-            refEl.text = reference.decode("UTF-8")
-            refEl.set("nbtokens", countTokens(reference))
-            refEl.set("nbwords", countWords(reference))
-            refEl.set("contiguous", contiguousTokens(reference, untokAlign.target[j]))
-
-            grid = EditGrid(" ".join(wordTokens(reference)), " ".join(translation_words))
-            refEl.set("wer", "%.2d"%grid.wer)
-            refEl.set("edits", _completeEdits(grid.refTokens, reference))
-            if not bestGrid or bestGrid.wer > grid.wer:
-                bestGrid = grid
-
-            grid_punct = EditGrid(reference, tokAlign.translation)
-            refEl.set("wer_punct", "%.2d"%grid_punct.wer)
-            refEl.set("edits_punct", "".join([t.edit for t in grid_punct.refTokens]))
-            if not bestGrid_punct or bestGrid_punct.wer > grid_punct.wer:
-                bestGrid_punct = grid_punct
-             
-        transEl = ET.SubElement(pairEl, "translation")
-        transEl.text = tokAlign.translation.decode("UTF-8")
-        transEl.set("nbtokens", countTokens(tokAlign.translation))
-        transEl.set("nbwords", countWords(tokAlign.translation))
-        transEl.set("contiguous", contiguousTokens(tokAlign.translation, untokAlign.translation))
-        
-        transEl.set("edits",_completeEdits(bestGrid.actualTokens, tokAlign.translation))
-        transEl.set("edits_punct", "".join([t.edit for t in bestGrid_punct.actualTokens])) 
-                    
-    return ET.tostring(root)
+    pairEl = ET.Element("pair")
+   
+    tokAlign.source = _clean(tokAlign.source)
+    sourceEl = ET.SubElement(pairEl, "source")
+    sourceEl.text = tokAlign.source.decode("UTF-8")   
+    sourceEl.set("nbtokens", countTokens(tokAlign.source))
+    sourceEl.set("nbwords", countWords(tokAlign.source))
+    sourceEl.set("contiguous", contiguousTokens(tokAlign.source, untokAlign.source))
+  
+    tokAlign.translation = _clean(tokAlign.translation)
+    translation_words = wordTokens(tokAlign.translation)
+    
+    bestGrid = None
+    bestGrid_punct = None
+    for j in range(0, len(tokAlign.target)):
+        reference = _clean(tokAlign.target[j])
+        refEl = ET.SubElement(pairEl, "reference")
+        refEl.text = reference.decode("UTF-8")
+        refEl.set("nbtokens", countTokens(reference))
+        refEl.set("nbwords", countWords(reference))
+        refEl.set("contiguous", contiguousTokens(reference, untokAlign.target[j]))
+
+        grid = EditGrid(" ".join(wordTokens(reference)), " ".join(translation_words))
+        refEl.set("wer", "%.2d"%grid.wer)
+        refEl.set("edits", _completeEdits(grid.refTokens, reference))
+        if not bestGrid or bestGrid.wer > grid.wer:
+            bestGrid = grid
+
+        grid_punct = EditGrid(reference, tokAlign.translation)
+        refEl.set("wer_punct", "%.2d"%grid_punct.wer)
+        refEl.set("edits_punct", "".join([t.edit for t in grid_punct.refTokens]))
+        if not bestGrid_punct or bestGrid_punct.wer > grid_punct.wer:
+            bestGrid_punct = grid_punct
+         
+    transEl = ET.SubElement(pairEl, "translation")
+    transEl.text = tokAlign.translation.decode("UTF-8")
+    transEl.set("nbtokens", countTokens(tokAlign.translation))
+    transEl.set("nbwords", countWords(tokAlign.translation))
+    transEl.set("contiguous", contiguousTokens(tokAlign.translation, untokAlign.translation))
+    
+    transEl.set("edits",_completeEdits(bestGrid.actualTokens, tokAlign.translation))
+    transEl.set("edits_punct", "".join([t.edit for t in bestGrid_punct.actualTokens])) 
+                
+    return pairEl
  
         
 
@@ -296,20 +408,41 @@ filterbox = """
 class EditGrid:
     """Grid for the edit distance between two strings (one is typically a
     reference translation, while the other one is a generated translation).
+    The tokens are encoded as integers, and the distance grid is computed row
+    by row, using numpy array operations when numpy is available.  The 
+    computation can optionally be restricted to a band around the diagonal.
    
     """
     
-    def __init__(self, reference, actual):
-
+    def __init__(self, reference, actual, band=None):
+        """Creates the edit grid between the reference and actual strings.
+        
+        Args:
+            reference (str): the reference string
+            actual (str): the actual string
+            band (int): optional maximum distance from the diagonal for the
+                cells of the grid (the band is widened if necessary to allow
+                for the difference of length between the two strings).
+        
+        """
         self.refTokens = [EditToken(t) for t in reference.split()]
         self.actualTokens = [EditToken(t) for t in actual.split()]
         
-        self.distgrid, self.editgrid = self.__createGrids()
+        codes = {}
+        refCodes = [codes.setdefault(t.lowered, len(codes)) for t in self.refTokens]
+        actualCodes = [codes.setdefault(t.lowered, len(codes)) for t in self.actualTokens]
+        self.distgrid = _getDistanceGrid(refCodes, actualCodes, band)
         self.wer = (float(self.distgrid[-1][-1])/len(self.refTokens)*100)
         
         i,j = len(self.refTokens), len(self.actualTokens)
         while i!=0 or j!=0:
-            decision = self.editgrid[i][j]
+            if i and j and (self.distgrid[i][j] == self.distgrid[i-1][j-1] 
+                            + (refCodes[i-1] != actualCodes[j-1])):
+                decision = 'g' if refCodes[i-1] == actualCodes[j-1] else 's'
+            elif j and self.distgrid[i][j] == self.distgrid[i][j-1] + 1:
+                decision = 'i'
+            else:
+                decision = 'd'
             if decision != 'i':
                 self.refTokens[i-1].edit = decision
                 i = i-1
@@ -317,41 +450,6 @@ class EditGrid:
                 self.actualTokens[j-1].edit = decision
                 j = j-1
 
-
-    def __createGrids(self):
-        """Creates a distance grid specifying the edit distance between
-        any pairs of prefix of the two strings.
-        
-        """
-        nbColumns = len(self.actualTokens) + 1
-        nbRows = len(self.refTokens) + 1
-        distgrid = [[0 for _ in range(nbColumns)] for _ in range(nbRows)] 
-        editgrid = [['' for _ in range(nbColumns)] for _ in range(nbRows)] 
-        
-        for i in range(1,nbColumns):
-            distgrid[0][i] = distgrid[0][i-1] + 1        
-            editgrid[0][i] = 'i'
-           
-        for i in range(1,nbRows):
-            refToken = self.refTokens[i-1]
-            distgrid[i][0] = distgrid[i-1][0] + 1
-            editgrid[i][0] = 'd'
-               
-            for j in range(1, nbColumns):
-                actualToken = self.actualTokens[j-1]
-                equalToken = refToken==actualToken       
-                
-                insert_dist = distgrid[i-1][j] + 1
-                delete_dist = distgrid[i][j-1] + 1
-                substitute_dist = distgrid[i-1][j-1] + (not equalToken)
-                distance = min(insert_dist, delete_dist, substitute_dist) 
-                distgrid[i][j] = distance  
-                if distance == substitute_dist:
-                    editgrid[i][j] = 'g' if equalToken else 's'
-                else:
-                    editgrid[i][j] = 'i' if distance == delete_dist else 'd'
-        
-        return distgrid,editgrid
                
     def __str__(self):
         """Returns the edit distance table.
@@ -366,6 +464,52 @@ class EditGrid:
         return result
         
 
+def _getDistanceGrid(refCodes, actualCodes, band=None):
+    """Returns the grid (as a list of lists) of edit distances between any pair
+    of prefixes of the two sequences of integer-encoded tokens.  If band is 
+    provided, the cells further away from the diagonal are set to a maximum 
+    distance.
+    
+    """
+    nbRows, nbColumns = len(refCodes) + 1, len(actualCodes) + 1
+    maxDist = nbRows + nbColumns
+    if band is not None:
+        band = max(band, abs(nbRows - nbColumns))
+    
+    if numpy is not None:
+        actual = numpy.array(actualCodes, dtype=numpy.int64)
+        columns = numpy.arange(nbColumns)
+        grid = numpy.empty((nbRows, nbColumns), dtype=numpy.int64)
+        grid[0] = columns
+        for i in range(1, nbRows):
+            row = numpy.empty(nbColumns, dtype=numpy.int64)
+            row[0] = i
+            row[1:] = numpy.minimum(grid[i-1,1:] + 1, grid[i-1,:-1] + (actual != refCodes[i-1]))
+            outside = numpy.abs(columns - i) > band if band is not None else None
+            if outside is not None:
+                row[outside] = maxDist
+            # insertions: row[j] = min over k <= j of row[k] + (j - k)
+            row = numpy.minimum(numpy.minimum.accumulate(row - columns) + columns, maxDist)
+            if outside is not None:
+                row[outside] = maxDist
+            grid[i] = row
+        if band is not None:
+            grid[0][columns > band] = maxDist
+        return grid.tolist()
+    
+    grid = [range(0, nbColumns)]
+    for i in range(1, nbRows):
+        previous = grid[i-1]
+        refCode = refCodes[i-1]
+        row = [i if band is None or i <= band else maxDist] + [maxDist]*(nbColumns-1)
+        first, last = (1, nbColumns) if band is None else (max(1, i-band), min(nbColumns, i+band+1))
+        for j in range(first, last):
+            row[j] = min(previous[j] + 1, row[j-1] + 1, 
+                         previous[j-1] + (actualCodes[j-1] != refCode))
+        grid.append(row)
+    if band is not None:
+        grid[0] = [j if j <= band else maxDist for j in range(0, nbColumns)]
+    return grid
  
 
 class EditToken:
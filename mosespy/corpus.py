@@ -35,11 +35,15 @@ __author__ = 'Pierre Lison (plison@ifi.uio.no)'
 __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
-import re
+import os, sys, re, shutil, itertools, collections, hashlib, struct, threading
 import mosespy.system as system
 import mosespy.install as install
+import mosespy.scoring as scoring
 from mosespy.system import Path
 
+# Lock for the eviction of cache entries (shared by all caches of the process)
+_cacheLock = threading.Lock()
+
 
 class BasicCorpus(Path):
     """A basic, monolingual corpus, composed of a sequence of lines.
@@ -62,7 +66,7 @@ class BasicCorpus(Path):
          
         """
         if self.exists():
-            for l in self.readlines():
+            for l in self.iterlines():
                 print l
         else:
             raise RuntimeError(self + " not an existing file")
@@ -80,9 +84,8 @@ class BasicCorpus(Path):
         
         """
         occurrences = {} 
-        corpusLines = self.readlines()
-        for i in range(0, len(corpusLines)):
-            corpusLine = corpusLines[i].strip()
+        for i, corpusLine in enumerate(self.iterlines()):
+            corpusLine = corpusLine.strip()
             if corpusLine not in occurrences:
                 occurrences[corpusLine] = set()
             occurrences[corpusLine].add(i)
@@ -103,13 +106,33 @@ class BasicCorpus(Path):
         """
         
         histories = {}
-        corpusLines = self.readlines()
-        originLines = [originLine.strip("\n") for originLine in corpusLines]
-        
-        for i in range(0, len(corpusLines)):
-            histories[i] = originLines[max(0,i-historyWindow):max(0,i)]
+        window = collections.deque(maxlen=historyWindow)
+        for i, corpusLine in enumerate(self.iterlines()):
+            histories[i] = list(window)
+            window.append(corpusLine.strip("\n"))
  
         return histories
+    
+    
+    def getByteRanges(self, nbRanges):
+        """Divides the corpus file into (at most) nbRanges contiguous byte 
+        ranges of similar size, where each range starts and ends on a line 
+        boundary.  Returns the list of (start, end) offsets.
+        
+        """
+        size = self.getSize()
+        offsets = [0]
+        with open(self, 'rb') as corpusD:
+            for i in range(1, nbRanges):
+                target = size*i/nbRanges
+                if target <= offsets[-1]:
+                    continue
+                corpusD.seek(target-1)
+                corpusD.readline()
+                if offsets[-1] < corpusD.tell() < size:
+                    offsets.append(corpusD.tell())
+        offsets.append(size)
+        return zip(offsets[:-1], offsets[1:])
 
 
 class AlignedPair():
@@ -198,6 +221,24 @@ class AlignedCorpus(object):
         self.targetCorpus.remove()
         
     
+    def iterlines(self):
+        """Iterates over the (source line, target line) pairs of the corpus,
+        without loading the corpus in memory.
+        
+        """
+        return itertools.izip(self.getSourceCorpus().iterlines(), 
+                              self.getTargetCorpus().iterlines())
+    
+    
+    def iterAlignments(self):
+        """Iterates over the alignment objects of the corpus (cf. getAlignments)
+        without loading the corpus in memory.
+        
+        """
+        for sourceLine, targetLine in self.iterlines():
+            yield AlignedPair(sourceLine.strip(), targetLine.strip())
+            
+    
     def getAlignments(self): 
         """Returns a list of alignment objects (of length corresponding
         to the number of lines in the corpus), where each alignment
@@ -206,15 +247,7 @@ class AlignedCorpus(object):
         sentence.
         
         """
-        sourceLines = self.getSourceCorpus().readlines()
-        targetLines = self.getTargetCorpus().readlines()      
-            
-        alignments = []
-        for i in range(0, len(sourceLines)):
-            pair = AlignedPair(sourceLines[i].strip(),targetLines[i].strip())
-            alignments.append(pair)
-                 
-        return alignments
+        return list(self.iterAlignments())
 
 
 
@@ -326,26 +359,198 @@ class ReferenceCorpus(object):
         - generateEdits whether to generate the edit grids for the alignments
         
         """
-        sourceLines = self.getSourceCorpus().readlines()
+        return list(self.iterAlignments())
+    
+    
+    def iterlines(self):
+        """Iterates over the tuples (source line, reference line(s), translation 
+        line) of the corpus, without loading the corpus in memory.  The 
+        translation line is None if the corpus has no translation.
+        
+        """
+        refIterators = [refCorpus.iterlines() for refCorpus in self.refCorpora]
+        transIterator = (self.translation.iterlines() if self.translation 
+                         else itertools.repeat(None))
+        for sourceLine, transLine in itertools.izip(self.sourceCorpus.iterlines(), 
+                                                    transIterator):
+            yield sourceLine, [refIterator.next() for refIterator in refIterators], transLine
         
-        targetLines = []
-        for refCorpus in self.refCorpora:
-            targetLines.append(refCorpus.readlines())    
-            
-        translationLines = self.translation.readlines() if self.translation else None
-        alignments = []
-        for i in range(0, len(sourceLines)):
-            targets = [targetLine[i].strip() for targetLine in targetLines]
-            pair = AlignedReference(sourceLines[i].strip(), targets)
-            if translationLines:
-                actual = translationLines[i].strip()
-                pair.addTranslation(actual)                         
-            alignments.append(pair)
-                                     
-        return alignments             
+    
+    def iterAlignments(self):
+        """Iterates over the alignment objects of the corpus (cf. getAlignments)
+        without loading the corpus in memory.
+        
+        """
+        for sourceLine, targetLines, transLine in self.iterlines():
+            pair = AlignedReference(sourceLine.strip(), [t.strip() for t in targetLines])
+            if transLine is not None:
+                pair.addTranslation(transLine.strip())
+            yield pair
 
 
  
+class FingerprintIndex(object):
+    """Index of 64-bit fingerprints for the lines of one or more corpora, where 
+    each fingerprint covers a line together with its preceding window of lines.
+    The index is used to detect occurrences of (development or test) sentences 
+    within other corpora, such as language model data, in a single streaming
+    pass over these corpora.
+    
+    """
+    
+    def __init__(self, historyWindow=3):
+        """Creates a new, empty index.
+        
+        Args:
+            historyWindow (int): the number of preceding lines covered by the 
+                fingerprints (lines at the start of a corpus have shorter 
+                histories).
+        
+        """
+        self.historyWindow = historyWindow
+        self.fingerprints = set()
+        self.historyLengths = set()
+        
+    
+    def addCorpus(self, corpus):
+        """Adds the fingerprints of all lines in the corpus to the index.
+        
+        """
+        for fingerprints in self._iterFingerprints(corpus):
+            self.fingerprints.add(fingerprints[-1])
+            self.historyLengths.add(len(fingerprints)-1)
+        
+        
+    def contains(self, fingerprints):
+        """Returns True if one of the fingerprints (computed for the successive 
+        history lengths of a line, cf. _iterFingerprints) is in the index.
+        
+        """
+        for historyLength in self.historyLengths:
+            if (historyLength < len(fingerprints) 
+                and fingerprints[historyLength] in self.fingerprints):
+                return True
+        return False
+    
+    
+    def filterCorpus(self, corpus, outputFile):
+        """Writes in outputFile the lines of the corpus that are not in the index
+        (with the same history), and returns the number of filtered lines.
+        
+        """
+        nbSkipped = 0
+        with open(outputFile, 'w', 1000000) as outputD:
+            for line, fingerprints in itertools.izip(corpus.iterlines(), 
+                                                     self._iterFingerprints(corpus)):
+                if self.contains(fingerprints):
+                    nbSkipped += 1
+                else:
+                    outputD.write(line.strip() + "\n")
+        return nbSkipped
+    
+    
+    def _iterFingerprints(self, corpus):
+        """Iterates over the lines of the corpus, and yields for each line the list
+        of fingerprints covering the line and its k preceding lines, for k = 0 up to 
+        the available history (at most historyWindow lines).
+        
+        """
+        window = collections.deque(maxlen=self.historyWindow+1)
+        for line in corpus.iterlines():
+            digest = hashlib.md5(line.strip()).digest()
+            window.appendleft(struct.unpack("<Q", digest[:8])[0])
+            fingerprints = []
+            fingerprint = 0
+            for k, lineHash in enumerate(window):
+                fingerprint = (fingerprint * 0x100000001b3 + lineHash + k) & 0xffffffffffffffff
+                fingerprints.append(fingerprint)
+            yield fingerprints
+            
+    
+    
+class PreprocessingCache(object):
+    """Content-addressed cache of preprocessed corpora, shared across 
+    experiments.  Each entry is identified by the hash of the input file, 
+    its language, the chain of processing steps, the Moses installation and
+    (if relevant) the hash of the truecasing model.  The total size of the 
+    cache is bounded, and the least recently used entries are evicted first.
+    
+    """
+    
+    def __init__(self, cacheDir, maxSize=20*1024**3):
+        """Creates a cache stored in the given directory.
+        
+        Args:
+            cacheDir (str): directory in which to store the cached files
+            maxSize (int): maximum size of the cache (in bytes)
+        
+        """
+        self.cacheDir = Path(cacheDir)
+        self.maxSize = maxSize
+        if not self.cacheDir.exists():
+            os.makedirs(self.cacheDir)
+    
+    
+    def getKey(self, inputFile, lang, steps, modelFile=None):
+        """Returns the cache key for the input file processed with the given 
+        steps (and truecasing model, if any).
+        
+        """
+        keyParts = [Path(inputFile).getHash(), lang, ",".join(steps), install.moses_root,
+                    Path(modelFile).getHash() if modelFile else ""]
+        return hashlib.sha1("\n".join(keyParts)).hexdigest()
+    
+    
+    def get(self, key, outputFile):
+        """Copies the cached file for the key into outputFile. Returns True if
+        the key was found in the cache, and False otherwise.
+        
+        """
+        cachedFile = self.cacheDir + "/" + key
+        try:
+            os.utime(cachedFile, None)
+            shutil.copyfile(cachedFile, outputFile + ".tmp")
+        except (IOError, OSError):
+            return False
+        os.rename(outputFile + ".tmp", outputFile)
+        return True
+        
+    
+    def put(self, key, inputFile):
+        """Adds a copy of the file to the cache under the given key, and evicts 
+        the least recently used entries if the cache exceeds its maximum size.
+        The cache directory may be shared with other experiments or processes,
+        so entries may disappear at any time, and files still being written 
+        (*.tmp) are left untouched.
+        
+        """
+        cachedFile = self.cacheDir + "/" + key
+        tmpFile = cachedFile + ".%i-%i.tmp"%(os.getpid(), threading.current_thread().ident)
+        shutil.copyfile(inputFile, tmpFile)
+        os.rename(tmpFile, cachedFile)
+        with _cacheLock:
+            entries = []
+            for entry in os.listdir(self.cacheDir):
+                if entry.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(self.cacheDir + "/" + entry)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            totalSize = sum([size for _, size, _ in entries])
+            for _, size, entry in sorted(entries):
+                if totalSize <= self.maxSize:
+                    break
+                if entry != key:
+                    try:
+                        os.remove(self.cacheDir + "/" + entry)
+                    except OSError:
+                        pass
+                    totalSize -= size
+
+    
+
 class CorpusProcessor():
     """Processor for various types of corpus data.  The processor
     is used to tokenise, detokenise, truecase, clean, and split
@@ -353,19 +558,34 @@ class CorpusProcessor():
     
     """
     
-    def __init__(self, workPath, executor=None, nbThreads=2):
+    def __init__(self, workPath, executor=None, nbThreads=2, persistent=False, 
+                 pipelined=False, nbShards=1, cache=None):
         """Creates a new processor.
         
         Args:
             workPath (str): directory in which to store intermediate files
             executor: executor for the processing commands
             nbThreads (int): number of threads to employ
+            persistent (bool): whether to process texts (cf. processText and 
+                revertText) through long-lived co-processes instead of 
+                starting new processes for each call.
+            pipelined (bool): whether to chain the normalisation, tokenisation
+                and truecasing of corpora through pipes instead of writing
+                intermediate files.
+            nbShards (int): number of shards (byte ranges) in which to divide
+                the corpora for parallel processing (implies pipelined mode).
+                The shards are processed through the run_parallel method of the
+                executor, and may therefore be distributed on SLURM nodes.
+            cache (PreprocessingCache): cache of preprocessed corpora (if any).
         
         """
         self.workPath = Path(workPath)
         self.executor = executor if executor else system.ShellExecutor()
-        self.tokeniser = Tokeniser(self.executor, nbThreads)
-        self.truecaser = TrueCaser(self.executor, workPath+"/truecasingmodel")
+        self.pipelined = pipelined or nbShards > 1
+        self.nbShards = nbShards
+        self.cache = cache
+        self.tokeniser = Tokeniser(self.executor, nbThreads, persistent)
+        self.truecaser = TrueCaser(self.executor, workPath+"/truecasingmodel", persistent)
         
         
     def processAlignedCorpus(self, corpus, maxLength=80):
@@ -381,14 +601,13 @@ class CorpusProcessor():
         """
         
         if isinstance(corpus,AlignedCorpus):
-            trueSource = self.processCorpus(corpus.getSourceCorpus())
-            self.processCorpus(corpus.getTargetCorpus())
+            trueSource = self.processCorpora([corpus.getSourceCorpus(), 
+                                              corpus.getTargetCorpus()])[0]
             trueCorpus = AlignedCorpus(trueSource.getStem(), corpus.sourceLang, corpus.targetLang)
         
         elif isinstance(corpus,ReferenceCorpus):
-            trueSource = self.processCorpus(corpus.getSourceCorpus())
-            for refCorpus in corpus.getReferenceCorpora():
-                self.processCorpus(refCorpus)    
+            trueSource = self.processCorpora([corpus.getSourceCorpus()] 
+                                             + corpus.getReferenceCorpora())[0]
             trueCorpus = ReferenceCorpus(trueSource.getStem(), corpus.sourceLang, corpus.targetLang)
                  
         else:
@@ -404,6 +623,99 @@ class CorpusProcessor():
             return trueCorpus
 
 
+    def processCorpora(self, rawCorpora):
+        """Process a list of basic corpora concurrently (each in a separate
+        thread), and returns the list of truecased corpora.  The truecasing
+        model for each language is first trained on the first corpus in that
+        language, such that the model does not depend on the order in which 
+        the threads are scheduled.
+        
+        """
+        if len(rawCorpora) == 1:
+            return [self.processCorpus(rawCorpora[0])]
+        firstCorpora = []
+        langs = set()
+        for rawCorpus in rawCorpora:
+            if Path(rawCorpus).getLang() not in langs:
+                langs.add(Path(rawCorpus).getLang())
+                firstCorpora.append(rawCorpus)
+        self.trainTruecasingModels(firstCorpora)
+        return self._processConcurrently(self.processCorpus, rawCorpora)
+    
+    
+    def trainTruecasingModels(self, rawCorpora):
+        """Trains the truecasing models for the languages of the basic corpora
+        (one corpus per language) concurrently, such that the models do not 
+        depend on which corpus is processed first.  Returns the list of 
+        booleans indicating whether each model was trained.
+        
+        """
+        return self._processConcurrently(self.trainTruecasingModel, rawCorpora)
+    
+    
+    def trainTruecasingModel(self, rawCorpus):
+        """Trains the truecasing model for the language of the basic corpus, 
+        unless the model already exists or can be restored from the cache.  The
+        corpus is normalised and tokenised in a temporary file for the training.
+        Returns True if the model was trained.
+        
+        """
+        if not isinstance(rawCorpus, BasicCorpus):
+            rawCorpus = BasicCorpus(rawCorpus)
+        lang = rawCorpus.getLang()
+        if self.truecaser.isModelTrained(lang):
+            return False
+        modelKey = self._getCacheKeys(rawCorpus)[0] if self.cache else None
+        if modelKey and self.cache.get(modelKey, self.truecaser.getModelFile(lang)):
+            print "Truecasing model for %s restored from cache"%(lang)
+            return False
+        
+        if rawCorpus.isTokenised():
+            isModelNew = self.truecaser.trainModel(rawCorpus, onlyIfMissing=True)
+        else:
+            normFile = self.workPath + "/" + rawCorpus.basename().addFlag("norm")
+            tokFile = normFile.changeFlag("tok")
+            if self.pipelined:
+                scripts = [self.tokeniser.getNormaliseScript(lang), 
+                           self.tokeniser.getTokeniseScript(lang)]
+                if not self._runPipeline(scripts, rawCorpus, tokFile):
+                    raise RuntimeError("Tokenisation of %s has failed"%(rawCorpus))
+            else:
+                self.tokeniser.normaliseFile(rawCorpus, normFile)
+                self.tokeniser.tokeniseFile(normFile, tokFile)
+                normFile.remove()
+            isModelNew = self.truecaser.trainModel(tokFile, onlyIfMissing=True)
+            tokFile.remove()
+        
+        if isModelNew and modelKey:
+            self.cache.put(modelKey, self.truecaser.getModelFile(lang))
+        return isModelNew
+    
+    
+    def _processConcurrently(self, function, rawCorpora):
+        """Applies the function on each corpus in a separate thread, and returns
+        the list of results.  The first error raised in a thread is re-raised
+        with its original traceback.
+        
+        """
+        results = [None]*len(rawCorpora)
+        errors = []
+        def processCorpus(i):
+            try:
+                results[i] = function(rawCorpora[i])
+            except Exception:
+                errors.append(sys.exc_info())
+        threads = [threading.Thread(target=processCorpus, args=(i,)) 
+                   for i in range(0, len(rawCorpora))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return results
+    
+    
     def processCorpus(self, rawCorpus):
         """Process a basic corpus by normalising, tokenising and
         truecasing it.  Intermediary files are deleted, and the final
@@ -413,6 +725,27 @@ class CorpusProcessor():
         if not isinstance(rawCorpus, BasicCorpus):
             rawCorpus = BasicCorpus(rawCorpus)
         
+        if self.cache:
+            trueCorpus = self._getCachedCorpus(rawCorpus)
+            if trueCorpus:
+                return trueCorpus
+        
+        if not rawCorpus.isTokenised() and self.pipelined:
+            trueCorpus, isModelNew = self._processCorpusPipeline(rawCorpus)
+        else:
+            trueCorpus, isModelNew = self._processCorpusSteps(rawCorpus)
+        
+        if self.cache:
+            self._addToCache(rawCorpus, trueCorpus, isModelNew)
+        return trueCorpus
+    
+    
+    def _processCorpusSteps(self, rawCorpus):
+        """Process a basic corpus by normalising, tokenising and truecasing it
+        step by step.  Returns the truecased corpus and whether the truecasing 
+        model was trained on this corpus.
+        
+        """
         # STEP 1: tokenisation
         isTokenised = rawCorpus.isTokenised()
         if not isTokenised:
@@ -428,8 +761,7 @@ class CorpusProcessor():
             
         
         # STEP 2: train truecaser if not already existing
-        if not self.truecaser.isModelTrained(rawCorpus.getLang()):
-            self.truecaser.trainModel(tokFile)
+        isModelNew = self.truecaser.trainModel(tokFile, onlyIfMissing=True)
             
         # STEP 3: truecasing      
         self.truecaser.truecaseFile(tokFile, trueFile) 
@@ -437,7 +769,120 @@ class CorpusProcessor():
         if not isTokenised:
             tokFile.remove()
       
-        return BasicCorpus(trueFile)
+        return BasicCorpus(trueFile), isModelNew
+    
+    
+    def _processCorpusPipeline(self, rawCorpus):
+        """Process a basic corpus by chaining its normalisation, tokenisation
+        and truecasing through pipes, such that the corpus is read and written
+        only once.  If the truecasing model is not yet trained, the tokenised
+        corpus is first written to train the model.  Returns the truecased 
+        corpus and whether the truecasing model was trained on this corpus.
+        
+        """
+        lang = rawCorpus.getLang()
+        tokFile = self.workPath + "/" + rawCorpus.basename().addFlag("norm").changeFlag("tok")
+        trueFile = tokFile.changeFlag("true")
+        scripts = [self.tokeniser.getNormaliseScript(lang), self.tokeniser.getTokeniseScript(lang)]
+        
+        isModelNew = False
+        if self.truecaser.isModelTrained(lang):
+            print "Start normalisation, tokenisation and truecasing of \"" + rawCorpus + "\""
+            scripts.append(self.truecaser.getTruecaseScript(lang))
+            if not self._runPipeline(scripts, rawCorpus, trueFile):
+                raise RuntimeError("Processing of %s has failed"%(rawCorpus))
+        else:
+            print "Start normalisation and tokenisation of \"" + rawCorpus + "\""
+            if not self._runPipeline(scripts, rawCorpus, tokFile):
+                raise RuntimeError("Tokenisation of %s has failed"%(rawCorpus))
+            isModelNew = self.truecaser.trainModel(tokFile, onlyIfMissing=True)
+            if not self._runPipeline([self.truecaser.getTruecaseScript(lang)], 
+                                     BasicCorpus(tokFile), trueFile):
+                raise RuntimeError("Truecasing of %s has failed"%(tokFile))
+            tokFile.remove()
+        
+        print "New truecased file: " + trueFile.getDescription()
+        return BasicCorpus(trueFile), isModelNew
+    
+    
+    def _getCacheKeys(self, rawCorpus):
+        """Returns the cache keys for the truecasing model trained on the corpus
+        and for the processed corpus (None if no truecasing model is present).
+        
+        """
+        lang = rawCorpus.getLang()
+        steps = ["truecase"] if rawCorpus.isTokenised() else ["normalise", "tokenise", "truecase"]
+        modelKey = self.cache.getKey(rawCorpus, lang, steps[:-1] + ["train-truecaser"])
+        corpusKey = None
+        if self.truecaser.isModelTrained(lang):
+            corpusKey = self.cache.getKey(rawCorpus, lang, steps, self.truecaser.getModelFile(lang))
+        return modelKey, corpusKey
+    
+    
+    def _getCachedCorpus(self, rawCorpus):
+        """Returns the processed corpus from the cache, if available.  If the
+        truecasing model is not yet trained, the method first tries to restore
+        the model trained on the same corpus.  Returns None if the corpus is not
+        in the cache.
+        
+        """
+        lang = rawCorpus.getLang()
+        modelKey, corpusKey = self._getCacheKeys(rawCorpus)
+        if not corpusKey and self.cache.get(modelKey, self.truecaser.getModelFile(lang)):
+            print "Truecasing model for %s restored from cache"%(lang)
+            modelKey, corpusKey = self._getCacheKeys(rawCorpus)
+        
+        if rawCorpus.isTokenised():
+            trueFile = self.workPath + "/" + rawCorpus.basename().addFlag("true")
+        else:
+            trueFile = (self.workPath + "/" + rawCorpus.basename().addFlag("norm")
+                        .changeFlag("tok").changeFlag("true"))
+        if corpusKey and self.cache.get(corpusKey, trueFile):
+            print "Processed corpus restored from cache: " + trueFile.getDescription()
+            return BasicCorpus(trueFile)
+        return None
+    
+    
+    def _addToCache(self, rawCorpus, trueCorpus, isModelNew):
+        """Adds the processed corpus (and the truecasing model, if it was trained
+        on this corpus) to the cache.
+        
+        """
+        modelKey, corpusKey = self._getCacheKeys(rawCorpus)
+        if isModelNew:
+            self.cache.put(modelKey, self.truecaser.getModelFile(rawCorpus.getLang()))
+        self.cache.put(corpusKey, trueCorpus)
+    
+    
+    def _runPipeline(self, scripts, inputFile, outputFile):
+        """Runs the scripts chained through pipes on the input corpus, and
+        writes the result in outputFile.  If the processor is configured with
+        several shards, the corpus is divided into byte ranges aligned on line
+        boundaries, and each range is processed in parallel.  The outputs of 
+        the shards are then concatenated in order.
+        
+        """
+        byteRanges = inputFile.getByteRanges(self.nbShards) if self.nbShards > 1 else []
+        if len(byteRanges) <= 1:
+            return self.executor.run_pipeline(scripts, inputFile, outputFile)
+        
+        shardScripts = []
+        shardFiles = []
+        for i, (start, end) in enumerate(byteRanges):
+            readScripts = ["tail -c +%i %s"%(start+1, inputFile), "head -c %i"%(end-start)]
+            shardScripts.append(system.getPipelineScript(readScripts + scripts))
+            shardFiles.append(Path(outputFile + ".shard%i"%i))
+        result = self.executor.run_parallel(shardScripts, stdouts=shardFiles,
+                                            maxConcurrency=self.nbShards)
+        if result:
+            with open(outputFile, 'wb') as outputD:
+                for shardFile in shardFiles:
+                    with open(shardFile, 'rb') as shardD:
+                        shutil.copyfileobj(shardD, outputD)
+        for shardFile in shardFiles:
+            if shardFile.exists():
+                shardFile.remove()
+        return result
     
     
     def processText(self, text, lang):
@@ -475,12 +920,19 @@ class CorpusProcessor():
             processedCorpus = BasicCorpus(processedCorpus)
                         
         untokFile = self.workPath + "/" + processedCorpus.basename().changeFlag("detok") 
-        self.tokeniser.detokeniseFile(processedCorpus,untokFile)
-         
         finalFile = untokFile.changeFlag("read")
+        
+        # the reverted corpus is reused if its input file is unchanged
+        keyFile = Path(finalFile + ".key")
+        key = "%s\t%s\t%i"%(processedCorpus.getAbsolute(), 
+                             os.path.getmtime(processedCorpus), processedCorpus.getSize())
+        if finalFile.exists() and keyFile.exists() and keyFile.read() == key:
+            return BasicCorpus(finalFile)
+        
+        self.tokeniser.detokeniseFile(processedCorpus,untokFile)
         self.tokeniser.deescapeFile(untokFile, finalFile)
-    
         untokFile.remove()
+        keyFile.write(key)
      
         return BasicCorpus(finalFile)
     
@@ -495,41 +947,35 @@ class CorpusProcessor():
         return finalText        
     
     
-
-    def filterOutLines(self, corpusFile, toRemoveFile):
-        """Filters out sentences from the corpus represented by toRemoveFile
-        from the corpus in fullCorpusFile.  This method is used to prune 
-        language model data from development and test sentences.
+    def close(self):
+        """Terminates the co-processes employed by the processor (if any).
         
         """
+        self.tokeniser.close()
+        self.truecaser.close()
     
-        print "Filtering out file " + str(toRemoveFile) + " from " + str(corpusFile)
-        toRemoveCorpus = BasicCorpus(toRemoveFile)
-        occurrences = toRemoveCorpus.getOccurrences()
-        histories = toRemoveCorpus.getHistories()
     
-        filteredLines = []
-        inputLines = corpusFile.readlines()
-        for i in range(3, len(inputLines)):
-            l = inputLines[i].strip()
-            toSkip = False
-            if l in occurrences:
-                for index in occurrences[l]:
-                    history = histories[index]
-                    if history == [iline.strip("\n") for iline in inputLines[i-len(history):i]]:
-                        toSkip = True
-                        break
-            if not toSkip:
-                filteredLines.append(l+"\n")
-                 
-        outputFile = self.workPath + "/" + corpusFile.basename().changeFlag("filtered") 
-        outputFile.writelines(filteredLines)                                           
+
+    def filterOutLines(self, corpusFile, *toRemoveFiles):
+        """Filters out sentences from the corpora represented by toRemoveFiles
+        from the corpus in corpusFile.  This method is used to prune 
+        language model data from development and test sentences. A line
+        is filtered out if it occurs in one of the toRemoveFiles with the 
+        same preceding lines.
+        
+        """
+        print ("Filtering out file(s) " + ", ".join([str(f) for f in toRemoveFiles]) 
+               + " from " + str(corpusFile))
+        index = FingerprintIndex()
+        for toRemoveFile in toRemoveFiles:
+            index.addCorpus(BasicCorpus(toRemoveFile))
     
-        print "Number of skipped lines: " + str((len(inputLines)-len(filteredLines)))
+        outputFile = self.workPath + "/" + corpusFile.basename().changeFlag("filtered") 
+        nbSkipped = index.filterCorpus(BasicCorpus(corpusFile), outputFile)                                         
+        print "Number of skipped lines: " + str(nbSkipped)
         return BasicCorpus(outputFile)
 
 
-
    
     def cutCorpus(self, inputCorpus, outputStem, maxLength):
         """Cleans the corpus by pruning out sentences with a length
@@ -556,19 +1002,21 @@ class CorpusProcessor():
   
         
     def getBleuScore(self, translatedCorpus):
-        """Returns the BLEU score for the translated corpus.
+        """Returns the (lowercased) BLEU score for the translated corpus, along 
+        with a description of the score in the format of multi-bleu.perl.
         
         """
-        bleuScript = (install.moses_root  + "/scripts/generic/multi-bleu.perl -lc " 
-                      + translatedCorpus.getStem()+"."+ translatedCorpus.targetLang)
-        translation = translatedCorpus.getTranslationCorpus()
-        bleu_output = self.executor.run_output(bleuScript, stdin=translation)       
-        s = re.search(r"=\s(([0-9,\.])+)\,", bleu_output)
-        if s:
-            bleu = float(s.group(1))
-            return bleu, bleu_output
-        else:
-            raise RuntimeError("BLEU score could not be extracted")
+        stats = scoring.getStatistics(translatedCorpus)
+        return stats.bleu(), stats.describeBLEU()
+    
+    
+    def getScores(self, translatedCorpus):
+        """Returns a dictionary with the BLEU, chrF and TER scores for the 
+        translated corpus.
+        
+        """
+        stats = scoring.getStatistics(translatedCorpus)
+        return {"BLEU":stats.bleu(), "chrF":stats.chrF(), "TER":stats.ter()}
           
     
     def splitData(self, corpus, nbSplits, outputDir=None):
@@ -593,13 +1041,12 @@ class CorpusProcessor():
         
         elif isinstance(corpus, BasicCorpus):
               
-            lines = corpus.readlines()
             if corpus.getLang():
                 extension = "." + corpus.getLang()
             else:
                 extension = ""
                 
-            totalLines = len(lines) 
+            totalLines = max(1, corpus.countNbLines())
             nbSplits = min(nbSplits, totalLines)
             filenames = []
             curSplit = 0
@@ -607,7 +1054,7 @@ class CorpusProcessor():
             filenames.append(filename)
             curFile = open(filename, 'w')
             nbLines = 0
-            for l in lines:
+            for l in corpus.iterlines():
                 if nbLines >= (totalLines / nbSplits) and curSplit < nbSplits -1:
                     nbLines = 0
                     curFile.close()
@@ -629,13 +1076,17 @@ class Tokeniser():
     """Tokeniser component for processing corpora.
     
     """
-    def __init__(self, executor, nbThreads=2):
+    def __init__(self, executor, nbThreads=2, persistent=False):
         """Creates a new tokeniser based on the provided executor and number
-        of threads.
+        of threads.  If persistent is set to True, the text-level methods
+        (tokenise, detokenise and deescape) rely on long-lived co-processes 
+        that are reused across calls.
         
         """
         self.executor = executor
         self.nbThreads = nbThreads
+        self.persistent = persistent
+        self.coprocesses = {}
      
     def normaliseFile(self, inputFile, outputFile):
         """Normalises the punctuation of the file and write the output in
@@ -646,9 +1097,7 @@ class Tokeniser():
         if not inputFile.exists():
             raise IOError("raw file " + inputFile + " does not exist")
                         
-        cleanScript = (install.moses_root + "/scripts/tokenizer" 
-                       +"/normalize-punctuation.perl " + lang)
-        result = self.executor.run(cleanScript, inputFile, outputFile)
+        result = self.executor.run(self.getNormaliseScript(lang), inputFile, outputFile)
         if not result:
             raise RuntimeError("Normalisation of %s has failed"%(inputFile))
 
@@ -664,9 +1113,7 @@ class Tokeniser():
             raise IOError("raw file " + inputFile + " does not exist")
                         
         print "Start tokenisation of file \"" + inputFile + "\""
-        tokScript = (install.moses_root + "/scripts/tokenizer/tokenizer.perl" 
-                     + " -l " + lang + " -threads " + str(self.nbThreads))
-        result = self.executor.run(tokScript, inputFile, outputFile)
+        result = self.executor.run(self.getTokeniseScript(lang), inputFile, outputFile)
         if not result:
             raise RuntimeError("Tokenisation of %s has failed"%(inputFile))
 
@@ -675,6 +1122,23 @@ class Tokeniser():
         return outputFile
     
     
+    def getNormaliseScript(self, lang):
+        """Returns the command for normalising the punctuation of a text in 
+        the given language.
+        
+        """
+        return (install.moses_root + "/scripts/tokenizer" 
+                +"/normalize-punctuation.perl " + lang)
+    
+    
+    def getTokeniseScript(self, lang):
+        """Returns the command for tokenising a text in the given language.
+        
+        """
+        return (install.moses_root + "/scripts/tokenizer/tokenizer.perl" 
+                + " -l " + lang + " -threads " + str(self.nbThreads))
+        
+    
     def tokenise(self, inputText, lang):
         """Tokenises the text (for the given language) and returns the
         output.
@@ -682,6 +1146,8 @@ class Tokeniser():
         """
         tokScript = (install.moses_root + "/scripts/tokenizer"
                      + "/tokenizer.perl" + " -l " + lang)
+        if self.persistent:
+            return self._getCoProcess(tokScript + " -b").process(inputText).strip()
         return self.executor.run_output(tokScript, stdin=inputText)
     
 
@@ -709,6 +1175,8 @@ class Tokeniser():
         """
         tokScript = (install.moses_root + "/scripts/tokenizer" 
                      + "/detokenizer.perl" + " -l " + lang)
+        if self.persistent:
+            return self._getCoProcess(tokScript + " -b").process(inputText).strip()
         return self.executor.run_output(tokScript, stdin=inputText)
   
 
@@ -729,44 +1197,86 @@ class Tokeniser():
     
     def deescape(self, inputText):   
         """Deescapes special characters in the text and returns the result.
+        In persistent mode, the substitutions of deescape-special-chars.perl
+        are applied directly in Python (the Perl script cannot be unbuffered).
         
         """             
+        if self.persistent:
+            return _deescape(inputText).strip()
         deescapeScript = (install.moses_root + "/scripts/tokenizer"
                           + "/deescape-special-chars.perl ")
         return self.executor.run_output(deescapeScript, inputText)
 
 
+    def close(self):
+        """Terminates the co-processes started by the tokeniser (if any).
+        
+        """
+        for coprocess in self.coprocesses.values():
+            coprocess.close()
+        self.coprocesses = {}
+        
+    
+    def _getCoProcess(self, script):
+        """Returns the co-process running the script, creating it if necessary.
+        
+        """
+        if script not in self.coprocesses:
+            self.coprocesses[script] = system.CoProcess(script)
+        return self.coprocesses[script]
+
+
 
 class TrueCaser():
     """Truecaser to process corpora content.
     
     """
     
-    def __init__(self, executor, modelStem):
+    def __init__(self, executor, modelStem, persistent=False):
         """Creates a new truecaser with the following executor, and stem for model
-        files.
+        files.  If persistent is set to True, text-level truecasing relies on 
+        long-lived co-processes (one per language) that are reused across calls.
         
         """
         self.executor = executor
         self.modelStem = Path(modelStem)
+        self.persistent = persistent
+        self.coprocesses = {}
+        self.locks = collections.defaultdict(threading.Lock)
+        self.locksLock = threading.Lock()
                
                
-    def trainModel(self, inputFile):
-        """Trains a truecasing model based on the provided input file.
+    def trainModel(self, inputFile, onlyIfMissing=False):
+        """Trains a truecasing model based on the provided input file.  If 
+        onlyIfMissing is set to True, the model is only trained if no model
+        exists yet for the language.  Concurrent calls for the same language
+        are serialised.  Returns True if the model was trained.
         
         """
         if not inputFile.exists():
             raise IOError("Tokenised file " + inputFile + " does not exist")
         
-        modelFile = self.modelStem + "." + inputFile.getLang()
-        print "Start building truecasing model based on " + inputFile
-        truecaseModelScript = (install.moses_root + "/scripts/recaser/train-truecaser.perl" 
-                               + " --model " + modelFile + " --corpus " + inputFile)
-        result = self.executor.run(truecaseModelScript)
-        if not result:
-            raise RuntimeError("Training of truecasing model with %s has failed"%(inputFile))
-
-        print "New truecasing model: " + modelFile.getDescription()
+        lang = inputFile.getLang()
+        with self.locksLock:
+            lock = self.locks[lang]
+        with lock:
+            if onlyIfMissing and self.isModelTrained(lang):
+                return False
+            modelFile = self.modelStem + "." + lang
+            if lang in self.coprocesses:
+                self.coprocesses.pop(lang).close()
+            print "Start building truecasing model based on " + inputFile
+            # the model is written to a temporary file, such that concurrent
+            # readers never see a partially written model
+            truecaseModelScript = (install.moses_root + "/scripts/recaser/train-truecaser.perl" 
+                                   + " --model " + modelFile + ".tmp --corpus " + inputFile)
+            result = self.executor.run(truecaseModelScript)
+            if not result:
+                raise RuntimeError("Training of truecasing model with %s has failed"%(inputFile))
+            os.rename(modelFile + ".tmp", modelFile)
+    
+            print "New truecasing model: " + modelFile.getDescription()
+            return True
     
     
     def isModelTrained(self, lang):
@@ -774,7 +1284,14 @@ class TrueCaser():
         language, and false otherwise.
         
         """
-        return Path(self.modelStem + "." + lang).exists()
+        return self.getModelFile(lang).exists()
+    
+    
+    def getModelFile(self, lang):
+        """Returns the path to the truecasing model for the language.
+        
+        """
+        return Path(self.modelStem + "." + lang)
         
             
     def truecaseFile(self, inputFile, outputFile):
@@ -788,10 +1305,8 @@ class TrueCaser():
         if not self.isModelTrained(inputFile.getLang()):
             raise RuntimeError("Truecasing model for " + inputFile.getLang()+ " is not yet trained")
     
-        modelFile = Path(self.modelStem + "." + inputFile.getLang())
         print "Start truecasing of file \"" + inputFile + "\""
-        truecaseScript = (install.moses_root + "/scripts/recaser" 
-                          + "/truecase.perl" + " --model " + modelFile)
+        truecaseScript = self.getTruecaseScript(inputFile.getLang())
         result = self.executor.run(truecaseScript, inputFile, outputFile)
         if not result:
             raise RuntimeError("Truecasing of %s has failed"%(inputFile))
@@ -800,6 +1315,15 @@ class TrueCaser():
         return outputFile
     
     
+    def getTruecaseScript(self, lang):
+        """Returns the command for truecasing a text in the given language.
+        
+        """
+        modelFile = Path(self.modelStem + "." + lang)
+        return (install.moses_root + "/scripts/recaser" 
+                + "/truecase.perl" + " --model " + modelFile)
+    
+    
     def truecase(self, inputText, lang):
         """Truecase the text (for the provided language) and returns the result.
         A truecasing model for the input language must be present.
@@ -808,10 +1332,36 @@ class TrueCaser():
         if not self.isModelTrained(lang):
             raise RuntimeError("Truecasing model for " + lang + " is not yet trained")
 
-        modelFile = Path(self.modelStem + "." + lang)
-        truecaseScript = (install.moses_root + "/scripts/recaser"
-                          + "/truecase.perl" + " --model " + modelFile)
+        truecaseScript = self.getTruecaseScript(lang)
+        if self.persistent:
+            if lang not in self.coprocesses:
+                self.coprocesses[lang] = system.CoProcess(truecaseScript + " -b")
+            return self.coprocesses[lang].process(inputText).strip()
         return self.executor.run_output(truecaseScript, stdin=inputText)
+    
+    
+    def close(self):
+        """Terminates the co-processes started by the truecaser (if any).
+        
+        """
+        for coprocess in self.coprocesses.values():
+            coprocess.close()
+        self.coprocesses = {}
+
+
+
+def _deescape(text):
+    """Deescapes special characters in the text, following the substitutions
+    of the Moses script deescape-special-chars.perl.
+    
+    """
+    for escaped, char in [("&bar;", "|"), ("&#124;", "|"), ("&lt;", "<"), 
+                          ("&gt;", ">"), ("&bra;", "["), ("&ket;", "]"), 
+                          ("&quot;", "\""), ("&apos;", "'"), ("&#91;", "["), 
+                          ("&#93;", "]"), ("&amp;", "&")]:
+        text = text.replace(escaped, char)
+    return text
+
  
  
  
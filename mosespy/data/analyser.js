@@ -119,14 +119,16 @@ function getColourContent(xmlTag, tokenised, punctuation) {
 }
 
 function generateTable(conditions) {
+    index = $('#transindex').html();
+    if (index) {
+        generateShardedTable(conditions, JSON.parse(index));
+        return;
+    }
     data = $('#transdata').html();
     xmlDoc = $.parseXML(data);
     $xml = $(xmlDoc);
     incr = 1;
 
-    tokenised = (conditions['tokenised'] == "yes");
-    punctuation = (conditions['punct'] == "yes");
-
     $xml.find("pair").each(function(index) {
 
         if (incr > conditions['tablesize']) {
@@ -135,55 +137,162 @@ function generateTable(conditions) {
         if (isSatisfied($(this), conditions) == false) {
             return true;
         }
+        appendRow($(this), conditions, incr);
+        incr += 1;
+    });
+    $('#nboutputs').text((incr - 1));
+}
 
-        sourceTag = $(this).find('source');
-        sourceText = getContent(sourceTag, tokenised, punctuation);
+function isInShardRange(shard, conditions) {
+    range = (conditions['punct'] == "yes") ? shard['wer_punct'] : shard['wer'];
+    return (conditions['minwer'] == "" || range[1] >= +conditions['minwer'])
+            && (conditions['maxwer'] == "" || range[0] <= +conditions['maxwer']);
+}
 
-        translationTag = $(this).find('translation');
-        translationText = getContent(translationTag, tokenised, punctuation);
-        translationColour = getColourContent(translationTag, tokenised, punctuation);
+function isRowSatisfied(row, conditions) {
+    k = (conditions['punct'] == "yes") ? 0 : 1;
+    nbsource = row['source'][k];
+    nbtrans = row['translation'][k];
+    if ((conditions['minsource'] != "" && nbsource < +conditions['minsource'])
+            || (conditions['maxsource'] != "" && nbsource > +conditions['maxsource'])
+            || (conditions['mintrans'] != "" && nbtrans < +conditions['mintrans'])
+            || (conditions['maxtrans'] != "" && nbtrans > +conditions['maxtrans'])) {
+        return false;
+    }
+    for (var r = 0; r < row['references'].length; r++) {
+        nbref = row['references'][r][k];
+        wer = row['references'][r][3 - k];
+        if ((conditions['minref'] == "" || nbref >= +conditions['minref'])
+                && (conditions['maxref'] == "" || nbref <= +conditions['maxref'])
+                && (conditions['minwer'] == "" || wer >= +conditions['minwer'])
+                && (conditions['maxwer'] == "" || wer <= +conditions['maxwer'])) {
+            return true;
+        }
+    }
+    return false;
+}
 
-        if (typeof (previous) !== 'undefined') {
-            tooltip_source = "<b>Previous (source):</b> " + previous[0] + "<br>";
-            tooltip_source += "<b>Previous (reference):</b> " + previous[1] + "<br>";
-            tooltip_source += "<b>Previous (translation):</b> " + previous[2];
-        } else {
-            tooltip_source = "(None)";
+var shardCallbacks = {};
+
+function analyserShard(number, rows) {
+    if (number in shardCallbacks) {
+        shardCallbacks[number](rows);
+    }
+}
+
+function loadShardScript(file, number, onLoad, onError) {
+    script = document.createElement("script");
+    shardCallbacks[number] = function(rows) {
+        delete shardCallbacks[number];
+        onLoad(rows);
+    };
+    // the load event is fired after the script is executed, so a shard whose
+    // callback is still pending at that point could not be read
+    script.onload = function() {
+        if (number in shardCallbacks) {
+            delete shardCallbacks[number];
+            onError();
         }
+        $(this).remove();
+    };
+    script.onerror = function() {
+        delete shardCallbacks[number];
+        onError();
+        $(this).remove();
+    };
+    script.src = file;
+    document.getElementsByTagName("head")[0].appendChild(script);
+}
 
-        indexClosestRef = -1; lowestWer = 10000;
-        $(this).find("reference").each(function(m) {
-          wer = (punctuation) ? +$(this).attr('wer_punct') : +$(this).attr('wer');
-          if (wer < lowestWer) {
-          	 lowestWer = wer;
-          	 indexClosestRef = m;
-          }
-        });
-        
-        tooltip_reference = "";
-        $(this).find("reference").each(function(m) {
-            referenceText = getContent($(this), tokenised, punctuation);
-            if (m == indexClosestRef) {
-                fullRef = getColourContent($(this), tokenised, punctuation);
-                closestRef = referenceText;
-            } else {
-                fullRef = referenceText;
+function generateShardedTable(conditions, index) {
+    incr = 1;
+    failed = [];
+
+    function loadShard(s) {
+        if (s >= index['shards'].length || incr > conditions['tablesize']) {
+            $('#nboutputs').text((incr - 1));
+            if (failed.length > 0) {
+                $('#nboutputs').append(" (could not load shards: " + failed.join(", ") + ")");
+            }
+            enableTooltips();
+            return;
+        }
+        shard = index['shards'][s];
+        if (!isInShardRange(shard, conditions)) {
+            loadShard(s + 1);
+            return;
+        }
+        shardFile = index['directory'] + "/" + shard['file'];
+        loadShardScript(shardFile, s, function(rows) {
+            for (var i = 0; i < rows.length && incr <= conditions['tablesize']; i++) {
+                if (!isRowSatisfied(rows[i], conditions)) {
+                    continue;
+                }
+                pair = $($.parseXML(rows[i]['pair'])).find("pair");
+                if (isSatisfied(pair, conditions) == false) {
+                    continue;
+                }
+                appendRow(pair, conditions, incr);
+                incr += 1;
             }
-            wer = (punctuation) ? $(this).attr('wer_punct') : $(this).attr('wer');
-            tooltip_reference += "<li>" + fullRef + " <b>(WER: " + wer + "&#37;)</b>" + "</li>";
+            loadShard(s + 1);
+        }, function() {
+            failed.push(shardFile);
+            loadShard(s + 1);
         });
+    }
+    loadShard(0);
+}
+
+function appendRow(pair, conditions, incr) {
+    tokenised = (conditions['tokenised'] == "yes");
+    punctuation = (conditions['punct'] == "yes");
 
-        line = "<tr><td>" + incr + "</td>";
-        line += "<td><a href='#' tooltip-title='Contextual factors' tooltip-content='";
-        line += clean(tooltip_source) + "'>" + sourceText + "</a></td>";
-        line += "<td><a href='#' tooltip-title='Reference translations' tooltip-content='";
-        line += clean(tooltip_reference) + "'>" + translationColour + "</td></tr>";
+    sourceTag = pair.find('source');
+    sourceText = getContent(sourceTag, tokenised, punctuation);
 
-        $('.outputs').append(line);
-        previous = [ sourceText, closestRef, translationText ];
-        incr += 1;
+    translationTag = pair.find('translation');
+    translationText = getContent(translationTag, tokenised, punctuation);
+    translationColour = getColourContent(translationTag, tokenised, punctuation);
+
+    if (typeof (previous) !== 'undefined') {
+        tooltip_source = "<b>Previous (source):</b> " + previous[0] + "<br>";
+        tooltip_source += "<b>Previous (reference):</b> " + previous[1] + "<br>";
+        tooltip_source += "<b>Previous (translation):</b> " + previous[2];
+    } else {
+        tooltip_source = "(None)";
+    }
+
+    indexClosestRef = -1; lowestWer = 10000;
+    pair.find("reference").each(function(m) {
+      wer = (punctuation) ? +$(this).attr('wer_punct') : +$(this).attr('wer');
+      if (wer < lowestWer) {
+      	 lowestWer = wer;
+      	 indexClosestRef = m;
+      }
     });
-    $('#nboutputs').text((incr - 1));
+    
+    tooltip_reference = "";
+    pair.find("reference").each(function(m) {
+        referenceText = getContent($(this), tokenised, punctuation);
+        if (m == indexClosestRef) {
+            fullRef = getColourContent($(this), tokenised, punctuation);
+            closestRef = referenceText;
+        } else {
+            fullRef = referenceText;
+        }
+        wer = (punctuation) ? $(this).attr('wer_punct') : $(this).attr('wer');
+        tooltip_reference += "<li>" + fullRef + " <b>(WER: " + wer + "&#37;)</b>" + "</li>";
+    });
+
+    line = "<tr><td>" + incr + "</td>";
+    line += "<td><a href='#' tooltip-title='Contextual factors' tooltip-content='";
+    line += clean(tooltip_source) + "'>" + sourceText + "</a></td>";
+    line += "<td><a href='#' tooltip-title='Reference translations' tooltip-content='";
+    line += clean(tooltip_reference) + "'>" + translationColour + "</td></tr>";
+
+    $('.outputs').append(line);
+    previous = [ sourceText, closestRef, translationText ];
 }
 
 function enableTooltips() {
@@ -36,8 +36,8 @@ __author__ = 'Pierre Lison (plison@ifi.uio.no)'
 __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
-import random
-from mosespy.corpus import AlignedCorpus, BasicCorpus
+import random, array
+from mosespy.corpus import AlignedCorpus, BasicCorpus, FingerprintIndex
     
 
 def divideData(alignedStem, sourceLang, targetLang, nbTuning=1000, nbDev=3000, 
@@ -64,84 +64,40 @@ def divideData(alignedStem, sourceLang, targetLang, nbTuning=1000, nbDev=3000,
     
     """
     corpus = AlignedCorpus(alignedStem, sourceLang, targetLang)
+    nbLines = corpus.countNbLines()
    
-    if nbTuning + nbDev + nbTesting > corpus.countNbLines():
+    if nbTuning + nbDev + nbTesting > nbLines:
         raise RuntimeError("cannot divide such small amount of data")
     
     outputPath = corpus.getSourceCorpus().getUp()
     
+    # one split identifier per line (0=training, 1=tuning, 2=development, 3=testing)
+    assignments = array.array('B', [0]) * nbLines
+    nbHeldOut = nbTuning + nbDev + nbTesting
     if randomPick:
-        nbLines = corpus.countNbLines()
-        toExclude = set()
-        
-        tuningIndices =_drawRandom(nbTuning, nbLines, exclusion=toExclude)
-        toExclude = toExclude.union(tuningIndices)
-        developIndices =_drawRandom(nbDev, nbLines, exclusion=toExclude)
-        toExclude = toExclude.union(developIndices)
-        testingIndices = _drawRandom(nbTesting,nbLines, exclusion=toExclude)
+        heldOutIndices = random.sample(xrange(nbLines), nbHeldOut)
     else:
-        nbLines = corpus.countNbLines()
-        tuningIndices = range(0,nbLines)[-nbTuning-nbTesting-nbDev:-nbDev-nbTesting]
-        developIndices = range(0,nbLines)[-nbDev-nbTesting:-nbTesting]
-        testingIndices = range(0,nbLines)[-nbTesting:]
-
-    sourceLines = corpus.getSourceCorpus().readlines()
-    targetLines = corpus.getTargetCorpus().readlines()
-
-    trainSourceLines = []
-    tuneSourceLines = []
-    devSourceLines = []       
-    testSourceLines = []       
-    print "Dividing source data..."
-    for i in range(0, len(sourceLines)):
-        sourceLine = sourceLines[i]
-        if i in tuningIndices:
-            tuneSourceLines.append(sourceLine)
-        elif i in developIndices:
-            devSourceLines.append(sourceLine)
-        elif i in testingIndices:
-            testSourceLines.append(sourceLine)
-        else:
-            trainSourceLines.append(sourceLine)
-    
-    trainTargetLines = []
-    tuneTargetLines = []
-    devTargetLines = []
-    testTargetLines = []       
-    print "Dividing target data..."
-    for i in range(0, len(targetLines)):
-        targetLine = targetLines[i]
-        if i in tuningIndices:
-            tuneTargetLines.append(targetLine)
-        elif i in developIndices:
-            devTargetLines.append(targetLine)
-        elif i in testingIndices:
-            testTargetLines.append(targetLine)
-        else:
-            trainTargetLines.append(targetLine)
-    
-    trainStem = outputPath + "/" + (corpus.stem + ".train").basename()
-    (trainStem + "." + corpus.sourceLang).writelines(trainSourceLines) 
-    (trainStem + "." + corpus.targetLang).writelines(trainTargetLines)
-    trainCorpus = AlignedCorpus(trainStem, corpus.sourceLang, corpus.targetLang)
-    
+        heldOutIndices = xrange(nbLines - nbHeldOut, nbLines)
+    for k, index in enumerate(heldOutIndices):
+        assignments[index] = 1 if k < nbTuning else (2 if k < nbTuning + nbDev else 3)
+ 
+    stems = [outputPath + "/" + (corpus.stem + "." + part).basename() 
+             for part in ["train", "tune", "dev", "test"]]
+    outputs = [(open(stem + "." + corpus.sourceLang, 'w', 1000000), 
+                open(stem + "." + corpus.targetLang, 'w', 1000000)) for stem in stems]
+    print "Dividing source and target data..."
+    try:
+        for i, (sourceLine, targetLine) in enumerate(corpus.iterlines()):
+            sourceD, targetD = outputs[assignments[i] if i < nbLines else 0]
+            sourceD.write(sourceLine)
+            targetD.write(targetLine)
+    finally:
+        for sourceD, targetD in outputs:
+            sourceD.close()
+            targetD.close()
     
-    tuneStem = outputPath + "/" + (corpus.stem + ".tune").basename()
-    (tuneStem + "." + corpus.sourceLang).writelines(tuneSourceLines) 
-    (tuneStem + "." + corpus.targetLang).writelines(tuneTargetLines)
-    tuneCorpus = AlignedCorpus(tuneStem, corpus.sourceLang, corpus.targetLang)
-
-    devStem = outputPath + "/" + (corpus.stem + ".dev").basename()
-    (devStem + "." + corpus.sourceLang).writelines(devSourceLines) 
-    (devStem + "." + corpus.targetLang).writelines(devTargetLines)
-    devCorpus = AlignedCorpus(devStem, corpus.sourceLang, corpus.targetLang)
-
-    testStem = outputPath + "/" + (corpus.stem + ".test").basename()
-    (testStem + "." + corpus.sourceLang).writelines(testSourceLines) 
-    (testStem + "." + corpus.targetLang).writelines(testTargetLines)
-    testCorpus = AlignedCorpus(testStem, corpus.sourceLang, corpus.targetLang)
-
-    return trainCorpus, tuneCorpus, devCorpus, testCorpus
+    return tuple([AlignedCorpus(stem, corpus.sourceLang, corpus.targetLang) 
+                  for stem in stems])
     
  
   
@@ -153,52 +109,12 @@ def filterOutLines(fullCorpusFile, *toRemoveFiles):
     """
     fullCorpus = BasicCorpus(fullCorpusFile)
     
-    occurrences = {}
-    histories = {}
+    index = FingerprintIndex()
     for toRemoveFile in toRemoveFiles:
-        toRemoveCorpus= BasicCorpus(toRemoveFile)
-        occurrences[toRemoveFile] = toRemoveCorpus.getOccurrences()
-        histories[toRemoveFile] = toRemoveCorpus.getHistories()
-
+        index.addCorpus(BasicCorpus(toRemoveFile))
 
     outputFile = fullCorpus.addFlag("filtered") 
-    with open(outputFile, 'w', 1000000) as newLmFileD:                 
-        inputLines = fullCorpus.readlines()
-        skippedLines = []
-        for i in range(2, len(inputLines)):
-            l = inputLines[i].strip()
-            toSkip = False
-            for f in occurrences:
-                if l in occurrences[f]:
-                    for index in occurrences[f][l]:
-                        if histories[f][index] == [iline.strip("\n") for 
-                                                   iline in inputLines[i-2:i]]:
-                            skippedLines.append(l)
-                            toSkip = True
-            if not toSkip:
-                newLmFileD.write(l+"\n")                                
-
-    print "Number of skipped lines: " + str(len(skippedLines))
+    nbSkipped = index.filterCorpus(fullCorpus, outputFile)
+    print "Number of skipped lines: " + str(nbSkipped)
     return outputFile
 
-
-  
-
-
-def _drawRandom(nbToDraw, maxValue, exclusion=None):
-    """Draws random numbers from 0 to maxValue.
-    
-    Args:
-        nbToDraw (int): number of numbers to draw
-        maxValue (int): max value for the numbers to draw
-        exclusion (set): numbers to exclude
-        
-    """
-    numbers = set()     
-    while len(numbers) < nbToDraw:
-        choice = random.randrange(0, maxValue)
-        if not exclusion or choice not in exclusion:
-            numbers.add(choice)
-    
-    return numbers 
-
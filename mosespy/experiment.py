@@ -58,12 +58,22 @@ __author__ = 'Pierre Lison (plison@ifi.uio.no)'
 __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
  
-import json,  re, copy
+import os, sys, json,  re, copy, threading, itertools, hashlib, pipes, time, tempfile, zlib
 import mosespy.system as system
 import mosespy.install as install
 from mosespy.system import Path
 import mosespy.analyser as analyser
+import mosespy.scoring as scoring
+import mosespy.phrasetable as phrasetable
 from mosespy.corpus import BasicCorpus, AlignedCorpus, ReferenceCorpus, CorpusProcessor
+from mosespy.corpus import PreprocessingCache
+
+# Stages of the training script following the word alignment (steps 1-3),
+# with their first and last steps and output files (in {tmDir}/model)
+trainingStages = [("lexical", 4, 4, ["lex.f2e", "lex.e2f"]),
+                  ("extraction", 5, 5, ["extract.sorted.gz"]),
+                  ("scoring", 6, 6, ["phrase-table.gz"]),
+                  ("tables", 7, 9, ["moses.ini"])]
 
 
 class Experiment(object):
@@ -84,7 +94,8 @@ class Experiment(object):
     
     """
     
-    def __init__(self, expName, sourceLang=None, targetLang=None, nbThreads=2):
+    def __init__(self, expName, sourceLang=None, targetLang=None, nbThreads=2, 
+                 executor=None, cacheDir=None):
         """Start a new experiment with the given name.  If an experiment of 
         same name already exists, its state is reloaded (based on the JSON
         file that records the experiment state). 
@@ -93,14 +104,25 @@ class Experiment(object):
             sourceLang (str): language code for the source language
             targetLang (str): language code for the target language
             nbThreads (int): number of parallel threads to use
+            executor (ShellExecutor): executor for the shell commands (e.g. an
+                EventLoopExecutor).  A new ShellExecutor is used by default.
+            cacheDir (str): directory of the cache of preprocessed corpora, 
+                which may be shared across experiments (e.g. install.expDir + 
+                ".cache").  The cache stores a copy of each processed corpus, 
+                and is therefore disabled by default.
         
         """
                 
         self.expPath = Path(install.expDir+expName).getAbsolute()
         self.lm = None
+        self.lmStats = None
         self.tm = None
         self.iniFile = None
         self.results = None
+        self.decoderSession = None
+        self.checkpoints = {}
+        self.stateLock = threading.RLock()
+        self.timings = {}
         
         jsonFile = self.expPath+"/settings.json"
         if jsonFile.exists():
@@ -118,14 +140,16 @@ class Experiment(object):
         print ("Experiment " + expName + " (" + self.sourceLang  
                + "-" + self.targetLang + ") successfully started")
         
-        self.executor = system.ShellExecutor()
+        self.executor = executor if executor else system.ShellExecutor()
         self.nbThreads = nbThreads
-        self.processor = CorpusProcessor(self.expPath, self.executor, self.nbThreads)
+        cache = PreprocessingCache(cacheDir) if cacheDir else None
+        self.processor = CorpusProcessor(self.expPath, self.executor, self.nbThreads, 
+                                         persistent=True, pipelined=True, cache=cache)
         self.decoder = install.decoder
                    
     
     def trainLanguageModel(self, trainFile, preprocess= True, ngram_order=3, 
-                           filterOut=None):
+                           filterOut=None, nbSplits=None, memory=None, binaryFormat=None):
         """Trains the language model used for the experiment.  The method starts
         by inserting start and end characters <s> and </s> to the lines of the
         training files, then estimates the model parameters, builds the model, and
@@ -136,34 +160,63 @@ class Experiment(object):
             preprocess (bool): whether to tokenise and truecase the training data
                 before estimating the model parameters
             ngram_order: order of the N-gram
-            filterOut (str): optional path of file whose occurrences must be filtered
-                out of the training file. Use to remove sentences from the development
-                or test set prior to estimating the LM. 
+            filterOut (str): optional path (or list of paths) of file(s) whose 
+                occurrences must be filtered out of the training file. Use to remove 
+                sentences from the development or test set prior to estimating the LM. 
+            nbSplits (int): number of sub-dictionaries for which the n-gram 
+                statistics and sub-models are estimated in parallel (by default,
+                the number of threads). 
+            memory (str): memory for sorting the n-grams in build_binary, in 
+                bytes or as percentage of physical memory (e.g. "4G" or "50%").
+            binaryFormat (dict): format of the binarised KenLM model, with the 
+                data structure ('type': 'probing' or 'trie'), and for tries the 
+                optional number of bits for quantising the probabilities 
+                ('probBits') and backoffs ('backoffBits') and for compressing 
+                the pointers ('pointerBits').  E.g. {"type":"trie", "probBits":8, 
+                "backoffBits":8, "pointerBits":22}.  Default is a probing model.
                     
         If the operation is successful, the binarised language model is set to the
-        instance self.lm as a tuple (file path, n-gram order).
+        instance self.lm as a tuple (file path, n-gram order), and its memory 
+        footprint and load time are recorded in self.lmStats.
         
         """         
 
         print "Building language model based on " + trainFile
         train = BasicCorpus(trainFile)
-        if filterOut:
-            train = self.processor.filterOutLines(train, filterOut)
+        toRemove = filterOut if isinstance(filterOut, list) else ([filterOut] if filterOut else [])
+        binaryOptions = _getBinaryOptions(binaryFormat)
+        inputs = [train, preprocess, ngram_order, binaryOptions] + toRemove
+        checkpoint = self._getCheckpoint("lm", inputs)
+        if checkpoint:
+            print "Language model already built, skipping estimation"
+            self.lm = (Path(checkpoint["result"][0]), checkpoint["result"][1])
+            self.lmStats = checkpoint["result"][2]
+            self._recordState()
+            return
+        
+        if toRemove:
+            train = self.processor.filterOutLines(train, *toRemove)
         if preprocess:
             train = self.processor.processCorpus(train)
        
         regex = re.compile("</?s>", re.I)
-        lines = [regex.sub("",l) for l in train.readlines()]
-        train.writelines(lines)
+        cleanFile = train.addFlag("nosb")
+        with open(cleanFile, 'w') as cleanD:
+            for l in train.iterlines():
+                cleanD.write(regex.sub("",l))
+        cleanFile.rename(train)
         sbFile = self.expPath + "/" + train.basename().changeFlag("sb")              
         self.executor.run(install.irstlm_root+"/bin/add-start-end.sh", train, sbFile)
         
         blmFile = self.expPath + "/langmodel.blm." + self.targetLang
-        self._estimateLanguageModel(sbFile, ngram_order, blmFile)
+        self._estimateLanguageModel(sbFile, ngram_order, blmFile, nbSplits=nbSplits or 
+                                    self.nbThreads, memory=memory, binaryOptions=binaryOptions)
         
         sbFile.remove()
         self.lm = (blmFile, ngram_order)
-        self._recordState()
+        self.lmStats = self._getLanguageModelStats()
+        self.lmStats["format"] = binaryOptions
+        self._completeStep("lm", inputs, [blmFile], self.lm + (self.lmStats,))
   
      
     def trainTranslationModel(self, trainStem, alignment=install.defaultAlignment, 
@@ -187,7 +240,9 @@ class Experiment(object):
             preprocess (bool): whether to tokenise and truecase the training data
                 prior to the model estimation.
             pruning (bool): whether to prune the phrase table after constructing the
-                model, to remove phrase pairs with near-zero probabilities.
+                model, to remove phrase pairs with near-zero probabilities.  The
+                pruning criteria can also be given as a dictionary with the 
+                arguments of _prunePhraseTable (e.g. {"maxTranslations":20}).
         
         Once all training operations are completed, the method sets the self.tm
         variable to the directory containing the phrase and reordering tables, and
@@ -198,25 +253,38 @@ class Experiment(object):
             raise RuntimeError("Language model not yet constructed")
         
         train = AlignedCorpus(trainStem, self.sourceLang, self.targetLang)
+        inputs = [train.getSourceCorpus(), train.getTargetCorpus(), alignment, reordering,
+                  preprocess, pruning, self.lm[0], self.lm[1]]
+        checkpoint = self._getCheckpoint("translationmodel", inputs)
+        if checkpoint:
+            print "Translation model already built, skipping training"
+            self.tm, self.iniFile = Path(checkpoint["result"][0]), Path(checkpoint["result"][1])
+            self._recordState()
+            return
         
         if preprocess:         
-            train = self.processor.processAlignedCorpus(train)
+            train = self._processAlignedCorpus(train, "preprocessing")
        
         print ("Building translation model " + self.sourceLang + "-" 
                + self.targetLang + " with " + train.getStem())
 
-        tmDir = self._constructTranslationModel(train, alignment, reordering)
-        
-        if ((tmDir + "/model/phrase-table.gz").getSize() < 1000
-            or not (tmDir +"/model/moses.ini").exists()):
+        pruningArgs = (pruning if isinstance(pruning, dict) else {}) if pruning else None
+        tmDir = self._constructTranslationModel(train, alignment, reordering, pruningArgs)
+        if not (tmDir +"/model/moses.ini").exists():
             raise RuntimeError("Construction of translation model FAILED")
             
-        print "Finished building translation model in directory " + tmDir.getDescription()
         self.tm= tmDir + "/model"
         self.iniFile = self.tm +"/moses.ini"
-        if pruning:
-            self._prunePhraseTable()
-        self._recordState()
+        isPruned = self._prunePhraseTable(**pruningArgs) if pruning else False
+        phraseTable = MosesConfig(self.iniFile).getPhraseTable()
+        if not phraseTable.exists() or phraseTable.getSize() < 1000:
+            raise RuntimeError("Construction of translation model FAILED")
+        print "Finished building translation model in directory " + tmDir.getDescription()
+        # an unsuccessful pruning is not recorded, such that it is retried later
+        if isPruned or not pruning:
+            self._completeStep("translationmodel", inputs, [self.iniFile], (self.tm, self.iniFile))
+        else:
+            self._recordState()
         
  
     def tuneTranslationModel(self, tuningStem, preprocess=True):
@@ -245,12 +313,25 @@ class Experiment(object):
         tuning = AlignedCorpus(tuningStem, self.sourceLang, self.targetLang)
         
         if preprocess:         
-            tuning = self.processor.processAlignedCorpus(tuning, False)
+            tuning = self._processAlignedCorpus(tuning, "preprocessing-tuning", False)
+        
+        tuneDir = self.expPath+"/tunedmodel"
+        
+        # if the model was already tuned, the initial configuration is the one
+        # recorded in the checkpoint
+        initialIni = self.iniFile
+        if self.checkpoints.get("tuning") and self.iniFile == tuneDir + "/moses.ini":
+            initialIni = Path(self.checkpoints["tuning"]["result"])
+        inputs = [tuning.getSourceCorpus(), tuning.getTargetCorpus(), initialIni]
+        if self._getCheckpoint("tuning", inputs):
+            print "Translation model already tuned, skipping tuning"
+            self.iniFile = tuneDir + "/moses.ini"
+            self._recordState()
+            return
         
         print ("Tuning translation model " + self.sourceLang + "-" 
                + self.targetLang + " with " + tuning.getStem())
         
-        tuneDir = self.expPath+"/tunedmodel"
         tuningScript = self._getTuningScript(tuneDir, tuning.getStem())
         tuneDir.resetdir()
         result = self.executor.run(tuningScript)
@@ -259,10 +340,86 @@ class Experiment(object):
             
         print "Finished tuning translation model in directory " + tuneDir.getDescription()
         self.iniFile = tuneDir + "/moses.ini"
-        self._recordState()
+        self._completeStep("tuning", inputs, [self.iniFile], initialIni)
       
       
    
+    def getRunPlan(self, lmFile, trainStem, tuningStem=None, testStem=None, 
+                   alignment=install.defaultAlignment, reordering=install.defaultReordering,
+                   preprocess=True, ngram_order=3, pruning=True):
+        """Returns the plan for a full run of the experiment, as a graph of 
+        stages with their dependencies.  The language model is estimated in
+        parallel with the preprocessing and word alignment of the training
+        data, since only the last training steps require the language model.
+        When preprocessing is enabled, both stages first wait for the truecasing
+        models to be trained, using the source side of the training data and
+        the language model data (for the target side), as in a sequential run.
+        Further stages may be added to the plan before running it.
+        
+        Args:
+            lmFile (str): the training file for the language model
+            trainStem (str): the stem for the training data of the translation model
+            tuningStem (str): the stem for the tuning data (if any)
+            testStem (str): the stem for the test data (if any)
+            alignment (str): the alignment heuristic
+            reordering (str): the reordering method
+            preprocess (bool): whether to tokenise and truecase the data
+            ngram_order (int): the order of the language model
+            pruning (bool): whether to prune the phrase table
+        
+        """
+        plan = system.TaskGraph()
+        dependencies = []
+        if preprocess:
+            def trainTruecasers():
+                train = AlignedCorpus(trainStem, self.sourceLang, self.targetLang)
+                self.processor.trainTruecasingModels([train.getSourceCorpus(), 
+                                                      BasicCorpus(lmFile)])
+            plan.addTask("truecasing", trainTruecasers)
+            dependencies = ["truecasing"]
+        plan.addTask("lm", lambda : self.trainLanguageModel(lmFile, preprocess, ngram_order),
+                     dependencies)
+        
+        def align():
+            train = AlignedCorpus(trainStem, self.sourceLang, self.targetLang)
+            if preprocess:
+                train = self._processAlignedCorpus(train, "preprocessing")
+            self._getAlignment(train, alignment, reordering)
+        plan.addTask("alignment", align, dependencies)
+        
+        # the translation model reuses the checkpoints of the preprocessing and alignment
+        plan.addTask("translationmodel", lambda : self.trainTranslationModel(
+                trainStem, alignment, reordering, preprocess, pruning), ["lm", "alignment"])
+        lastStage = "translationmodel"
+        if tuningStem:
+            plan.addTask("tuning", lambda : self.tuneTranslationModel(tuningStem, preprocess), 
+                         [lastStage])
+            lastStage = "tuning"
+        if testStem:
+            plan.addTask("evaluation", lambda : self.evaluateBLEU(testStem, preprocess), 
+                         [lastStage])
+        return plan
+    
+    
+    def runExperiment(self, lmFile, trainStem, tuningStem=None, testStem=None, **kwargs):
+        """Runs the full experiment (language model, translation model, and 
+        optionally tuning and evaluation), executing independent stages 
+        concurrently.  Returns the duration of each stage (in seconds), which 
+        is also recorded in the experiment state.  See getRunPlan(...) for 
+        the arguments.
+        
+        """
+        plan = self.getRunPlan(lmFile, trainStem, tuningStem, testStem, **kwargs)
+        try:
+            plan.run()
+        finally:
+            self.timings.update(plan.timings)
+            self._recordState()
+        for stage, duration in plan.timings.items():
+            print "Stage %s: %.1f s"%(stage, duration)
+        return plan.timings
+            
+    
     def translate(self, text, preprocess=True):
         """ Translates the text given as argument and returns the result.
         
@@ -288,9 +445,13 @@ class Experiment(object):
         text = text.strip("\n") + "\n"
         if preprocess:
             text = self.processor.processText(text, self.sourceLang)
-            
-        transScript = self._getTranslateScript()
-        translation = self.executor.run_output(transScript, stdin=text)
+        
+        session = self._getDecoderSession()
+        if session:
+            translation = session.translate(text)
+        else:
+            transScript = self._getTranslateScript()
+            translation = self.executor.run_output(transScript, stdin=text)
         return self.processor.revertText(translation, self.targetLang)
         
    
@@ -311,11 +472,15 @@ class Experiment(object):
                 prior to translation.
             filterModel (bool): whether to filter the phrase-table to reduce
                 it to the pairs necessary for translating 'infile'.  The 
-                filtering takes some time but speeds up the decoding.
+                filtering speeds up the decoding, and the filtered models
+                are kept for later translations of the same input.
             revertOutput (bool): whether to detokenise and deescape the translation
                 outputs (useful to get good-looking output, but not appropriate
                 for evaluation on reference translations).     
         
+        If a resident decoder session is running (see startDecoder), the input is
+        translated through this session, and no model filtering is performed.
+        
         """   
         
         inCorpus = BasicCorpus(infile)
@@ -328,14 +493,24 @@ class Experiment(object):
             
         if preprocess:
             inCorpus = self.processor.processCorpus(inCorpus)
+        
+        session = self._getDecoderSession()
+        if session:
+            print ("Translating file \"" + inCorpus + "\" from " + self.sourceLang 
+                   + " to " + self.targetLang + " with resident decoder")
+            session.translateFile(inCorpus, outCorpus)
+            if revertOutput: 
+                outCorpus = self.processor.revertCorpus(outCorpus)
+                outCorpus.rename(outfile)
+            return
        
+        if not self.iniFile:
+            raise RuntimeError("Translation model is not yet trained!")
+        initFile = self.iniFile
         if filterModel:
             filterDir = self._getFilteredModel(inCorpus)
-            initFile = filterDir + "/moses.ini"
-        elif self.iniFile:
-            initFile = self.iniFile
-        else:
-            raise RuntimeError("Translation model is not yet trained!")
+            if filterDir:
+                initFile = filterDir + "/moses.ini"
         
         print ("Translating file \"" + inCorpus + "\" from " + 
                self.sourceLang + " to " + self.targetLang)
@@ -343,10 +518,6 @@ class Experiment(object):
         transScript = self._getTranslateScript(initFile, inCorpus)
         
         result = self.executor.run(transScript, stdout=outCorpus)
-                    
-        if filterDir:
-            filterDir.remove()
-       
         if not result:
             raise RuntimeError("Translation of file " + str(inCorpus) + " FAILED")
         
@@ -368,9 +539,8 @@ class Experiment(object):
                 
         At the end of the evaluation, the translation results and their BLEU score 
         are returned, and the instance variable self.results records the translation 
-        results (useful for later analysis).
-                
-        TODO: allow for other metrics than BLEU
+        results (useful for later analysis).  Other metrics (chrF and TER) can then
+        be computed with getScores().
         
         """
  
@@ -391,12 +561,48 @@ class Experiment(object):
         
         bleu, bleu_output = self.processor.getBleuScore(testCorpus)
         print bleu_output
+        scoring.getStatistics(testCorpus).saveBleuStatistics(self._getStatisticsFile())
         return testCorpus, bleu
     
+    
+    def getScores(self):
+        """Returns a dictionary with the BLEU, chrF and TER scores for the translation
+        results recorded by the last call to evaluateBLEU(...).
+        
+        """
+        if not self.results:
+            raise RuntimeError("Results must first be generated with evaluateBLEU(...)")
+        return self.processor.getScores(self.results)
+    
  
-    def generateResults(self):
+    def compareResults(self, otherExp, nbSamples=1000):
+        """Compares the translation results of the experiment with the results of
+        another experiment (evaluated on the same test data) through paired bootstrap 
+        resampling over the sentence-level BLEU statistics.
+        
+        Args:
+            otherExp (Experiment): the experiment to compare with
+            nbSamples (int): number of bootstrap resamples
+        
+        Returns:
+            A dictionary with the BLEU scores of both experiments, the proportion of
+            resamples in which the current experiment wins, the p-value and the 95% 
+            confidence interval for the BLEU difference (cf. scoring.pairedBootstrap).
+        
+        """
+        comparison = scoring.pairedBootstrap(self._getResultStatistics(), 
+                                             otherExp._getResultStatistics(), nbSamples)
+        print ("BLEU: %.2f vs. %.2f (p-value: %.3f, 95%% interval for difference: "
+               "[%.2f, %.2f])"%(comparison["bleu1"], comparison["bleu2"], 
+                                comparison["pvalue"], comparison["interval"][0],
+                                comparison["interval"][1]))
+        return comparison
+    
+    
+    def generateResults(self, sharded=False):
         """Generate an HTML page that allows one to easily inspect the translation outputs
-        against their reference translations.
+        against their reference translations.  If sharded is set to True, the data
+        is written as JSON shards loaded on demand by the page (for large test sets).
         
         The method returns the path to the generated HTML file.
         
@@ -407,46 +613,97 @@ class Experiment(object):
         elif not isinstance(self.results, ReferenceCorpus):
             raise RuntimeError("results must be of type ReferenceCorpus")
                 
-        return analyser.generateHTML(self.results, self.processor)
+        return analyser.generateHTML(self.results, self.processor, sharded=sharded)
 
   
 
 
-    def binariseModel(self):
+    def binariseModel(self, tableFormat="binary", nbScores=None, nbThreads=None, 
+                      quantisation=None):
         """Binarises the phrase and reordering tables.  This operation takes some
-        time but makes the models must faster to load at decoding time.
+        time but makes the models must faster to load at decoding time.  The two
+        tables are binarised concurrently through the executor (i.e. as separate
+        SLURM jobs for a SlurmExperiment), and the completion of each table is 
+        reported.
         
         The translation model must already be constructed before calling this method.
         
+        Args:
+            tableFormat (str): format of the binarised phrase table, among 
+                'binary' (processPhraseTable), 'compact' (processPhraseTableMin) 
+                and 'probing' (CreateProbingPT).  The compact and probing tables 
+                are memory-mapped by the decoder, such that several decoder 
+                processes share the same pages.  The reordering table is 
+                binarised with processLexicalTableMin for the compact and 
+                probing formats, and with processLexicalTable otherwise.
+            nbScores (int): number of scores in the phrase table (by default,
+                detected from the first entry)
+            nbThreads (int): number of threads for the compact format (by 
+                default, the number of threads of the experiment)
+            quantisation (int): for the compact format, the number of distinct 
+                values to which each score is quantised (no quantisation if None)
+        
         """
         
         print "Binarise translation model " + self.sourceLang + " -> " + self.targetLang
         if not self.iniFile:
             raise RuntimeError("Translation model has not yet been trained and tuned")
+        elif tableFormat not in ["binary", "compact", "probing"]:
+            raise RuntimeError("Unknown format for the phrase table: " + str(tableFormat))
+        elif quantisation and tableFormat != "compact":
+            raise RuntimeError("Quantisation is only available for compact phrase tables")
         
         binaDir = self.expPath+"/binmodel"
         config = MosesConfig(self.iniFile)
         phraseTable = config.getPhraseTable()
         reorderingTable = config.getReorderingTable()
+        nbScores = nbScores or phrasetable.getNbScores(phraseTable)
+        nbThreads = nbThreads or self.nbThreads
         
         binaDir.resetdir()
-        binScript = (install.moses_root + "/bin/processPhraseTable" + " -ttable 0 0 " + phraseTable 
-                     + " -nscores 5 -out " + binaDir + "/phrase-table")
-        result1 = self.executor.run(binScript)
-        if not result1:
-            raise RuntimeError("could not binarise translation model (phrase table process)")
-        
-        binScript2 = (install.moses_root + "/bin/processLexicalTable" + " -in " + reorderingTable 
-                      + " -out " + binaDir + "/reordering-table")
-        result2 = self.executor.run(binScript2)
-        if not result2:
-            raise RuntimeError("could not binarise translation model (lexical table process)")
+        if tableFormat == "compact":
+            newTable = binaDir + "/phrase-table.minphr"
+            binScript = (install.moses_root + "/bin/processPhraseTableMin -in " + phraseTable
+                         + " -out " + binaDir + "/phrase-table -nscores %i -threads %i"
+                         %(nbScores, nbThreads) 
+                         + (" -quantize %i"%quantisation if quantisation else ""))
+        elif tableFormat == "probing":
+            newTable = binaDir + "/phrase-table"
+            binScript = (install.moses_root + "/bin/CreateProbingPT --input-pt " + phraseTable
+                         + " --output-dir " + newTable + " --num-scores %i"%nbScores)
+        else:
+            newTable = binaDir + "/phrase-table"
+            binScript = (install.moses_root + "/bin/processPhraseTable" + " -ttable 0 0 " 
+                         + phraseTable + " -nscores %i -out "%nbScores + newTable)
+        if tableFormat == "binary":
+            binScript2 = (install.moses_root + "/bin/processLexicalTable" + " -in " 
+                          + reorderingTable + " -out " + binaDir + "/reordering-table")
+        else:
+            binScript2 = (install.moses_root + "/bin/processLexicalTableMin" + " -in " 
+                          + reorderingTable + " -out " + binaDir + "/reordering-table"
+                          + " -threads %i"%nbThreads
+                          + (" -quantize %i"%quantisation if quantisation else ""))
+        
+        def reportCompletion(task):
+            table = "phrase table" if task.script == binScript else "reordering table"
+            print ("Binarisation of %s %s"%(table, "completed" if task.isSuccessful() 
+                                                   else "FAILED"))
+        result = self.executor.run_parallel([binScript, binScript2], 
+                                            callback=reportCompletion)
+        if not result:
+            raise RuntimeError("could not binarise translation model")
          
-        config.replacePhraseTable(binaDir+"/phrase-table", "PhraseDictionaryBinary")
+        config.replacePhraseTable(newTable, "PhraseDictionaryBinary" 
+                                  if tableFormat == "binary" else None)
         config.replaceReorderingTable(binaDir+"/reordering-table")
         
+        # the configuration file rewritten by the binarisation supersedes the one
+        # recorded for the training and tuning steps
         self.tm = binaDir
-        self._recordState()
+        outputs = [self.iniFile] + [binaDir + "/" + f for f in binaDir.listdir() 
+                                    if os.path.isfile(binaDir + "/" + f)]
+        self._completeStep("binarisation", [tableFormat, nbScores, quantisation], outputs)
+        self._supersedeOutputs("binarisation", [self.iniFile])
         print "Finished binarising the translation model in directory " + binaDir.getDescription()
       
      
@@ -484,6 +741,46 @@ class Experiment(object):
             print "Query results could not be parsed: " + str(output)
     
    
+    def _getLanguageModelStats(self):
+        """Returns the memory footprint of the binarised language model (file
+        size and maximum resident memory of the query process, in bytes) and 
+        its load time (in seconds), measured by querying the model on an 
+        empty input.  The query is run locally (and not through the executor),
+        such that the load time does not include any job scheduling delay.
+        The load time is the real time reported by the query process, if any.
+        
+        """
+        start = time.time()
+        output = system.run_output(install.moses_root + "/bin/query "
+                                   + self.lm[0] + " 2>&1", "")
+        stats = {"size":self.lm[0].getSize(), "loadTime":time.time()-start}
+        s = re.search(r"RSSMax:\s*([0-9]+)\s*kB", output or "")
+        if s:
+            stats["memory"] = int(s.group(1))*1024
+        s = re.search(r"real:\s*([0-9.]+)", output or "")
+        if s:
+            stats["loadTime"] = float(s.group(1))
+        return stats
+    
+    
+    def queryPhraseTable(self, phrase):
+        """Returns the translations of a source phrase in the phrase table of the
+        current model, as a list of (target phrase, scores) tuples.  The phrase
+        must be tokenised and truecased like the training data.
+        
+        The translation model must already be constructed (and not binarised) 
+        before calling this method.
+        
+        """
+        if not self.iniFile:
+            raise RuntimeError("Translation model is not yet constructed")
+        reader = MosesConfig(self.iniFile).getPhraseTableReader()
+        try:
+            return reader.getTranslations(phrase)
+        finally:
+            reader.close()
+    
+    
     def reduceSize(self):
         """Reduces the size of the experiment directory by removing all uncessary files, 
         such as intermediary corpus files and optional files generated during the model
@@ -514,6 +811,46 @@ class Experiment(object):
         print "Finished reducing the size of experiment directory " + self.expPath
  
     
+    def startDecoder(self, nbInstances=1):
+        """Starts a resident decoder session, made of one or more Moses processes
+        that keep the translation and language models loaded in memory.  Until the
+        session is stopped, the methods translate(...) and translateFile(...) rely
+        on this session instead of starting (and loading) a new decoder for each 
+        call.
+        
+        Args:
+            nbInstances (int): number of decoder processes in the session. The
+                sentences to translate are distributed between the processes.
+        
+        """
+        if not self.iniFile:
+            raise RuntimeError("Translation model is not yet trained and tuned!")
+        self.stopDecoder()
+        transScript = self._getTranslateScript(decoder=install.decoder)
+        self.decoderSession = DecoderSession(transScript, self.iniFile, nbInstances)
+        print "Resident decoder started with %i instance(s)"%(nbInstances)
+        
+    
+    def stopDecoder(self):
+        """Stops the resident decoder session (if any).
+        
+        """
+        if self.decoderSession:
+            self.decoderSession.close()
+            self.decoderSession = None
+            print "Resident decoder stopped"
+        
+        
+    def close(self):
+        """Terminates the long-lived processes (such as the tokenisation and 
+        truecasing co-processes and the resident decoders) started by the 
+        experiment.
+        
+        """
+        self.stopDecoder()
+        self.processor.close()
+        
+    
     def copy(self, nexExpName):
         """Copies the current experiment under a new name.
         
@@ -523,6 +860,7 @@ class Experiment(object):
         """
         newexp = Experiment(str(nexExpName), self.sourceLang, self.targetLang)
         newexp.lm = copy.deepcopy(self.lm)
+        newexp.lmStats = copy.deepcopy(self.lmStats)
         newexp.tm = Path(self.tm)
         newexp.nbThreads = int(self.nbThreads)
         newexp.iniFile = Path(self.iniFile)
@@ -533,41 +871,109 @@ class Experiment(object):
         return newexp
  
     
-    def _estimateLanguageModel(self, corpusFile, ngram_order, outputFile, continuous=False):
+    def _estimateLanguageModel(self, corpusFile, ngram_order, outputFile, continuous=False,
+                               nbSplits=1, memory=None, binaryOptions=""):
+        """Estimates the language model with IRSTLM and binarises it with KenLM.
+        The ARPA model is streamed from compile-lm to build_binary, without
+        writing it to disk.
+        
+        Args:
+            corpusFile (str): training data, with start and end characters
+            ngram_order (int): order of the N-gram
+            outputFile (str): path to the binarised model
+            continuous (bool): whether to build the model for continuous features
+            nbSplits (int): number of sub-dictionaries estimated in parallel
+            memory (str): memory for sorting the n-grams in build_binary
+            binaryOptions (str): data structure and compression options for 
+                build_binary (see _getBinaryOptions)
         
+        """
         lmFile = outputFile.changeFlag("rawlm")
         system.setEnv("IRSTLM", install.irstlm_root)
-        lmScript = ((install.irstlm_root + "/bin/build-lm.sh" + " -i %s" +
-                    " -p -s improved-kneser-ney -o %s -n %i -t ./tmp-%s"
-                    )%(corpusFile, lmFile, ngram_order, self.expPath.basename())) 
-        self.executor.run(lmScript)
+        if nbSplits > 1:
+            self._estimateSplitLanguageModel(corpusFile, ngram_order, lmFile, nbSplits)
+        else:
+            lmScript = ((install.irstlm_root + "/bin/build-lm.sh" + " -i %s" +
+                        " -p -s improved-kneser-ney -o %s -n %i -t ./tmp-%s"
+                        )%(corpusFile, lmFile, ngram_order, self.expPath.basename())) 
+            self.executor.run(lmScript)
                            
-        arpaFile = lmFile.changeFlag("arpa")
         arpaScript = (install.irstlm_root + "/bin/compile-lm "
-                      + "--text=yes %s %s"%(lmFile+".gz", arpaFile))
-        self.executor.run(arpaScript)  
-
+                      + "--text=yes %s /dev/stdout"%(lmFile+".gz"))
         blmScript = (install.moses_root + "/bin/build_binary -w after " 
                      + (" -s " if continuous else "")
-                     + " -i " + arpaFile + " " + outputFile)
-        self.executor.run(blmScript)
-        print "New binarised language model: " + outputFile.getDescription() 
-        
+                     + (" -S " + memory if memory else "")
+                     + " -T " + self.expPath + " -i " + binaryOptions 
+                     + " /dev/stdin " + outputFile)
+        result = self.executor.run(system.getPipelineScript([arpaScript, blmScript]))
         (lmFile + ".gz").remove()
-        arpaFile.remove()
-
-        if outputFile.getSize() == 0:
+        
+        if not result or not outputFile.exists() or outputFile.getSize() == 0:
             raise RuntimeError("Error: generated language model is empty")
+        print "New binarised language model: " + outputFile.getDescription() 
+        
+    
+    def _estimateSplitLanguageModel(self, corpusFile, ngram_order, lmFile, nbSplits):
+        """Estimates the language model in parallel (following the procedure of
+        build-lm.sh).  The dictionary is split in sub-dictionaries, and the n-gram 
+        statistics and sub-models for each sub-dictionary are estimated in 
+        separate processes (or SLURM jobs), before being merged in {lmFile}.gz.
+        
+        """
+        splitDir = self.expPath + "/lmsplits"
+        splitDir.resetdir()
+        irstlmBin = install.irstlm_root + "/bin/"
+        
+        dictScript = (irstlmBin + "dict -i=%s -o=%s/dictionary -f=y -sort=no"
+                      %(corpusFile, splitDir))
+        splitScript = (irstlmBin + "split-dict.pl --input %s/dictionary --output %s/dict."
+                       " --parts %i"%(splitDir, splitDir, nbSplits))
+        if not self.executor.run(dictScript) or not self.executor.run(splitScript):
+            raise RuntimeError("Splitting of LM dictionary FAILED")
+        subDicts = sorted([d for d in os.listdir(splitDir) if d.startswith("dict.")])
+        
+        ngtScripts = [(irstlmBin + "ngt -i=%s -n=%i -gooout=y %s -fd=%s/%s -iknstat=%s/ikn.stat.%s"
+                       )%(corpusFile, ngram_order, 
+                          pipes.quote("-o=gzip -c > %s/ngram.%s.gz"%(splitDir, subDict)),
+                          splitDir, subDict, splitDir, subDict) for subDict in subDicts]
+        if not self.executor.run_parallel(ngtScripts):
+            raise RuntimeError("Extraction of n-gram statistics FAILED")
+        
+        sublmScripts = [(irstlmBin + "build-sublm.pl --prune-singletons --improved-kneser-ney" 
+                         + " %s --size %i --ngrams %s --sublm %s/lm.%s"
+                         )%(pipes.quote("cat %s/ikn.stat.dict.*"%splitDir), ngram_order,
+                            pipes.quote("gunzip -c %s/ngram.%s.gz"%(splitDir, subDict)),
+                            splitDir, subDict) for subDict in subDicts]
+        if not self.executor.run_parallel(sublmScripts):
+            raise RuntimeError("Estimation of sub-models FAILED")
+        
+        mergeScript = (irstlmBin + "merge-sublm.pl --size %i --sublm %s/lm.dict -lm %s.gz"
+                       %(ngram_order, splitDir, lmFile))
+        if not self.executor.run(mergeScript):
+            raise RuntimeError("Merging of sub-models FAILED")
+        splitDir.remove()
         
 
    
-    def _prunePhraseTable(self, probThreshold=0.0001):
-        """Prune the phrase table with the provided probability threshold.
+    def _prunePhraseTable(self, probThreshold=0.0001, sigThreshold=None, 
+                          maxTranslations=None):
+        """Prune the phrase table with the provided probability threshold, and 
+        optionally by statistical significance and number of translations per 
+        source phrase (cf. phrasetable.PhraseTablePruner).  The number of 
+        entries removed by each criterion is recorded in the pruning checkpoint.
+        As the original phrase table is removed after pruning, the pruning 
+        checkpoint supersedes the phrase table and configuration file recorded
+        for the training stages.  Returns True if the phrase table is pruned, 
+        and False if the pruning failed or was cancelled (in which case the 
+        unpruned table is kept).
         
         The translation model must already be constructed before calling this method.
         
         Args:
             probThreshold: the probability threshold under which phrase pairs are pruned.
+            sigThreshold: the significance threshold (negative log p-value, or
+                'a+e' / 'a-e') under which phrase pairs are pruned.
+            maxTranslations: the maximum number of translations per source phrase
             
         """
         
@@ -575,41 +981,121 @@ class Experiment(object):
             raise RuntimeError("Translation model is not yet constructed")
         
         config = MosesConfig(self.iniFile)
-        phrasetable = config.getPhraseTable()
-        newtable = Path(config.getPhraseTable()[:-2] + "reduced.gz")
-
-        if not phrasetable.exists():
-            print "Original phrase table has been removed, pruning cancelled"
-            return
+        phraseTable = Path(self.tm + "/phrase-table.gz")
+        newtable = Path(self.tm + "/phrase-table.reduced.gz")
         
-        zcatExec = "gzcat" if system.existsExecutable("gzcat") else "zcat"
-        pruneScript = (zcatExec + " %s|" + install.moses_root 
-                       + "/scripts/training/threshold-filter.perl " 
-                       + str(probThreshold) + " | gzip - > %s")%(phrasetable, newtable)
-        result = self.executor.run(pruneScript)
-        if result:        
-            config.replacePhraseTable(newtable)                          
-            phrasetable.remove()              
+        inputs = self._getPruningInputs(probThreshold, sigThreshold, maxTranslations)
+        if self._getCheckpoint("pruning", inputs):
+            print "Phrase table already pruned, skipping pruning"
+        elif not phraseTable.exists():
+            print "Original phrase table has been removed, pruning cancelled"
+            return False
         else:
-            print "Pruning of translation table FAILED"
+            nbSentences = None
+            if sigThreshold is not None:
+                alignFiles = [f for f in self.tm.listdir() if f.startswith("aligned.")]
+                if not alignFiles:
+                    raise RuntimeError("Word alignment needed for significance pruning")
+                nbSentences = (self.tm + "/" + alignFiles[0]).countNbLines()
+            
+            pruner = phrasetable.PhraseTablePruner(probThreshold, sigThreshold, nbSentences,
+                                                   maxTranslations, self.nbThreads)
+            try:
+                stats = pruner.prune(phraseTable, newtable)
+            except (RuntimeError, IOError, OSError) as e:
+                print "Pruning of translation table FAILED: " + str(e)
+                newtable.remove()
+                return False
+            print ("Pruned phrase table: %i entries out of %i kept"%(stats["kept"], stats["total"])
+                   + "".join([", %i removed by %s"%(stats[c], c) for c in phrasetable.criteria]))
+            self._completeStep("pruning", inputs, [newtable], stats)
+        
+        if config.getPhraseTable() != newtable:
+            config.replacePhraseTable(newtable)
+        if phraseTable.exists():
+            phraseTable.remove()
+        self._supersedeOutputs("pruning", [phraseTable, self.iniFile])
+        return True
+        
+    
+    def _getPruningInputs(self, probThreshold=0.0001, sigThreshold=None, maxTranslations=None):
+        """Returns the inputs of the pruning step, namely the phrase table recorded
+        in the checkpoint of the scoring stage and the pruning criteria.
+        
+        """
+        scoring = self.checkpoints.get("scoring")
+        return [sorted(scoring["outputs"].items()) if scoring else None, 
+                probThreshold, sigThreshold, maxTranslations]
         
 
-    def _constructTranslationModel(self, trainCorpus, alignment, reordering):
+    def _constructTranslationModel(self, trainCorpus, alignment, reordering, pruningArgs=None):
         """Internal method for constructing a translation model given a training 
         corpus, an alignment heuristic and a reordering method. The method returns 
-        the directory containing the resulting model data.
+        the directory containing the resulting model data.  Each stage of the 
+        training script is checkpointed, such that an interrupted training can 
+        be resumed from the last completed stage.  If the model is to be pruned
+        with the same arguments (pruningArgs) as the recorded pruning checkpoint,
+        the outputs superseded by the pruning need not be present.
         
         The method should not be called from outside the module, please use 
         trainTranslationModel(...) instead.
         
         """
         tmDir = self.expPath + "/translationmodel"
+        alignFile = self._getAlignment(trainCorpus, alignment, reordering)
+        superseding = {}
+        if pruningArgs is not None:
+            superseding["pruning"] = self._getPruningInputs(**pruningArgs)
+        
+        # the inputs of each stage include the inputs and recorded outputs of 
+        # previous stages
+        inputs = [trainCorpus.getSourceCorpus(), trainCorpus.getTargetCorpus(), 
+                  alignment, alignFile, reordering]
+        for stage, firstStep, lastStep, outputs in trainingStages:
+            outputs = [tmDir + "/model/" + output for output in outputs]
+            # step 9 writes the language model in the configuration file
+            stageInputs = inputs + (list(self.lm) if lastStep >= 9 else [])
+            if self._getCheckpoint(stage, stageInputs, superseding):
+                print "Stage '%s' already completed, skipping steps %i-%i"%(stage, firstStep, lastStep)
+            else:
+                tmScript = self._getTrainScript(tmDir, trainCorpus.getStem(), alignment, 
+                                                reordering, firstStep, lastStep)
+                result = self.executor.run(tmScript)
+                if not result:
+                    raise RuntimeError("construction of translation model FAILED (%s)"%stage)
+                self._completeStep(stage, stageInputs, outputs)
+            inputs.append(sorted(self.checkpoints[stage]["outputs"].items()))
+        return tmDir
+    
+    
+    def _getAlignment(self, trainCorpus, alignment, reordering):
+        """Returns the word alignment for the (processed) training corpus, which
+        is computed unless a checkpoint exists for it.  The word alignment does
+        not require the language model, and can thus be computed in parallel.
+        
+        """
+        tmDir = self.expPath + "/translationmodel"
+        inputs = [trainCorpus.getSourceCorpus(), trainCorpus.getTargetCorpus(), alignment]
+        alignFile = tmDir + "/model/aligned." + alignment
+        if self._getCheckpoint("alignment", inputs):
+            print "Word alignment already completed, skipping steps 1-3"
+        else:
+            self._alignCorpus(trainCorpus, tmDir, alignment, reordering)
+            self._completeStep("alignment", inputs, [alignFile])
+        return alignFile
+    
+    
+    def _alignCorpus(self, trainCorpus, tmDir, alignment, reordering):
+        """Aligns the words of the training corpus (steps 1 to 3 of the training 
+        script), and writes the alignment in {tmDir}/model/aligned.{alignment}.
+        
+        """
         tmDir.resetdir()
-        tmScript = self._getTrainScript(tmDir, trainCorpus.getStem(), alignment, reordering)
+        tmScript = self._getTrainScript(tmDir, trainCorpus.getStem(), alignment, 
+                                        reordering, 1, 3)
         result = self.executor.run(tmScript)
         if not result:
-            raise RuntimeError("construction of translation model FAILED")
-        return tmDir
+            raise RuntimeError("construction of translation model FAILED (alignment)")
 
 
 
@@ -628,21 +1114,25 @@ class Experiment(object):
             direction (int): direction for the estimation in step 2.  If left
                 unspecified, both directions are estimated.
         
+        The language model is only required for the creation of the 
+        configuration file (step 9).
+        
         """
-        if not self.lm: 
+        if not self.lm and lastStep >= 9: 
             raise RuntimeError("LM for " + self.targetLang  + " not yet trained")
         tmScript = (install.moses_root + "/scripts/training/train-model.perl" + " "
                     + "--root-dir " + tmDir + " -corpus " +  trainData
                     + " -f " + self.sourceLang + " -e " + self.targetLang 
                     + " -alignment " + alignment + " " 
                     + " -reordering " + reordering + " "
-                    + " -lm 0:" +str(self.lm[1])
-                    +":"+self.lm[0]+":8"       # 8 because binarised with KenLM
                     + " -external-bin-dir " + install.mgizapp_root + "/bin" 
                     + " -cores %i -mgiza -mgiza-cpus %i -parallel "
                     + " --first-step %i --last-step %i "
                     + " -sort-buffer-size 20%% -sort-compress gzip -sort-parallel %i" 
                     )%(self.nbThreads, self.nbThreads, firstStep, lastStep, self.nbThreads)
+        if self.lm:
+            # 8 because binarised with KenLM
+            tmScript += " -lm 0:" + str(self.lm[1]) + ":" + self.lm[0] + ":8"
         if direction:
             tmScript += " --direction " + str(direction)
         return tmScript
@@ -670,7 +1160,7 @@ class Experiment(object):
         
 
     
-    def _getTranslateScript(self, initFile=None, inputFile=None):
+    def _getTranslateScript(self, initFile=None, inputFile=None, decoder=None):
         """Forges the translation script (based on the Moses decoder) given the provided
         moses.ini configuration file and the input file to translate.
         
@@ -678,39 +1168,216 @@ class Experiment(object):
             initFile: Moses configuration file.  If left unspecified, uses self.iniFile.
             inputFile: input file to translate.  If left unspecified, translated from
                 standard input.
+            decoder: decoder executable.  If left unspecified, uses self.decoder.
         
         """
         if not initFile:
             initFile = self.iniFile
-        script = (self.decoder  + " -f " + initFile.encode('utf-8') 
+        if not decoder:
+            decoder = self.decoder
+        script = (decoder  + " -f " + initFile.encode('utf-8') 
                 + " -v 0 -threads " + str(self.nbThreads))
         if inputFile:
             script += " -input-file "+ inputFile
         return script
                                                                    
     
-    def _getFilteredModel(self, testSource):
+    def _getFilteredModel(self, testSource, maxFilteredModels=10):
         """Constructs a filtered translation model that is tailored for the particular
-        testing data.
+        testing data, and returns its directory.  The phrase and reordering tables
+        are filtered through their index (cf. phrasetable.PhraseTable), in a time 
+        proportional to the size of the input.  The filtered models are identified 
+        by the hash of the input and model, and reused for later translations of
+        the same input (the least recently used models being removed beyond 
+        maxFilteredModels).  The model is built in a temporary directory, which 
+        is only renamed once the filtering is complete.  Returns None if the 
+        tables are binarised (and therefore do not need filtering) or cannot be
+        filtered.
         
         Args:
             testSource: the aligned data to apply for the filter.
+            maxFilteredModels (int): maximum number of filtered models to keep
             
         """
         if not self.iniFile:
             raise RuntimeError("Translation model is not yet tuned")
-
-        filteredDir = self.expPath+ "/filteredmodel-" +  testSource.basename().getStem()
-        filteredDir.remove()
-
-        filterScript = (install.moses_root + "/scripts/training/filter-model-given-input.pl "
-                        + filteredDir + " " + self.iniFile + " "
-                        + testSource)
-                        #+ " -Binarizer "  + moses_root+"/bin/processPhraseTable")
-        self.executor.run(filterScript)
+        
+        config = MosesConfig(self.iniFile)
+        phraseTable = config.getPhraseTable()
+        reorderingTable = config.getReorderingTable()
+        tables = [table for table in [phraseTable, reorderingTable] if table]
+        if not phraseTable or any([phrasetable.isBinarised(table) or not os.path.isfile(table) 
+                                   for table in tables]):
+            print "Translation model is binarised, no filtering needed"
+            return None
+        
+        key = _getInputsHash([testSource, self.iniFile] + [(table, os.path.getmtime(table), 
+                                                            os.path.getsize(table))
+                                                           for table in tables])
+        filteredDir = self.expPath + "/filteredmodel-" + key[:12]
+        if (filteredDir + "/moses.ini").exists():
+            print "Reusing filtered model in " + filteredDir
+            os.utime(filteredDir, None)
+            return filteredDir
+        
+        print "Filtering translation model for " + testSource
+        tmpDir = Path(tempfile.mkdtemp(prefix="filteringmodel-", dir=self.expPath))
+        try:
+            phrases = phrasetable.getInputPhrases(testSource)
+            filteredConfig = MosesConfig(Path(self.iniFile).copy(tmpDir))
+            for table in tables:
+                reader = phrasetable.PhraseTable(table)
+                try:
+                    nbEntries = reader.writeSubset(phrases, tmpDir + "/" + table.basename())
+                finally:
+                    reader.close()
+                print "Filtered %s: %i entries"%(table.basename(), nbEntries)
+                # the configuration refers to the final location of the tables
+                filteredTable = filteredDir + "/" + table.basename()
+                if table == phraseTable:
+                    filteredConfig.replacePhraseTable(filteredTable, "PhraseDictionaryMemory")
+                else:
+                    filteredConfig.replaceReorderingTable(filteredTable)
+            if not (filteredDir + "/moses.ini").exists():
+                filteredDir.remove()
+                os.rename(tmpDir, filteredDir)
+        except (RuntimeError, IOError, OSError, zlib.error) as e:
+            print "Filtering of translation model FAILED, using unfiltered model: " + str(e)
+            return None
+        finally:
+            if tmpDir.exists():
+                tmpDir.remove()
+        
+        filteredDirs = sorted([self.expPath + "/" + d for d in self.expPath.listdir() 
+                               if d.startswith("filteredmodel-")], key=os.path.getmtime)
+        for oldDir in filteredDirs[:-maxFilteredModels]:
+            oldDir.remove()
         return filteredDir
             
     
+    def _processAlignedCorpus(self, corpus, step, maxLength=80):
+        """Processes the aligned corpus (cf. CorpusProcessor.processAlignedCorpus),
+        unless the processing step was already completed with the same input.
+        
+        """
+        inputs = [corpus.getSourceCorpus(), corpus.getTargetCorpus(), maxLength]
+        checkpoint = self._getCheckpoint(step, inputs)
+        if checkpoint:
+            print "Corpus %s already processed, skipping %s"%(corpus.getStem(), step)
+            return AlignedCorpus(checkpoint["result"], self.sourceLang, self.targetLang)
+        processed = self.processor.processAlignedCorpus(corpus, maxLength)
+        self._completeStep(step, inputs, [processed.getSourceCorpus(), 
+                                          processed.getTargetCorpus()], processed.getStem())
+        return processed
+    
+    
+    def _getCheckpoint(self, step, inputs, supersedingInputs=None):
+        """Returns the checkpoint recorded for the step if the step was completed 
+        with the same inputs and its outputs are unchanged, and None otherwise.
+        Outputs that were modified or removed by a later step (cf. 
+        _supersedeOutputs) are valid as long as the outputs of this later step
+        are unchanged.
+        
+        Args:
+            step (str): name of the step
+            inputs (list): input files and parameters of the step
+            supersedingInputs (dict): if provided, only the steps in the dictionary
+                may supersede the outputs, and their recorded inputs must match
+                the provided ones.
+        
+        """
+        checkpoint = self.checkpoints.get(step)
+        if (not checkpoint or checkpoint["inputs"] != _getInputsHash(inputs, self.expPath)
+            or not self._hasValidOutputs(step, supersedingInputs)):
+            return None
+        return checkpoint
+    
+    
+    def _hasValidOutputs(self, step, supersedingInputs=None, visited=()):
+        """Returns true if the outputs recorded for the step are unchanged, or 
+        superseded by a later step with valid outputs.
+        
+        """
+        checkpoint = self.checkpoints.get(step)
+        if not checkpoint or step in visited:
+            return False
+        superseded = checkpoint.get("superseded", {})
+        for output, fingerprint in checkpoint["outputs"].items():
+            if output not in superseded:
+                if _getFingerprint(output) != fingerprint:
+                    return False
+                continue
+            laterStep = superseded[output]
+            if supersedingInputs is not None:
+                if (laterStep not in supersedingInputs or laterStep not in self.checkpoints
+                    or (self.checkpoints[laterStep]["inputs"] != 
+                        _getInputsHash(supersedingInputs[laterStep], self.expPath))):
+                    return False
+            if not self._hasValidOutputs(laterStep, supersedingInputs, visited + (step,)):
+                return False
+        return True
+    
+    
+    def _completeStep(self, step, inputs, outputs, result=None):
+        """Records the completion of the step in the experiment state, with the 
+        hash of its inputs, the fingerprints of its output files, and an optional
+        result.
+        
+        """
+        with self.stateLock:
+            self.checkpoints[step] = {"inputs": _getInputsHash(inputs, self.expPath), 
+                                      "result": result,
+                                      "outputs": dict([(output, _getFingerprint(output)) 
+                                                       for output in outputs])}
+            self._recordState()
+    
+    
+    def _supersedeOutputs(self, step, outputs):
+        """Marks the output files (modified or removed by the step) as superseded
+        by the step in the checkpoints of the other steps, such that these steps
+        remain completed as long as the outputs of the step are unchanged.
+        
+        """
+        with self.stateLock:
+            for otherStep, checkpoint in self.checkpoints.items():
+                for output in outputs:
+                    if otherStep != step and output in checkpoint["outputs"]:
+                        checkpoint.setdefault("superseded", {})[output] = step
+            self._recordState()
+    
+    
+    def _getDecoderSession(self):
+        """Returns the resident decoder session (if any). If the configuration file
+        of the experiment has changed since the start of the session (e.g. after
+        tuning), the session is restarted with the new configuration.
+        
+        """
+        if self.decoderSession and self.decoderSession.iniFile != self.iniFile:
+            self.startDecoder(len(self.decoderSession.decoders))
+        return self.decoderSession
+            
+    
+    def _getStatisticsFile(self):
+        """Returns the path to the file containing the sentence-level BLEU 
+        statistics for the translation results.
+        
+        """
+        return self.results.getTranslationCorpus().getStem() + ".stats"
+    
+    
+    def _getResultStatistics(self):
+        """Returns the sentence-level scoring statistics for the translation
+        results (reloaded from their file if possible).
+        
+        """
+        if not self.results:
+            raise RuntimeError("Results must first be generated with evaluateBLEU(...)")
+        statsFile = self._getStatisticsFile()
+        if statsFile.exists():
+            return scoring.loadBleuStatistics(statsFile)
+        return scoring.getStatistics(self.results)
+            
+    
     def _recordState(self):
         """Records the current state of the experiment in the JSON file.
         
@@ -718,6 +1385,8 @@ class Experiment(object):
         settings = {"path":self.expPath, "source":self.sourceLang, "target":self.targetLang}
         if self.lm:
             settings["lm"] = {"lm":self.lm[0], "ngram_order":self.lm[1]}
+            if self.lmStats:
+                settings["lm"]["stats"] = self.lmStats
         if self.tm:
             settings["tm"] = self.tm
         if self.iniFile:
@@ -725,9 +1394,14 @@ class Experiment(object):
         if self.results:
             settings["results"] = {"stem":self.results.getStem(), 
                                    "translation":self.results.getTranslationCorpus()}
-        dump = json.dumps(settings)
-        with open(self.expPath+"/settings.json", 'w') as jsonFile:
-            jsonFile.write(dump)
+        with self.stateLock:
+            if self.checkpoints:
+                settings["checkpoints"] = self.checkpoints
+            if self.timings:
+                settings["timings"] = self.timings
+            dump = json.dumps(settings)
+            with open(self.expPath+"/settings.json", 'w') as jsonFile:
+                jsonFile.write(dump)
             
             
     def _reloadState(self):
@@ -744,6 +1418,7 @@ class Experiment(object):
             if settings.has_key("lm"):
                 lm = settings["lm"]
                 self.lm = (Path(lm["lm"]), int(lm["ngram_order"]))
+                self.lmStats = lm.get("stats")
             if settings.has_key("tm"):
                 self.tm = Path(settings["tm"])
             if settings.has_key("ini"):
@@ -752,8 +1427,95 @@ class Experiment(object):
                 self.results = ReferenceCorpus(settings["results"]["stem"], 
                                                self.sourceLang, self.targetLang)
                 self.results.addTranslation(settings["results"]["translation"])            
+            if settings.has_key("checkpoints"):
+                self.checkpoints = settings["checkpoints"]
+            if settings.has_key("timings"):
+                self.timings = settings["timings"]
            
     
+class DecoderSession(object):
+    """Resident session of Moses decoder processes.  The processes are started
+    once and keep their models loaded in memory, such that translation requests
+    are only bound by the decoding time.  The input sentences are distributed
+    between the decoder instances of the session.
+    
+    """
+    
+    def __init__(self, transScript, iniFile, nbInstances=1):
+        """Starts a new session with the translation script and configuration file.
+        
+        Args:
+            transScript (str): the decoder command (reading from standard input)
+            iniFile (str): the Moses configuration file employed by the script
+            nbInstances (int): number of decoder processes
+        
+        """
+        self.iniFile = iniFile
+        self.decoders = [system.CoProcess(transScript, quiet=False) 
+                         for _ in range(0, max(1, nbInstances))]
+        for decoder in self.decoders:
+            decoder.start()
+    
+    
+    def translate(self, text):
+        """Translates the text (with one sentence per line) and returns the result.
+        
+        """
+        return "\n".join(self.translateLines(text.strip("\n").split("\n")))
+    
+    
+    def translateLines(self, lines):
+        """Translates the list of sentences (without line breaks) and returns the
+        list of translations.
+        
+        """
+        chunkSize = (len(lines)-1)/len(self.decoders) + 1
+        chunks = [lines[i:i+chunkSize] for i in range(0, len(lines), chunkSize)]
+        if len(chunks) <= 1:
+            return self.decoders[0].processLines(lines)
+        
+        outputs = [None]*len(chunks)
+        errors = []
+        def translateChunk(i):
+            try:
+                outputs[i] = self.decoders[i].processLines(chunks[i])
+            except Exception:
+                errors.append(sys.exc_info())
+        threads = [threading.Thread(target=translateChunk, args=(i,)) 
+                   for i in range(0, len(chunks))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            # re-raising the first error with its original traceback
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return [output for chunkOutputs in outputs for output in chunkOutputs]
+    
+    
+    def translateFile(self, inputFile, outputFile, batchSize=1000):
+        """Translates the sentences in inputFile and writes the results in 
+        outputFile. The input is processed in batches of batchSize sentences.
+        
+        """
+        with open(inputFile, 'r') as inputD:
+            with open(outputFile, 'w') as outputD:
+                while True:
+                    batch = list(itertools.islice(inputD, batchSize))
+                    if not batch:
+                        break
+                    translations = self.translateLines([l.rstrip("\n") for l in batch])
+                    outputD.writelines([t + "\n" for t in translations])
+    
+    
+    def close(self):
+        """Terminates the decoder processes.
+        
+        """
+        for decoder in self.decoders:
+            decoder.close()
+        
+    
 class MosesConfig():
     """Representation of a moses.ini configuration file.  The class provides
     functions to easily extract and modify information in this file.
@@ -776,24 +1538,36 @@ class MosesConfig():
         parts = self._getParts() 
         if parts.has_key("feature"):
             for l in parts["feature"]:
-                if "PhraseDictionary" in l:
+                if "PhraseDictionary" in l or l.startswith("ProbingPT"):
                     s = re.search(re.escape("path=") + r"((\S)+)", l)
                     if s:
                         return Path(s.group(1))
         print "Cannot find path to phrase table"
         
     
-    def replacePhraseTable(self, newPath, phraseType="PhraseDictionaryMemory"):
+    def replacePhraseTable(self, newPath, phraseType=None):
         """Replaces the path to the phrase table with a new path.  In addition,
         the type of the phrase table can be modified (useful when doing e.g.
-        binarisation).
+        binarisation).  If the type is not specified, it is derived from the
+        new phrase table: PhraseDictionaryCompact for *.minphr files, ProbingPT
+        for directories, PhraseDictionaryBinary if *.binphr.* files are present,
+        and PhraseDictionaryMemory otherwise.
         
         """
+        if not phraseType:
+            if newPath.endswith(".minphr"):
+                phraseType = "PhraseDictionaryCompact"
+            elif os.path.isdir(newPath):
+                phraseType = "ProbingPT"
+            elif os.path.exists(newPath + ".binphr.idx"):
+                phraseType = "PhraseDictionaryBinary"
+            else:
+                phraseType = "PhraseDictionaryMemory"
         parts = self._getParts() 
         if parts.has_key("feature"):
             newList = []
             for l in parts["feature"]:
-                if "PhraseDictionary" in l:
+                if "PhraseDictionary" in l or l.startswith("ProbingPT"):
                     s = re.search(re.escape("path=") + r"((\S)+)", l)
                     if s:
                         existingPath = s.group(1)
@@ -804,6 +1578,15 @@ class MosesConfig():
         self._updateFile(parts)
         
 
+    def getPhraseTableReader(self, cacheSize=100000):
+        """Returns a reader for the phrase table specified in the configuration 
+        file, to look up the translations of source phrases (cf. 
+        phrasetable.PhraseTable).
+        
+        """
+        return phrasetable.PhraseTable(self.getPhraseTable(), cacheSize)
+    
+    
     def getReorderingTable(self):
         """Returns the path to the reordering table file as specified in the
         configuration file.
@@ -931,6 +1714,54 @@ class MosesConfig():
     
     
 
+def _getInputsHash(inputs, localDir=None):
+    """Returns a hash for the inputs of an experiment step.  Files produced in 
+    the local directory are identified by their fingerprint, other existing 
+    files by their content, and other inputs by their string representation.
+    
+    """
+    sha = hashlib.sha1()
+    for inp in inputs:
+        if isinstance(inp, basestring) and os.path.isfile(inp):
+            if localDir and Path(inp).getAbsolute().startswith(Path(localDir).getAbsolute() + "/"):
+                sha.update("local:" + inp + ":" + _getFingerprint(inp))
+            else:
+                sha.update("file:" + Path(inp).getHash())
+        else:
+            sha.update("value:" + str(inp))
+        sha.update("\n")
+    return sha.hexdigest()
+
+
+def _getFingerprint(filePath):
+    """Returns the fingerprint (size and modification time) of a local file, or
+    None if the file does not exist.
+    
+    """
+    if not os.path.isfile(filePath):
+        return None
+    return "%i:%.6f"%(os.path.getsize(filePath), os.path.getmtime(filePath))
+
+
+def _getBinaryOptions(binaryFormat):
+    """Returns the build_binary options for the format of the binarised language
+    model (cf. Experiment.trainLanguageModel).
+    
+    """
+    binaryFormat = dict(binaryFormat or {})
+    lmType = binaryFormat.pop("type", "probing")
+    bitOptions = {"probBits":"-q", "backoffBits":"-b", "pointerBits":"-a"}
+    if lmType not in ["probing", "trie"]:
+        raise RuntimeError("Unknown type for the language model: " + str(lmType))
+    for key in binaryFormat:
+        if key not in bitOptions:
+            raise RuntimeError("Unknown option for the language model: " + key)
+        elif lmType != "trie":
+            raise RuntimeError("Option " + key + " is only available for trie models")
+    options = ["%s %i"%(bitOptions[key], binaryFormat[key]) for key in sorted(binaryFormat)]
+    return " ".join(options + [lmType])
+
+
 def checkEnvironment():
     """Checking that all executables and binaries are in place for the experiment.
     If not, raises a runtime error. All third-party tools (Moses, MGIZA++ IRSTLM)
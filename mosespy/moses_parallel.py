@@ -102,7 +102,7 @@ def mergeOutFiles(outfiles, outStream):
     """
     for outfile_part in outfiles:
         with open(outfile_part, 'r') as part:
-            for partline in part.readlines():
+            for partline in part:
                 if partline.strip():
                     outStream.write(partline.strip('\n') + '\n')
     outStream.close()
@@ -131,7 +131,7 @@ def mergeNbestOutFiles(nbestOutPartFiles, nbestOutFile):
     with open(nbestOutFile, 'w') as nbestout_full:
         for nbestOutPartFile in nbestOutPartFiles:
             with open(nbestOutPartFile, 'r') as nbestout_part:
-                for partline in nbestout_part.readlines():
+                for partline in nbestout_part:
                     if partline.strip():
                         newCount = int(partline.split(" ")[0])
                         if newCount == localCount + 1:
@@ -193,10 +193,11 @@ def runParallelMoses(sourceInput, mosesArgs, outStream, nbJobs):
     else:
         executor = slurm.SlurmExecutor()        
         splits = splitDecoding(sourceInput, mosesArgs, nbJobs)
-        jobArgs = [split["args"] for split in splits]
+        scripts = [install.decoder + " " + split["args"] for split in splits]
         stdins = [split["in"] for split in splits]
         stdouts = [split["out"] for split in splits]
-        executor.run_parallel(install.decoder + " %s", jobArgs, stdins, stdouts)
+        if not executor.run_parallel(scripts, stdins, stdouts):
+            raise RuntimeError("Parallel decoding of %s has failed"%(sourceInput))
 
         mergeOutFiles([split["out"] for split in splits], outStream)
         
@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================                                                                   
+# Copyright (C) 2014-2017 Pierre Lison (plison@ifi.uio.no)
+                                                                            
+# Permission is hereby granted, free of charge, to any person 
+# obtaining a copy of this software and associated documentation 
+# files (the "Software"), to deal in the Software without restriction, 
+# including without limitation the rights to use, copy, modify, merge, 
+# publish, distribute, sublicense, and/or sell copies of the Software, 
+# and to permit persons to whom the Software is furnished to do so, 
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be 
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, 
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. 
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY 
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, 
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE 
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+# =================================================================  
+
+
+"""Module for processing Moses phrase tables in Python.  The module
+provides a streaming pruner for (gzipped) phrase tables, which filters
+the entries by probability threshold, by statistical significance (as
+in Johnson et al., 2007) and by number of translations per source phrase,
+and a reader for looking up the translations of source phrases without
+running the decoder.
+
+The phrase table is read from a decompression process, and processed
+by chunks of consecutive source phrases in parallel processes.  Each 
+chunk is compressed as a separate gzip member, and the members are 
+concatenated (in order) in the output file, which remains a valid gzip
+file for Moses and standard tools.
+
+"""
+__author__ = 'Pierre Lison (plison@ifi.uio.no)'
+__copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
+__license__ = 'MIT License'
+
+import os, math, zlib, gzip, bisect, threading, collections, multiprocessing, subprocess
+import mosespy.system as system
+from mosespy.system import Path
+
+# Index of the direct phrase translation probability p(e|f) in the scores
+directProbIndex = 2
+
+# Margin around the significance threshold log(N) for 'a+e' and 'a-e'
+sigEpsilon = 0.01
+
+# Pruning criteria, in the order in which they are applied
+criteria = ["threshold", "significance", "topk"]
+
+# Maximum length (in words) of the source phrases in the phrase tables
+maxPhraseLength = 7
+
+# Indices and lookup caches of the phrase tables, shared by all readers, 
+# and locks on each table path (the global lock only guards the dictionaries)
+_tables = {}
+_tableLocks = {}
+_tablesLock = threading.Lock()
+
+
+class PhraseTablePruner(object):
+    """Streaming pruner for phrase tables.  Entries are removed if their 
+    direct translation probability p(e|f) is below a threshold, if the 
+    association between the source and target phrases is not significant 
+    (negative log p-value of Fisher's exact test below a threshold), or if 
+    they are not among the k most probable translations of the source phrase.
+    
+    The significance test relies on the counts recorded in the phrase table
+    (which are phrase counts, not sentence co-occurrence counts as in the 
+    original method).  Entries without counts are never pruned by this test.
+    
+    """
+    
+    def __init__(self, probThreshold=0.0001, sigThreshold=None, nbSentences=None, 
+                 maxTranslations=None, nbProcesses=None, chunkSize=4*1024**2, 
+                 compressLevel=6):
+        """Creates a new pruner with the given criteria.
+        
+        Args:
+            probThreshold (float): minimum p(e|f) for the entries (None for no limit)
+            sigThreshold: minimum negative log p-value for the entries, either as
+                a float or as 'a+e' or 'a-e' (log(N) plus or minus a small margin, 
+                where N is the number of sentence pairs).  None for no limit.
+            nbSentences (int): number of sentence pairs in the training data 
+                (required for the significance test).
+            maxTranslations (int): maximum number of translations per source
+                phrase, keeping the most probable ones (None for no limit)
+            nbProcesses (int): number of parallel processes (by default, the
+                number of CPUs)
+            chunkSize (int): approximate size (in bytes) of each chunk
+            compressLevel (int): gzip compression level for the output
+        
+        """
+        if sigThreshold is not None:
+            if not nbSentences:
+                raise RuntimeError("Significance pruning requires the number of sentences")
+            elif sigThreshold == "a+e":
+                sigThreshold = math.log(nbSentences) + sigEpsilon
+            elif sigThreshold == "a-e":
+                sigThreshold = math.log(nbSentences) - sigEpsilon
+            elif not isinstance(sigThreshold, (int, float)):
+                raise RuntimeError("Invalid significance threshold: " + str(sigThreshold))
+        self.params = (probThreshold, sigThreshold, nbSentences, maxTranslations, 
+                       compressLevel)
+        self.nbProcesses = nbProcesses or multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+        
+    
+    def prune(self, inputFile, outputFile):
+        """Prunes the (gzipped) phrase table in inputFile, and writes the result 
+        in outputFile (also gzipped).  Returns the statistics of the pruning, as 
+        a dictionary with the total number of entries, the number of entries 
+        kept, and the number of entries removed by each criterion.
+        
+        """
+        stats = collections.OrderedDict([("total", 0), ("kept", 0)] 
+                                        + [(criterion, 0) for criterion in criteria])
+        reader = _openTable(inputFile)
+        chunks = _iterChunks(reader.stdout, self.chunkSize)
+        pool = multiprocessing.Pool(self.nbProcesses) if self.nbProcesses > 1 else None
+        try:
+            with open(outputFile, 'wb') as output:
+                for block, chunkStats in _iterResults(chunks, self.params, pool, 
+                                                      2*self.nbProcesses):
+                    output.write(block)
+                    for key in chunkStats:
+                        stats[key] += chunkStats[key]
+                if not stats["kept"]:
+                    output.write(_compress("", self.params[-1]))
+            if reader.wait() != 0:
+                raise RuntimeError("Decompression of " + inputFile + " FAILED")
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            if reader.poll() is None:
+                reader.kill()
+                reader.wait()
+            reader.stdout.close()
+        return stats
+    
+
+
+class PhraseTable(object):
+    """Reader for a (gzipped) phrase table, providing the translations of 
+    source phrases without running the decoder.  The table must be sorted 
+    by source phrase (as produced by Moses).  
+    
+    On first use, the table is copied in {table}.blocks.gz as a sequence of 
+    small gzip members (each containing complete source phrases), together 
+    with a sorted index {table}.index of the first source phrase and offset
+    of each member.  A lookup then only decompresses one member.  The 
+    results of the lookups are stored in an LRU cache, which is shared by 
+    all readers (and threads) for the same table.
+    
+    Binarised tables (compact, probing or binary) cannot be read, please
+    use the original text table instead.
+    
+    """
+    
+    def __init__(self, tablePath, cacheSize=100000, blockSize=64*1024):
+        """Opens the phrase table, and builds its index if necessary.
+        
+        Args:
+            tablePath (str): path to the phrase table (gzipped or not)
+            cacheSize (int): maximum number of source phrases in the cache
+            blockSize (int): approximate size (uncompressed) of the indexed blocks
+        
+        """
+        self.tablePath = Path(tablePath).getAbsolute()
+        if isBinarised(self.tablePath):
+            raise RuntimeError("Cannot read binarised phrase table " + self.tablePath)
+        elif not self.tablePath.exists():
+            raise RuntimeError("Phrase table " + self.tablePath + " does not exist")
+        
+        self.blocksFile = Path(self.tablePath + ".blocks.gz")
+        self.indexFile = Path(self.tablePath + ".index")
+        key = (self.tablePath, os.path.getmtime(self.tablePath))
+        with _tablesLock:
+            tableLock = _tableLocks.setdefault(self.tablePath, threading.Lock())
+        with tableLock:
+            if key not in _tables:
+                if (not self.indexFile.exists() or not self.blocksFile.exists() or 
+                    os.path.getmtime(self.indexFile) < os.path.getmtime(self.tablePath)):
+                    self._buildIndex(blockSize)
+                table = (self._loadIndex(), _LRUCache(cacheSize))
+                with _tablesLock:
+                    for staleKey in [k for k in _tables if k[0] == self.tablePath]:
+                        del _tables[staleKey]
+                    _tables[key] = table
+            (self.keys, self.offsets), self.cache = _tables[key]
+        self.blocks = open(self.blocksFile, 'rb')
+        self.lock = threading.Lock()
+    
+    
+    def getTranslations(self, sourcePhrase):
+        """Returns the translations of the source phrase, as a list of tuples
+        (target phrase, list of scores), in the order of the phrase table.  
+        The list is empty if the source phrase is not in the table.
+        
+        """
+        if isinstance(sourcePhrase, unicode):
+            sourcePhrase = sourcePhrase.encode("utf-8")
+        sourcePhrase = sourcePhrase.strip()
+        translations = self.cache.get(sourcePhrase)
+        if translations is None:
+            translations = self._lookup(sourcePhrase)
+            self.cache.put(sourcePhrase, translations)
+        return translations
+    
+    
+    def writeSubset(self, sourcePhrases, outputFile):
+        """Writes the entries of the table for the given source phrases in 
+        outputFile (gzipped), in the order of the table.  Each block of the 
+        table is only decompressed once, such that the time is proportional 
+        to the number of source phrases.  Returns the number of entries written.
+        
+        """
+        prefixes = sorted(set(phrase.strip() + " ||| " for phrase in sourcePhrases))
+        nbEntries = 0
+        with open(outputFile, 'wb') as output:
+            currentBlock = None
+            entries = []
+            for prefix in prefixes:
+                i = bisect.bisect_right(self.keys, prefix) - 1
+                if i < 0:
+                    continue
+                elif i != currentBlock:
+                    lines = self._readBlock(i)
+                    currentBlock = i
+                for line in _getEntries(lines, prefix):
+                    entries.append(line + "\n")
+                if len(entries) > 10000:
+                    output.write(_compress("".join(entries), 6))
+                    nbEntries += len(entries)
+                    entries = []
+            nbEntries += len(entries)
+            output.write(_compress("".join(entries), 6))
+        return nbEntries
+    
+    
+    def close(self):
+        """Closes the phrase table.
+        
+        """
+        self.blocks.close()
+        
+        
+    def _lookup(self, sourcePhrase):
+        """Looks up the translations of the source phrase in the indexed blocks.
+        
+        """
+        prefix = sourcePhrase + " ||| "
+        i = bisect.bisect_right(self.keys, prefix) - 1
+        if i < 0:
+            return []
+        translations = []
+        for line in _getEntries(self._readBlock(i), prefix):
+            fields = line.split(" ||| ")
+            translations.append((fields[1], [float(s) for s in fields[2].split()]))
+        return translations
+    
+    
+    def _readBlock(self, i):
+        """Returns the (sorted) lines of the i-th block of the table.
+        
+        """
+        with self.lock:
+            self.blocks.seek(self.offsets[i])
+            data = self.blocks.read(self.offsets[i+1] - self.offsets[i])
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS).splitlines()
+    
+    
+    def _buildIndex(self, blockSize):
+        """Copies the phrase table in blocks starting with a new source phrase, 
+        and writes the index of the blocks.
+        
+        """
+        print "Indexing phrase table " + self.tablePath
+        reader = _openTable(self.tablePath)
+        index = []
+        offset = 0
+        tmpSuffix = ".%i-%i.tmp"%(os.getpid(), threading.current_thread().ident)
+        try:
+            with open(self.blocksFile + tmpSuffix, 'wb') as blocks:
+                for chunk in _iterChunks(reader.stdout, blockSize):
+                    prefix = chunk[0][:chunk[0].find(" ||| ")+5]
+                    if index and prefix < index[-1][0]:
+                        raise RuntimeError("Phrase table " + self.tablePath + " is not sorted")
+                    block = _compress("".join(chunk), 6)
+                    blocks.write(block)
+                    index.append((prefix, offset))
+                    offset += len(block)
+            if reader.wait() != 0:
+                raise RuntimeError("Decompression of " + self.tablePath + " FAILED")
+        finally:
+            if reader.poll() is None:
+                reader.kill()
+                reader.wait()
+            reader.stdout.close()
+        
+        Path(self.blocksFile + tmpSuffix).rename(self.blocksFile)
+        with open(self.indexFile + tmpSuffix, 'w') as indexD:
+            for prefix, blockOffset in index:
+                indexD.write("%s\t%i\n"%(prefix, blockOffset))
+            indexD.write("\t%i\n"%offset)
+        Path(self.indexFile + tmpSuffix).rename(self.indexFile)
+    
+    
+    def _loadIndex(self):
+        """Loads the index, as a list of source prefixes for each block, and the 
+        list of block offsets (with the end offset of the last block).
+        
+        """
+        keys = []
+        offsets = []
+        with open(self.indexFile) as indexD:
+            for line in indexD:
+                prefix, offset = line.rstrip("\n").split("\t")
+                if prefix:
+                    keys.append(prefix)
+                offsets.append(int(offset))
+        return keys, offsets
+    
+    
+    
+class _LRUCache(object):
+    """Thread-safe cache with a maximum number of entries, where the least
+    recently used entries are removed first.
+    
+    """
+    
+    def __init__(self, maxSize):
+        self.entries = collections.OrderedDict()
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        
+    
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+    
+    
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        
+
+
+def getInputPhrases(inputFile, maxLength=maxPhraseLength):
+    """Returns the set of phrases (of at most maxLength words) occurring in 
+    the input file.
+    
+    """
+    phrases = set()
+    with open(inputFile) as inputD:
+        for line in inputD:
+            words = line.split()
+            for i in range(0, len(words)):
+                for j in range(i+1, min(i+maxLength, len(words))+1):
+                    phrases.add(" ".join(words[i:j]))
+    return phrases
+
+
+def isBinarised(tablePath):
+    """Returns true if the phrase or reordering table is binarised (in the 
+    compact, probing or binary format), and false otherwise.
+    
+    """
+    return (tablePath.endswith(".minphr") or tablePath.endswith(".minlexr") 
+            or os.path.isdir(tablePath) or os.path.exists(tablePath + ".minlexr")
+            or os.path.exists(tablePath + ".binphr.idx") 
+            or os.path.exists(tablePath + ".binlexr.idx"))
+
+
+def getNbScores(phraseTable):
+    """Returns the number of scores in the entries of the (gzipped) phrase table.
+    
+    """
+    with gzip.open(phraseTable) as table:
+        line = table.readline()
+    fields = line.split(" ||| ")
+    if len(fields) < 3:
+        raise RuntimeError("Phrase table " + phraseTable + " is empty or malformed")
+    return len(fields[2].split())
+
+
+def getSignificance(jointCount, sourceCount, targetCount, nbSentences):
+    """Returns the negative log p-value of Fisher's exact test (one-sided) for
+    the co-occurrence of a source and target phrase.
+    
+    Args:
+        jointCount (int): number of co-occurrences
+        sourceCount (int): number of occurrences of the source phrase
+        targetCount (int): number of occurrences of the target phrase
+        nbSentences (int): total number of sentences
+    
+    """
+    sourceCount = min(sourceCount, nbSentences)
+    targetCount = min(targetCount, nbSentences)
+    jointCount = min(jointCount, sourceCount, targetCount)
+    def logHypergeom(k):
+        return (_logComb(sourceCount, k) + _logComb(nbSentences - sourceCount, targetCount - k)
+                - _logComb(nbSentences, targetCount))
+    
+    # the sum of the hypergeometric probabilities for k >= jointCount is computed
+    # relative to the first term, and stops when the terms become negligible
+    first = logHypergeom(jointCount)
+    total = 0.0
+    for k in xrange(jointCount, min(sourceCount, targetCount)+1):
+        term = math.exp(logHypergeom(k) - first)
+        total += term
+        if term < 1e-10 * total and k > jointCount:
+            break
+    return max(0.0, -(first + math.log(total)))
+
+
+def _logComb(n, k):
+    """Returns the log of the binomial coefficient (n k).
+    
+    """
+    if k < 0 or k > n:
+        return float("-inf")
+    return math.lgamma(n+1) - math.lgamma(k+1) - math.lgamma(n-k+1)
+
+
+def _getEntries(lines, prefix):
+    """Returns the lines starting with the prefix in the sorted lines.
+    
+    """
+    start = bisect.bisect_left(lines, prefix)
+    end = start
+    while end < len(lines) and lines[end].startswith(prefix):
+        end += 1
+    return lines[start:end]
+
+
+def _openTable(tablePath):
+    """Returns a process decompressing the phrase table on its standard output.
+    
+    """
+    zcatExec = ("pigz -dcf" if system.existsExecutable("pigz") else 
+                "gzcat -f" if system.existsExecutable("gzcat") else "zcat -f")
+    return subprocess.Popen(zcatExec + " " + tablePath, shell=True, 
+                            stdout=subprocess.PIPE, bufsize=1024**2)
+
+
+def _iterChunks(lines, chunkSize):
+    """Iterates over chunks of lines of approximately chunkSize bytes.  The
+    chunks only end at a change of source phrase, such that all translations
+    of a source phrase are in the same chunk.
+    
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        if size >= chunkSize and not line.startswith(lastSource):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+        if size >= chunkSize:
+            lastSource = line[:line.find(" ||| ")+5]
+    if chunk:
+        yield chunk
+        
+
+def _iterResults(chunks, params, pool, maxPending):
+    """Iterates (in order) over the pruned chunks, with at most maxPending chunks
+    being processed at the same time (to avoid reading the full table in memory).
+    
+    """
+    if not pool:
+        for chunk in chunks:
+            yield _pruneChunk(chunk, params)
+        return
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_pruneChunk, (chunk, params)))
+        if len(pending) >= maxPending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+    
+
+def _pruneChunk(chunk, params):
+    """Prunes a chunk of phrase table entries, and returns the pruned chunk
+    (compressed as a gzip member) with its statistics.
+    
+    """
+    probThreshold, sigThreshold, nbSentences, maxTranslations, compressLevel = params
+    stats = dict([("total", len(chunk)), ("kept", 0)] + [(c, 0) for c in criteria])
+    kept = []
+    translations = []
+    source = None
+    for line in chunk:
+        fields = line.split(" ||| ")
+        if fields[0] != source:
+            kept += _getTopTranslations(translations, maxTranslations, stats)
+            translations = []
+            source = fields[0]
+        scores = fields[2].split()
+        prob = float(scores[directProbIndex]) if len(scores) > directProbIndex else 1.0
+        if probThreshold and prob < probThreshold:
+            stats["threshold"] += 1
+            continue
+        if sigThreshold is not None and len(fields) > 4:
+            counts = [int(round(float(c))) for c in fields[4].split()]
+            if (len(counts) >= 3 and getSignificance(counts[2], counts[1], counts[0], 
+                                                     nbSentences) < sigThreshold):
+                stats["significance"] += 1
+                continue
+        translations.append((prob, line))
+    kept += _getTopTranslations(translations, maxTranslations, stats)
+    stats["kept"] = len(kept)
+    
+    return (_compress("".join(kept), compressLevel) if kept else ""), stats
+
+
+def _compress(data, compressLevel):
+    """Compresses the data as a gzip member.
+    
+    """
+    compressor = zlib.compressobj(compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _getTopTranslations(translations, maxTranslations, stats):
+    """Returns the lines for the most probable translations of a source phrase 
+    (in their original order), and counts the removed ones in the statistics.
+    
+    """
+    if not maxTranslations or len(translations) <= maxTranslations:
+        return [line for _, line in translations]
+    stats["topk"] += len(translations) - maxTranslations
+    ranked = sorted(range(len(translations)), key=lambda i : -translations[i][0])
+    selected = sorted(ranked[:maxTranslations])
+    return [translations[i][1] for i in selected]
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+
+# =================================================================                                                                   
+# Copyright (C) 2014-2017 Pierre Lison (plison@ifi.uio.no)
+                                                                            
+# Permission is hereby granted, free of charge, to any person 
+# obtaining a copy of this software and associated documentation 
+# files (the "Software"), to deal in the Software without restriction, 
+# including without limitation the rights to use, copy, modify, merge, 
+# publish, distribute, sublicense, and/or sell copies of the Software, 
+# and to permit persons to whom the Software is furnished to do so, 
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be 
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, 
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. 
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY 
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, 
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE 
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+# =================================================================  
+
+
+"""Module for evaluating translation outputs against one or more
+reference translations, without calling external scripts.  The module
+computes sufficient statistics for each sentence (n-gram matches and
+lengths for BLEU, character n-gram matches for chrF, and edit counts
+for TER), from which corpus-level scores are derived.  The BLEU statistics
+are computed eagerly, while the (costlier) chrF and TER statistics are only
+computed when these scores are requested.  The statistics of the most recent
+reference corpora are cached, such that several scores (or several calls for
+the same results) only require one pass over the data.
+
+The BLEU score follows the conventions of the Moses script multi-bleu.perl
+(closest reference length for the brevity penalty, 4-gram precisions).
+
+"""
+__author__ = 'Pierre Lison (plison@ifi.uio.no)'
+__copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
+__license__ = 'MIT License'
+
+import math, os, collections, random, threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maximum n-gram order for BLEU
+bleuOrder = 4
+
+# Maximum character n-gram order and beta parameter for chrF
+chrfOrder = 6
+chrfBeta = 2
+
+# Maximum length (in words) of the phrases shifted by TER
+terMaxShift = 10
+
+# Maximum number of reference corpora whose statistics are kept in the cache
+maxCachedStatistics = 10
+
+_cache = collections.OrderedDict()
+_cacheLock = threading.Lock()
+
+
+class ScoringStatistics(object):
+    """Sufficient statistics for the sentences of a translated corpus. Each
+    sentence is associated with a vector of BLEU statistics (hypothesis length,
+    closest reference length, then n-gram matches and totals for each order),
+    a vector of chrF statistics (hypothesis, reference and matching character
+    n-grams for each order) and a vector of TER statistics (number of edits
+    and average reference length).  The chrF and TER statistics are computed
+    on first access.
+
+    """
+
+    def __init__(self):
+        """Creates empty statistics.
+
+        """
+        self.bleuStats = []
+        self.sentences = []
+        self._chrfStats = []
+        self._terStats = []
+
+
+    def addSentence(self, translation, references):
+        """Adds the statistics for a translation and its list of references.
+
+        """
+        self.sentences.append((translation, references))
+        self.bleuStats.append(getBleuStatistics(translation.split(), 
+                                                [reference.split() for reference in references]))
+
+
+    @property
+    def chrfStats(self):
+        """Returns the chrF statistics for each sentence.
+
+        """
+        for translation, references in self.sentences[len(self._chrfStats):]:
+            self._chrfStats.append(getChrfStatistics(translation, references))
+        return self._chrfStats
+
+
+    @property
+    def terStats(self):
+        """Returns the TER statistics for each sentence.
+
+        """
+        for translation, references in self.sentences[len(self._terStats):]:
+            self._terStats.append(getTerStatistics(translation.split(), 
+                                                   [reference.split() for reference in references]))
+        return self._terStats
+
+
+    def __len__(self):
+        """Returns the number of sentences.
+
+        """
+        return len(self.bleuStats)
+
+
+    def bleu(self, indices=None):
+        """Returns the corpus BLEU score (between 0 and 100).  If indices is
+        provided, the score is computed on the corresponding subset of sentences
+        (possibly with repetitions).
+
+        """
+        return computeBLEU(_sumStatistics(self.bleuStats, indices))
+
+
+    def chrF(self, indices=None):
+        """Returns the corpus chrF score (between 0 and 100).
+
+        """
+        return computeChrF(_sumStatistics(self.chrfStats, indices))
+
+
+    def ter(self, indices=None):
+        """Returns the corpus TER score (in percents).
+
+        """
+        return computeTER(_sumStatistics(self.terStats, indices))
+
+
+    def sentenceBLEU(self, i):
+        """Returns the (smoothed) BLEU score of the i-th sentence.
+
+        """
+        return computeBLEU(self.bleuStats[i], smoothing=True)
+
+
+    def describeBLEU(self):
+        """Returns a description of the BLEU score in the format of multi-bleu.perl.
+
+        """
+        return describeBLEU(_sumStatistics(self.bleuStats))
+
+
+    def saveBleuStatistics(self, statsFile):
+        """Writes the per-sentence BLEU statistics in the file (one line per
+        sentence), such that they can be reloaded with loadBleuStatistics(...).
+
+        """
+        with open(statsFile, 'w') as statsD:
+            for stats in self.bleuStats:
+                statsD.write(" ".join([str(s) for s in stats]) + "\n")
+        return statsFile
+
+
+
+def loadBleuStatistics(statsFile):
+    """Loads the per-sentence BLEU statistics written by saveBleuStatistics(...),
+    and returns the corresponding ScoringStatistics object (without chrF and TER
+    statistics).
+
+    """
+    stats = ScoringStatistics()
+    with open(statsFile, 'r') as statsD:
+        for line in statsD:
+            if line.strip():
+                stats.bleuStats.append([int(s) for s in line.split()])
+    return stats
+
+
+def pairedBootstrap(stats1, stats2, nbSamples=1000, seed=None):
+    """Performs paired bootstrap resampling (Koehn, 2004) to assess whether the
+    BLEU score of a first system is significantly better than the BLEU score of
+    a second system on the same test set.  Each resample draws (with replacement)
+    as many sentences as in the test set, and the corpus BLEU of both systems is
+    recomputed from the cached sentence statistics.  If numpy is available, all
+    resamples are computed at once through array operations.
+
+    Args:
+        stats1 (ScoringStatistics): statistics for the first system
+        stats2 (ScoringStatistics): statistics for the second system
+        nbSamples (int): number of bootstrap resamples
+        seed (int): optional random seed
+
+    Returns:
+        A dictionary with the BLEU scores of both systems ('bleu1' and 'bleu2'),
+        the proportion of resamples in which the first system wins ('wins'), the
+        p-value of the hypothesis that the first system is better ('pvalue'), and
+        the 95% confidence interval for the BLEU difference ('interval').
+
+    """
+    if len(stats1) != len(stats2) or not len(stats1):
+        raise RuntimeError("statistics must cover the same (non-empty) test set")
+    nbSentences = len(stats1)
+
+    if numpy is not None:
+        randomState = numpy.random.RandomState(seed)
+        weights = randomState.multinomial(nbSentences, [1.0/nbSentences]*nbSentences,
+                                          size=nbSamples)
+        bleus1 = _computeBLEUArray(weights.dot(numpy.array(stats1.bleuStats, dtype=float)))
+        bleus2 = _computeBLEUArray(weights.dot(numpy.array(stats2.bleuStats, dtype=float)))
+        differences = sorted((bleus1 - bleus2).tolist())
+    else:
+        generator = random.Random(seed)
+        differences = []
+        for _ in range(0, nbSamples):
+            indices = [generator.randrange(nbSentences) for _ in range(0, nbSentences)]
+            differences.append(stats1.bleu(indices) - stats2.bleu(indices))
+        differences.sort()
+
+    wins = float(len([d for d in differences if d > 0]))/nbSamples
+    return {"bleu1":stats1.bleu(), "bleu2":stats2.bleu(), "wins":wins, "pvalue":1-wins,
+            "interval":(differences[int(0.025*nbSamples)],
+                        differences[min(nbSamples-1, int(0.975*nbSamples))])}
+
+
+
+def getStatistics(refCorpus, lowercase=True):
+    """Returns the scoring statistics for the reference corpus (which must have
+    a translation).  The statistics are cached as long as the reference and
+    translation files are not modified.  Only the statistics of the most recent
+    corpora are kept (cf. maxCachedStatistics), and outdated statistics for the
+    same files are removed.
+
+    Args:
+        refCorpus (ReferenceCorpus): reference corpus with translations
+        lowercase (bool): whether to lowercase translations and references
+
+    """
+    if not refCorpus.getTranslationCorpus():
+        raise RuntimeError(str(refCorpus.getStem()) + " has no translation")
+    files = [refCorpus.getTranslationCorpus()] + refCorpus.getReferenceCorpora()
+    paths = (lowercase,) + tuple([f.getAbsolute() for f in files])
+    versions = tuple([(os.path.getmtime(f), f.getSize()) for f in files])
+    with _cacheLock:
+        if paths in _cache and _cache[paths][0] == versions:
+            stats = _cache.pop(paths)[1]
+            _cache[paths] = (versions, stats)
+            return stats
+    
+    stats = ScoringStatistics()
+    for pair in refCorpus.iterAlignments():
+        translation = _lowercase(pair.translation) if lowercase else pair.translation
+        references = [_lowercase(r) for r in pair.target] if lowercase else pair.target
+        stats.addSentence(translation, references)
+    with _cacheLock:
+        _cache.pop(paths, None)
+        _cache[paths] = (versions, stats)
+        while len(_cache) > maxCachedStatistics:
+            _cache.popitem(last=False)
+    return stats
+
+
+def getBleuStatistics(hypTokens, refTokens):
+    """Returns the BLEU statistics for the hypothesis tokens given the list of
+    reference tokens, as a list [hypothesis length, reference length, matches
+    for 1-grams, total 1-grams, ..., matches for N-grams, total N-grams].
+
+    """
+    hypLength = len(hypTokens)
+    refLength = None
+    for ref in refTokens:
+        if (refLength is None or abs(len(ref)-hypLength) < abs(refLength-hypLength)
+            or (abs(len(ref)-hypLength) == abs(refLength-hypLength)
+                and len(ref) < refLength)):
+            refLength = len(ref)
+    stats = [hypLength, refLength or 0]
+    for n in range(1, bleuOrder+1):
+        hypCounts = _getNgrams(hypTokens, n)
+        maxRefCounts = collections.Counter()
+        for ref in refTokens:
+            maxRefCounts |= _getNgrams(ref, n)
+        matches = sum([min(count, maxRefCounts[ngram])
+                       for ngram, count in hypCounts.iteritems()])
+        stats += [matches, max(0, hypLength-n+1)]
+    return stats
+
+
+def computeBLEU(stats, smoothing=False):
+    """Computes the BLEU score from the (summed) BLEU statistics. If smoothing
+    is set to True, add-one smoothing is applied to the n-gram precisions of
+    order > 1 (useful for sentence-level scores).
+
+    """
+    if not stats or not stats[0]:
+        return 0.0
+    hypLength, refLength = stats[0], stats[1]
+    logPrecision = 0.0
+    for n in range(0, bleuOrder):
+        matches, total = stats[2+2*n], stats[3+2*n]
+        if smoothing and n > 0:
+            matches, total = matches + 1, total + 1
+        if not matches or not total:
+            return 0.0
+        logPrecision += math.log(float(matches)/total) / bleuOrder
+    brevityPenalty = 1.0 if hypLength >= refLength else math.exp(1-float(refLength)/hypLength)
+    return 100 * brevityPenalty * math.exp(logPrecision)
+
+
+def _computeBLEUArray(stats):
+    """Computes the BLEU scores for a numpy array of summed BLEU statistics
+    (one row per sample), and returns the array of scores.
+
+    """
+    hypLengths, refLengths = stats[:,0], stats[:,1]
+    matches, totals = stats[:,2::2], stats[:,3::2]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        logPrecisions = numpy.log(matches / totals).sum(axis=1) / bleuOrder
+        brevityPenalties = numpy.where(hypLengths >= refLengths, 1.0,
+                                       numpy.exp(1 - refLengths/hypLengths))
+        scores = 100 * brevityPenalties * numpy.exp(logPrecisions)
+    return numpy.nan_to_num(scores)
+
+
+def describeBLEU(stats):
+    """Returns a description of the BLEU score in the format of multi-bleu.perl.
+
+    """
+    if not stats or not stats[0]:
+        return "BLEU = 0, 0/0/0/0 (BP=0, ratio=0, hyp_len=0, ref_len=0)"
+    hypLength, refLength = stats[0], stats[1]
+    precisions = [(100.0*stats[2+2*n]/stats[3+2*n] if stats[3+2*n] else 0)
+                  for n in range(0, bleuOrder)]
+    brevityPenalty = 1.0 if hypLength >= refLength else math.exp(1-float(refLength)/hypLength)
+    return ("BLEU = %.2f, %s (BP=%.3f, ratio=%.3f, hyp_len=%i, ref_len=%i)"
+            %(computeBLEU(stats), "/".join(["%.1f"%p for p in precisions]), brevityPenalty,
+              float(hypLength)/refLength if refLength else 0, hypLength, refLength))
+
+
+def getChrfStatistics(hypothesis, references):
+    """Returns the chrF statistics for the hypothesis given the list of references.
+    If several references are provided, the statistics for the reference with the
+    highest sentence-level chrF are selected.  The statistics are expressed as a
+    list [hypothesis n-grams, reference n-grams, matching n-grams] for each order.
+    The character n-grams are counted in pure Python (no vectorisation), which
+    is why the chrF statistics are only computed on demand.
+
+    """
+    hypChars = "".join(hypothesis.decode("UTF-8", "replace").split())
+    hypCounts = [_getNgrams(hypChars, n) for n in range(1, chrfOrder+1)]
+    bestStats = None
+    for reference in references:
+        refChars = "".join(reference.decode("UTF-8", "replace").split())
+        stats = []
+        for n in range(1, chrfOrder+1):
+            refCounts = _getNgrams(refChars, n)
+            matches = sum((hypCounts[n-1] & refCounts).values())
+            stats += [max(0, len(hypChars)-n+1), max(0, len(refChars)-n+1), matches]
+        if bestStats is None or computeChrF(stats) > computeChrF(bestStats):
+            bestStats = stats
+    return bestStats or [0]*(3*chrfOrder)
+
+
+def computeChrF(stats):
+    """Computes the chrF score from the (summed) chrF statistics, by averaging
+    the character n-gram precisions and recalls over all orders.
+
+    """
+    if not stats:
+        return 0.0
+    precisions = [float(stats[3*n+2])/stats[3*n] for n in range(0, chrfOrder) if stats[3*n]]
+    recalls = [float(stats[3*n+2])/stats[3*n+1] for n in range(0, chrfOrder) if stats[3*n+1]]
+    precision = sum(precisions)/len(precisions) if precisions else 0.0
+    recall = sum(recalls)/len(recalls) if recalls else 0.0
+    if not precision and not recall:
+        return 0.0
+    beta2 = chrfBeta**2
+    return 100 * (1+beta2) * precision * recall / (beta2*precision + recall)
+
+
+def getTerStatistics(hypTokens, refTokens):
+    """Returns the TER statistics for the hypothesis tokens given the list of
+    reference tokens, as a list [minimum number of edits, average reference length].
+    The greedy shift search is implemented in pure Python, and recomputes the
+    (quadratic) edit distance for each candidate shift, which is why the TER
+    statistics are only computed on demand.
+
+    """
+    if not refTokens:
+        return [len(hypTokens), 0.0]
+    nbEdits = min([_getTerEdits(hypTokens, ref) for ref in refTokens])
+    avgLength = float(sum([len(ref) for ref in refTokens]))/len(refTokens)
+    return [nbEdits, avgLength]
+
+
+def computeTER(stats):
+    """Computes the TER score from the (summed) TER statistics.
+
+    """
+    if not stats:
+        return 0.0
+    nbEdits, refLength = stats[0], stats[1]
+    if not refLength:
+        return 100.0 if nbEdits else 0.0
+    return 100.0 * nbEdits / refLength
+
+
+def _getTerEdits(hypTokens, refTokens):
+    """Returns the number of edits (insertions, deletions, substitutions and
+    shifts of contiguous phrases) to transform the hypothesis into the reference.
+    The shifts are searched greedily, as in the tercom implementation: at each
+    iteration, the shift yielding the largest reduction of the edit distance is
+    applied, where the shifted phrase must occur in the reference and be moved
+    right after the hypothesis word matching the reference word that precedes it.
+
+    """
+    words = list(hypTokens)
+    distance = _getEditDistance(words, refTokens)
+    nbShifts = 0
+    refPhrases = set()
+    for length in range(1, terMaxShift+1):
+        for k in range(0, len(refTokens)-length+1):
+            refPhrases.add(tuple(refTokens[k:k+length]))
+
+    while True:
+        bestShift = None
+        bestDistance = distance
+        for start in range(0, len(words)):
+            for length in range(1, min(terMaxShift, len(words)-start)+1):
+                phrase = tuple(words[start:start+length])
+                if phrase not in refPhrases:
+                    break
+                rest = words[:start] + words[start+length:]
+                for dest in _getShiftDestinations(rest, phrase, refTokens):
+                    if dest == start:
+                        continue
+                    shifted = rest[:dest] + list(phrase) + rest[dest:]
+                    newDistance = _getEditDistance(shifted, refTokens)
+                    if newDistance < bestDistance:
+                        bestShift, bestDistance = shifted, newDistance
+        if not bestShift:
+            break
+        words = bestShift
+        distance = bestDistance
+        nbShifts += 1
+    return distance + nbShifts
+
+
+def _getShiftDestinations(words, phrase, refTokens):
+    """Returns the possible destinations (insertion positions in words) for a
+    shifted phrase, namely the positions following the words that precede the
+    occurrences of the phrase in the reference.
+
+    """
+    destinations = set()
+    length = len(phrase)
+    for k in range(0, len(refTokens)-length+1):
+        if tuple(refTokens[k:k+length]) == phrase:
+            if k == 0:
+                destinations.add(0)
+            else:
+                for j in range(0, len(words)):
+                    if words[j] == refTokens[k-1]:
+                        destinations.add(j+1)
+    return destinations
+
+
+def _getEditDistance(words, refTokens):
+    """Returns the Levenshtein distance between two lists of tokens.
+
+    """
+    previous = range(0, len(refTokens)+1)
+    for i in range(1, len(words)+1):
+        current = [i] + [0]*len(refTokens)
+        word = words[i-1]
+        for j in range(1, len(refTokens)+1):
+            current[j] = min(previous[j]+1, current[j-1]+1,
+                             previous[j-1] + (word != refTokens[j-1]))
+        previous = current
+    return previous[-1]
+
+
+def _lowercase(text):
+    """Lowercases the (UTF-8 encoded) text, including non-ASCII characters.
+
+    """
+    if isinstance(text, unicode):
+        return text.lower()
+    try:
+        return text.decode("UTF-8").lower().encode("UTF-8")
+    except UnicodeDecodeError:
+        return text.lower()
+
+
+def _getNgrams(tokens, n):
+    """Returns the counts of n-grams of order n in the sequence of tokens.
+
+    """
+    return collections.Counter([tuple(tokens[i:i+n]) for i in range(0, len(tokens)-n+1)])
+
+
+def _sumStatistics(stats, indices=None):
+    """Sums the statistics vectors (optionally restricted to the given indices).
+
+    """
+    if indices is not None:
+        stats = [stats[i] for i in indices]
+    if not stats:
+        return []
+    return [sum(column) for column in zip(*stats)]
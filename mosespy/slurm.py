@@ -38,7 +38,7 @@ __author__ = 'Pierre Lison (plison@ifi.uio.no)'
 __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
-import re, uuid, copy
+import re, uuid
 import mosespy.system as system
 from mosespy.experiment import Experiment 
 from mosespy.corpus import CorpusProcessor
@@ -56,12 +56,14 @@ nodeTime = "10:00:00"
 class SlurmExperiment(Experiment):
     """Extension of the Experiment class (in module experiment) to run processes 
     through SLURM commands instead of on the shell. Training and decoding can also 
-    make use of multiple parallel jobs to speed up the experiments. 
+    make use of multiple parallel jobs to speed up the experiments. All commands
+    of the experiment (including preprocessing, training and tuning) are run 
+    through 'srun', unless the process is already running within SLURM.
     
     """
             
     def __init__(self, expName, sourceLang=None, targetLang=None, account=None, 
-                 maxJobs=4):
+                 maxJobs=4, cacheDir=None):
         """Creates a new experiment with the given name.  If an experiment of 
         same name already exists, its state is reloaded (based on the JSON
         file that records the experiment state). 
@@ -71,10 +73,11 @@ class SlurmExperiment(Experiment):
             targetLang (str): language code for the target language
             account (string): SLURM account
             maxJobs (int): maximum number of SLURM jobs to run in parallel
+            cacheDir (str): directory of the cache of preprocessed corpora (if any)
             
         """
-        self.executor = SlurmExecutor(account)
-        Experiment.__init__(self, expName, sourceLang, targetLang)
+        Experiment.__init__(self, expName, sourceLang, targetLang, 
+                            executor=SlurmExecutor(account), cacheDir=cacheDir)
         self.maxJobs = maxJobs
   
         if not system.existsExecutable("srun"):
@@ -82,7 +85,9 @@ class SlurmExperiment(Experiment):
             return
         
         self.nbThreads = nodeCpus
-        self.processor = CorpusProcessor(self.expPath, self.executor, nodeCpus)
+        self.processor = CorpusProcessor(self.expPath, self.executor, nodeCpus,
+                                         persistent=True, pipelined=True, 
+                                         cache=self.processor.cache)
         self.decoder = Path(__file__).getUp().getAbsolute() + "/moses_parallel.py"
         
     
@@ -90,9 +95,11 @@ class SlurmExperiment(Experiment):
         """Copies the experiment with another name.
         
         """
-        newexp = SlurmExperiment(nexExpName, self.sourceLang, 
-                                 self.targetLang, self.executor.account, self.maxJobs)
+        cacheDir = self.processor.cache.cacheDir if self.processor.cache else None
+        newexp = SlurmExperiment(nexExpName, self.sourceLang, self.targetLang, 
+                                 self.executor.account, self.maxJobs, cacheDir)
         newexp.lm = self.lm
+        newexp.lmStats = self.lmStats
         newexp.continuous_lm = self.continuous_lm
         newexp.tm = self.tm
         newexp.iniFile = self.iniFile
@@ -103,11 +110,11 @@ class SlurmExperiment(Experiment):
         return newexp
          
     
-    def _constructTranslationModel(self, trainCorpus, alignment, reordering):
-        """Constructs the translation model in a distributed fashion, by splitting
-        the training data into chunks that are aligned and processed independently
-        (from step 1 to step 3). The method returns the directory containing the 
-        resulting model data.
+    def _alignCorpus(self, trainCorpus, tmDir, alignment, reordering):
+        """Aligns the training data in a distributed fashion, by splitting
+        the data into chunks that are aligned and processed independently
+        (from step 1 to step 3), and merging the resulting alignments into
+        {tmDir}/model/aligned.{alignment}.
         
         The method should not be called directly, please use trainTranslationModel(...) 
         instead.
@@ -117,7 +124,6 @@ class SlurmExperiment(Experiment):
         splitDir.resetdir()
         
         splitStems = self.processor.splitData(trainCorpus, self.maxJobs/2, splitDir)
-        tmDir = self.expPath + "/translationmodel"
            
         scripts1 = [self._getTrainScript(stem, stem, alignment, reordering, 1, 1) 
                     for stem in splitStems]
@@ -144,16 +150,10 @@ class SlurmExperiment(Experiment):
             for split in range(0, self.maxJobs/2):
                 splitFile = splitDir+ "/" + str(split)+"/model/aligned."+alignment
                 with open(splitFile) as part:
-                    for partline in part.readlines():
+                    for partline in part:
                         if partline.strip():
                             align.write(partline.strip('\n') + '\n')
         splitDir.remove()
-                    
-        script4 = self._getTrainScript(tmDir, trainCorpus.getStem(), alignment, reordering, 4) 
-        r4 = self.executor.run(script4)
-        if not r4:
-            raise RuntimeError("Construction of translation model FAILED (step 4)")
-        return tmDir
 
  
 
@@ -200,7 +200,8 @@ class SlurmExecutor(ShellExecutor):
         return ShellExecutor.run(self, script, stdin, stdout)
     
     
-    def run_parallel(self, scripts, stdins=None, stdouts=None):
+    def run_parallel(self, scripts, stdins=None, stdouts=None, maxConcurrency=None,
+                     callback=None):
         """Runs a set of scripts in parallel through 'srun', each script
         being run on a separate node.
         
@@ -211,22 +212,26 @@ class SlurmExecutor(ShellExecutor):
             stdout: the standard output, which can a list of files, nothing 
                 (None) or the boolean True, in which case the outputs are 
                 returned by the method.
+            maxConcurrency (int): maximum number of scripts running at the
+                same time.
+            callback (function): function called with each completed task.
         
         """
+        # a single script keeps the SLURM variables of the current process
         if len(scripts) == 1:
-            stdin = stdins[0] if isinstance(stdins,list) else stdins
-            stdout = stdouts[0] if isinstance(stdouts,list) else stdouts
-            result = self.run(scripts[0], stdin, stdout) 
-            return [result] if stdouts else result
+            stdins = stdins if isinstance(stdins,list) or stdins is None else [stdins]
+            stdouts = stdouts if isinstance(stdouts,list) or stdouts is None else [stdouts]
+            return ShellExecutor.run_parallel(self, scripts, stdins, stdouts, 
+                                              maxConcurrency, callback)
         
-        currentEnv = copy.deepcopy(system.getEnv())
-        for k in system.getEnv():
+        # the SLURM variables are only blanked for the child processes, since
+        # other threads may be running commands at the same time
+        env = system.getEnv()
+        for k in env.keys():
             if "SLURM" in k:
-                system.setEnv(k, "", True)
-        result = ShellExecutor.run_parallel(self, scripts, stdins, stdouts)
-        for k in currentEnv:
-            system.setEnv(k, currentEnv[k])
-        return result
+                env[k] = ""
+        return ShellExecutor.run_parallel(self, scripts, stdins, stdouts, 
+                                          maxConcurrency, callback, env)
 
                
        
@@ -34,10 +34,13 @@ __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
 
-import os, shutil, subprocess, time, Queue, threading, copy, re
+import os, shutil, subprocess, signal, select, fcntl, errno, time, Queue, threading
+import copy, re, collections, pipes, hashlib
 from datetime import datetime
 from xml.dom import minidom
 
+_fileHashes = {}
+
 class Path(str):
     """Representation of a file or directory path (which may or may not
     currently exist.  The class provides a variety of methods for creating,
@@ -201,6 +204,21 @@ class Path(str):
         return Path(str.__add__(self, other))
 
 
+    def getHash(self):
+        """Returns the MD5 hash of the file content.  The hashes are memorised
+        as long as the file is not modified.
+        
+        """
+        fileKey = (os.path.abspath(self), os.path.getmtime(self), os.path.getsize(self))
+        if fileKey not in _fileHashes:
+            md5 = hashlib.md5()
+            with open(self, 'rb') as fileD:
+                for block in iter(lambda : fileD.read(1024*1024), ""):
+                    md5.update(block)
+            _fileHashes[fileKey] = md5.hexdigest()
+        return _fileHashes[fileKey]
+    
+    
     def getSize(self):
         """Returns the size of the file or directory.
         
@@ -279,6 +297,34 @@ class Path(str):
         else:
             raise RuntimeError(self + " not an existing file")
 
+    def iterlines(self):
+        """Iterates over the lines in the file, without loading the
+        file content in memory.
+        
+        """
+        if os.path.isfile(self):
+            with open(self, 'r') as fileD:
+                for line in fileD:
+                    yield line
+        else:
+            raise RuntimeError(self + " not an existing file")
+
+
+    def iterchunks(self, chunkSize=10000):
+        """Iterates over the lines in the file by chunks (lists of lines)
+        of at most chunkSize lines.
+        
+        """
+        chunk = []
+        for line in self.iterlines():
+            chunk.append(line)
+            if len(chunk) >= chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
     def read(self):
         """Reads the content of the file and returns the result
         as a single string.
@@ -314,14 +360,17 @@ class ShellExecutor(object):
     
     """
     
-    def __init__(self, quiet=False):
+    def __init__(self, quiet=False, maxConcurrency=None):
         """Creates a new executor.  If quiet is set to True,
         the executor does not print any command on the standard
-        output.
+        output.  The maximum number of scripts running concurrently
+        in run_parallel can be bounded with maxConcurrency (None for 
+        no limit).
         
         """
         self.callincr = 0
         self.quiet = quiet
+        self.maxConcurrency = maxConcurrency
         
 
     def run(self, script, stdin=None, stdout=None):
@@ -366,8 +415,15 @@ class ShellExecutor(object):
             print cmd_str
         
         inittime = datetime.now()
-        p = subprocess.Popen(script, shell=True, stdin=stdin_popen, stdout=stdout_popen)
+        task = getattr(_taskContext, "task", None)
+        p = subprocess.Popen(script, shell=True, stdin=stdin_popen, stdout=stdout_popen,
+                             preexec_fn=os.setsid if task else None, 
+                             env=task.env if task else None)
+        if task:
+            task.attach(p)
         callOutput = p.communicate(callInput)[0]
+        if task:
+            task.returncode = p.returncode
       
         if not self.quiet:     
             print "Task [%i] %s"%(curcall,"successful" if not p.returncode else "FAILED")
@@ -384,11 +440,49 @@ class ShellExecutor(object):
         
         """
         return self.run(script, stdin, stdout=True)
+    
+    
+    def run_pipeline(self, scripts, stdin=None, stdout=None):
+        """Runs a sequence of scripts connected through pipes, where the
+        output of each script is the input of the next one.  The pipeline
+        fails if any of its scripts fails.
+        
+        Args:
+            scripts (list): the commands to chain
+            stdin, stdout: like for the run method (for the first and last
+                command of the pipeline)
+        
+        """
+        return self.run(getPipelineScript(scripts), stdin, stdout)
 
     
-    def run_parallel(self, scripts, stdins=None, stdouts=None): 
-        """Runs a set of scripts in parallel, where each script is 
-        executed in a separate thread.
+    def submit(self, script, stdin=None, stdout=None, callback=None):
+        """Starts the execution of the script in a separate thread, and 
+        returns immediately a ShellTask object that can be used to wait
+        for the result of the script or cancel its execution.
+        
+        Args:
+            script (str): the command to execute
+            stdin, stdout: like for the run method
+            callback (function): function called with the task as argument
+                upon its completion
+        
+        """
+        task = ShellTask(script, stdin, stdout)
+        if callback:
+            task.addCallback(callback)
+        t = threading.Thread(target=task.execute, args=(self,))
+        t.daemon = True
+        t.start()
+        return task
+        
+    
+    def run_parallel(self, scripts, stdins=None, stdouts=None, maxConcurrency=None, 
+                     callback=None, env=None): 
+        """Runs a set of scripts in parallel, using a bounded pool of worker 
+        threads.  The method returns as soon as all scripts are completed, 
+        without any limit on their duration.  If one script fails, the other
+        scripts are cancelled (and their processes killed).
         
         Args:
             scripts (list): the commands to execute
@@ -397,6 +491,12 @@ class ShellExecutor(object):
             stdout: the standard output, which can a list of files, nothing 
                 (None) or the boolean True, in which case the outputs are 
                 returned by the method.
+            maxConcurrency (int): maximum number of scripts running at the
+                same time (default is the executor setting, or no limit).
+            callback (function): function called with each ShellTask upon
+                its completion.
+            env (dict): environment variables of the scripts (default is the
+                environment of the current process).
                 
         Returns:
             if stdout is set to True, the method returns a list of strings 
@@ -404,43 +504,66 @@ class ShellExecutor(object):
             if all scripts were successfully executed, and False otherwise.
         
         """
-        resultQueues = []
+        tasks = []
+        pending = Queue.Queue()
+        completed = Queue.Queue()
         for i in range(0, len(scripts)):
-            time.sleep(0.1)
-            script = scripts[i]
-            stdin = stdins[i] if stdins else None
-            stdout = stdouts[i] if stdouts else None
-            resultQueue = Queue.Queue()
-            t = threading.Thread(target=self._run_queue, 
-                                 args=(script, resultQueue, stdin, stdout))
-            resultQueues.append(resultQueue)
-            t.start()
-            
-        time.sleep(0.1)
-        print str(len(resultQueues)) + " processes started..."
-        results = {}
-        for counter in range(0, 10000):
-            for rqi in range(0, len(resultQueues)):
-                q = resultQueues[rqi]
-                if not results.has_key(rqi) and not q.empty():
-                    val = q.get()
-                    if stdouts == None and val == False:
-                        print "One parallel task failed, aborting"
-                        return False
-                    results[rqi] = val
-            
-            if len(results) < len(resultQueues):
-                time.sleep(1)
-                if not (counter % 60):
-                    print ("Nb. of running processes after %i mins: %i"
-                           %(counter/60, len(resultQueues) - len(results)))
-            else:
-                break
+            task = ShellTask(scripts[i], stdins[i] if stdins else None, 
+                             stdouts[i] if stdouts else None, env)
+            task.addCallback(completed.put)
+            if callback:
+                task.addCallback(callback)
+            tasks.append(task)
+            pending.put(task)
+        
+        nbWorkers = min(len(tasks), maxConcurrency or self.maxConcurrency or len(tasks))
+        self._startTasks(pending, nbWorkers)
+        print "%i processes started (%i running concurrently)..."%(len(tasks), nbWorkers)
+        
+        nbCompleted = 0
+        nbMinutes = 0
+        try:
+            while nbCompleted < len(tasks):
+                try:
+                    task = completed.get(timeout=60)
+                except Queue.Empty:
+                    nbMinutes += 1
+                    print ("Nb. of remaining processes after %i mins: %i"
+                           %(nbMinutes, len(tasks) - nbCompleted))
+                    continue
+                nbCompleted += 1
+                if not task.isSuccessful():
+                    print "One parallel task failed, aborting"
+                    return False
+        finally:
+            if nbCompleted < len(tasks):
+                for task in tasks:
+                    task.cancel()
         
         print "Parallel processes successfully completed" 
-        return True if stdout==None else [v for (_,v) in sorted(results.items())]
+        if stdouts and True in [stdout is True for stdout in stdouts]:
+            return [task.result for task in tasks]
+        return True
+    
+    
+    def _startTasks(self, pending, nbWorkers):
+        """Starts the execution of the tasks in the queue, using the given
+        number of worker threads.
+        
+        """
+        def worker():
+            while True:
+                try:
+                    task = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                task.execute(self)
+        
+        for _ in range(0, nbWorkers):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
         
-
 
     def run_parallel_function(self, function, jobArgs, stdins=None, stdouts=None):
         """Runs in parallel a Python function, where each instance is executed
@@ -466,14 +589,625 @@ class ShellExecutor(object):
         return self.run_parallel(scripts, stdins, stdouts)
         
     
-    def _run_queue(self, script, resultQueue, stdin=None, stdout=None):
-        """runs a particular scripts and add the result to the queue object.
+
+_taskContext = threading.local()
+
+
+class ShellTask(object):
+    """Handle on a script submitted to a ShellExecutor.  The task can be 
+    waited upon or cancelled, and calls its callbacks upon completion.
+    
+    """
+    
+    def __init__(self, script, stdin=None, stdout=None, env=None):
+        """Creates a new task for the script, with the standard input and
+        output defined as in ShellExecutor.run, and optional environment 
+        variables for its process.
+        
+        """
+        self.script = script
+        self.stdin = stdin
+        self.stdout = stdout
+        self.env = env
+        self.result = None
+        self.returncode = None
+        self.cancelled = False
+        self.popen = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+    
+    
+    def execute(self, executor):
+        """Executes the script with the executor (in the current thread),
+        unless the task has already been cancelled.
+        
+        """
+        result = None
+        if not self.cancelled:
+            _taskContext.task = self
+            try:
+                result = executor.run(self.script, self.stdin, self.stdout)
+            except Exception as e:
+                print "Task \"%s\" failed: %s"%(self.script, str(e))
+                result = False
+            finally:
+                _taskContext.task = None
+        self.complete(result)
+    
+    
+    def complete(self, result):
+        """Marks the task as completed with the given result, and calls 
+        its callbacks.
+        
+        """
+        self.result = result
+        with self.lock:
+            self.finished.set()
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback(self)
+    
+    
+    def attach(self, popen):
+        """Attaches the process running the script to the task.
+        
+        """
+        with self.lock:
+            self.popen = popen
+        if self.cancelled:
+            self._kill()
+        
+        
+    def addCallback(self, callback):
+        """Adds a function to call with the task upon its completion.  If
+        the task is already completed, the function is called immediately.
+        
+        """
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+        
+        
+    def isDone(self):
+        """Returns True if the task is completed (or cancelled).
+        
+        """
+        return self.finished.is_set()
+    
+    
+    def isSuccessful(self):
+        """Returns True if the task is completed and its script returned
+        with a zero exit code.
+        
+        """
+        return self.isDone() and not self.cancelled and self.returncode == 0
+        
+    
+    def wait(self):
+        """Waits for the completion of the task and returns its result.
+        
+        """
+        while not self.finished.wait(60):
+            pass
+        return self.result
+    
+    
+    def cancel(self):
+        """Cancels the task, killing its process if it is currently running.
+        
+        """
+        self.cancelled = True
+        self._kill()
+        
+    
+    def _kill(self):
+        """Kills the process group of the script, if still running.
         
         """
-        result = self.run(script, stdin, stdout)
-        resultQueue.put(result)
+        with self.lock:
+            popen = self.popen
+        if popen and popen.poll() is None:
+            try:
+                os.killpg(popen.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        
+
+class EventLoopExecutor(ShellExecutor):
+    """Executor of commands through the shell, where all processes are
+    driven by a single event loop (based on select.poll) running in a 
+    background thread.  The standard inputs and outputs of the processes 
+    are multiplexed by the loop, which avoids starting a thread for each
+    process.  The executor has the same interface as ShellExecutor, and
+    additionally supports per-task timeouts and incremental callbacks on
+    the standard output.
+    
+    The callbacks of the tasks are called in the thread of the event loop.
+    They must therefore return quickly, and may submit new tasks but not wait
+    for them: calling run or run_parallel from a callback raises an error 
+    (since the loop would otherwise wait for itself).
+    
+    """
+    
+    def __init__(self, quiet=False, maxConcurrency=None, timeout=None):
+        """Creates a new executor.  
+        
+        Args:
+            quiet (bool): whether to print the commands on the standard output
+            maxConcurrency (int): maximum number of scripts running concurrently
+                in run_parallel (None for no limit).
+            timeout (float): default timeout (in seconds) for each task, after
+                which the process is killed (None for no timeout).
+        
+        """
+        ShellExecutor.__init__(self, quiet, maxConcurrency)
+        self.timeout = timeout
+        self.incoming = collections.deque()
+        self.lock = threading.Lock()
+        self.loopThread = None
+        self.closed = False
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        
+    
+    def run(self, script, stdin=None, stdout=None, timeout=None):
+        """Runs a new script through the event loop and waits for its 
+        completion.  The arguments are the same as for ShellExecutor.run,
+        with an optional timeout (in seconds).
+        
+        """
+        self._checkThread()
+        return self.submit(script, stdin, stdout, timeout=timeout).wait()
+    
+    
+    def run_parallel(self, scripts, stdins=None, stdouts=None, maxConcurrency=None, 
+                     callback=None, env=None):
+        """Runs a set of scripts in parallel through the event loop (cf. 
+        ShellExecutor.run_parallel).
+        
+        """
+        self._checkThread()
+        return ShellExecutor.run_parallel(self, scripts, stdins, stdouts, 
+                                          maxConcurrency, callback, env)
+    
+    
+    def submit(self, script, stdin=None, stdout=None, callback=None, timeout=None,
+               outputCallback=None):
+        """Submits the script to the event loop and returns immediately a
+        ShellTask object for it.
+        
+        Args:
+            script (str): the command to execute
+            stdin, stdout: like for the run method
+            callback (function): function called with the task upon completion
+            timeout (float): timeout in seconds (default is the executor setting)
+            outputCallback (function): function called with the task and each 
+                new chunk of standard output, if stdout is True.
+        
+        """
+        task = ShellTask(script, stdin, stdout)
+        if callback:
+            task.addCallback(callback)
+        self._enqueue(_LoopJob(task, timeout or self.timeout, outputCallback))
+        return task
+    
+    
+    def close(self):
+        """Stops the event loop once all submitted tasks are completed.
+        
+        """
+        with self.lock:
+            self.closed = True
+            loopThread = self.loopThread
+        os.write(self.wakeupWrite, "x")
+        if loopThread:
+            loopThread.join()
+        os.close(self.wakeupRead)
+        os.close(self.wakeupWrite)
+     
+    
+    def _checkThread(self):
+        """Raises an error if the current thread is the thread of the event
+        loop (e.g. in a task callback), where waiting for a task would block
+        the loop forever.
+        
+        """
+        if threading.current_thread() is self.loopThread:
+            raise RuntimeError("cannot wait for tasks in the event loop thread")
+    
+    
+    def _startTasks(self, pending, nbWorkers):
+        """Submits the tasks in the queue to the event loop, with at most
+        nbWorkers tasks running at the same time.
+        
+        """
+        def submitNext(_=None):
+            try:
+                task = pending.get_nowait()
+            except Queue.Empty:
+                return
+            task.addCallback(submitNext)
+            self._enqueue(_LoopJob(task, self.timeout))
+        
+        for _ in range(0, nbWorkers):
+            submitNext()
+            
+    
+    def _enqueue(self, job):
+        """Adds the job to the queue of the event loop (starting the loop
+        if necessary).
+        
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("executor is closed")
+            self.incoming.append(job)
+            if not self.loopThread:
+                self.loopThread = threading.Thread(target=self._loop)
+                self.loopThread.daemon = True
+                self.loopThread.start()
+        os.write(self.wakeupWrite, "x")
+        
+    
+    def _loop(self):
+        """Event loop, which starts the submitted jobs, writes their standard 
+        inputs, reads their standard outputs and collects their results.
+        
+        """
+        poller = select.poll()
+        poller.register(self.wakeupRead, select.POLLIN)
+        fdJobs = {}
+        running = []
+        while True:
+            with self.lock:
+                newJobs = list(self.incoming)
+                self.incoming.clear()
+                if self.closed and not newJobs and not running:
+                    return
+            for job in newJobs:
+                if job.start(self):
+                    running.append(job)
+                    for fd in job.getFds():
+                        fdJobs[fd] = job
+                        poller.register(fd, select.POLLOUT if fd == job.stdinFd 
+                                        else select.POLLIN)
+            
+            # processes without open pipes are checked at short intervals
+            waitTime = None
+            if [job for job in running if not job.getFds()]:
+                waitTime = 0.05
+            deadlines = [job.deadline for job in running if job.deadline]
+            if deadlines:
+                untilDeadline = max(0, min(deadlines) - time.time())
+                waitTime = min(waitTime, untilDeadline) if waitTime else untilDeadline
+            try:
+                events = poller.poll(int(waitTime*1000) if waitTime is not None else -1)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            
+            for fd, event in events:
+                if fd == self.wakeupRead:
+                    os.read(fd, 1024)
+                    continue
+                job = fdJobs[fd]
+                if job.handleEvent(fd, event):
+                    poller.unregister(fd)
+                    del fdJobs[fd]
+            
+            for job in list(running):
+                if job.deadline and time.time() > job.deadline:
+                    print "Task \"%s\" timed out after %s seconds"%(job.task.script, job.timeout)
+                    job.deadline = None
+                    job.task.cancel()
+                if not job.getFds() and job.task.popen.poll() is not None:
+                    running.remove(job)
+                    job.finish(self)
+                    
+
+class _LoopJob(object):
+    """Internal state of a task executed in the event loop of an 
+    EventLoopExecutor.
+    
+    """
+    
+    def __init__(self, task, timeout=None, outputCallback=None):
+        self.task = task
+        self.timeout = timeout
+        self.deadline = None
+        self.outputCallback = outputCallback
+        self.stdinFd = None
+        self.stdoutFd = None
+        self.inputData = None
+        self.outputChunks = []
+        
+    
+    def start(self, executor):
+        """Starts the process for the task.  Returns True if the process was
+        started, and False otherwise (in which case the task is completed).
+        
+        """
+        task = self.task
+        if task.cancelled:
+            task.complete(False)
+            return False
+        executor.callincr += 1
+        self.callNumber = executor.callincr
+        if not executor.quiet:
+            print "[%i] Running %s"%(self.callNumber, task.script)
+        
+        stdin_popen = None
+        if os.path.exists(str(task.stdin)):
+            stdin_popen = open(task.stdin, 'r')
+        elif isinstance(task.stdin, basestring):
+            stdin_popen = subprocess.PIPE
+        stdout_popen = None
+        if os.path.exists(os.path.dirname(str(task.stdout))):
+            stdout_popen = open(task.stdout, 'w')
+        elif task.stdout is True:
+            stdout_popen = subprocess.PIPE
+        
+        self.inittime = datetime.now()
+        try:
+            popen = subprocess.Popen(task.script, shell=True, stdin=stdin_popen, 
+                                     stdout=stdout_popen, close_fds=True, preexec_fn=os.setsid,
+                                     env=task.env)
+        except OSError as e:
+            print "Task \"%s\" failed: %s"%(task.script, str(e))
+            task.complete(False)
+            return False
+        finally:
+            for f in (stdin_popen, stdout_popen):
+                if isinstance(f, file):
+                    f.close()
+        task.attach(popen)
+        if self.timeout:
+            self.deadline = time.time() + self.timeout
+            
+        if popen.stdin:
+            self.inputData = task.stdin
+            self.inputOffset = 0
+            self.stdinFd = popen.stdin.fileno()
+            fcntl.fcntl(self.stdinFd, fcntl.F_SETFL, 
+                        fcntl.fcntl(self.stdinFd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            if not self.inputData:
+                self._closeInput()
+        if popen.stdout:
+            self.stdoutFd = popen.stdout.fileno()
+        return True
+    
+    
+    def getFds(self):
+        """Returns the open pipes of the process.
+        
+        """
+        return [fd for fd in (self.stdinFd, self.stdoutFd) if fd is not None]
+    
+    
+    def handleEvent(self, fd, event):
+        """Handles a poll event on one of the pipes.  Returns True if the pipe
+        is closed after the event, and False otherwise.
+        
+        """
+        if fd == self.stdinFd:
+            if event & (select.POLLERR | select.POLLHUP):
+                self._closeInput()
+                return True
+            try:
+                end = self.inputOffset + select.PIPE_BUF*16
+                self.inputOffset += os.write(fd, self.inputData[self.inputOffset:end])
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return False
+                self._closeInput()
+                return True
+            if self.inputOffset >= len(self.inputData):
+                self._closeInput()
+                return True
+            return False
+        
+        chunk = os.read(fd, 65536)
+        if chunk:
+            self.outputChunks.append(chunk)
+            if self.outputCallback:
+                self.outputCallback(self.task, chunk)
+            return False
+        self.task.popen.stdout.close()
+        self.stdoutFd = None
+        return True
+    
+    
+    def finish(self, executor):
+        """Completes the task once its process is terminated.
+        
+        """
+        task = self.task
+        task.returncode = task.popen.returncode
+        if not executor.quiet:     
+            print "Task [%i] %s"%(self.callNumber, "successful" if not task.returncode else "FAILED")
+            print "Execution time: " + (str(datetime.now() - self.inittime)).split(".")[0]
+        if task.stdout is True:
+            task.complete("".join(self.outputChunks).strip())
+        else:
+            task.complete(not task.returncode)
+    
+    
+    def _closeInput(self):
+        """Closes the standard input of the process.
+        
+        """
+        try:
+            self.task.popen.stdin.close()
+        except IOError:
+            pass
+        self.stdinFd = None
+        
+
+class TaskGraph(object):
+    """Graph of interdependent tasks (Python functions without arguments).  
+    Each task is started in a separate thread as soon as all the tasks it 
+    depends on are completed, such that independent tasks run concurrently.
+    The duration of each task (in seconds) is recorded in self.timings.
+    
+    """
+    
+    def __init__(self):
+        """Creates an empty task graph.
+        
+        """
+        self.tasks = collections.OrderedDict()
+        self.timings = collections.OrderedDict()
+    
+    
+    def addTask(self, name, function, dependencies=None):
+        """Adds a task to the graph.  The dependencies must be tasks that 
+        are already part of the graph (which prevents cyclic dependencies).
+        
+        Args:
+            name (str): name of the task
+            function: function to execute (without arguments)
+            dependencies (list): names of the tasks to complete beforehand
+        
+        """
+        dependencies = dependencies or []
+        if name in self.tasks:
+            raise RuntimeError("Task " + name + " is already defined")
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise RuntimeError("Task " + name + " depends on unknown task " + dependency)
+        self.tasks[name] = (function, set(dependencies))
+    
+    
+    def run(self, maxConcurrency=None):
+        """Runs the tasks of the graph, following their dependencies.  If a task 
+        fails, no new task is started, and the first error is raised once the 
+        running tasks are completed.  Returns the timings of the tasks.
+        
+        Args:
+            maxConcurrency (int): maximum number of tasks running at the same
+                time.  If left unspecified, the number is unbounded.
+        
+        """
+        pending = collections.OrderedDict(self.tasks)
+        completed = set()
+        running = set()
+        errors = []
+        completions = Queue.Queue()
+        
+        def runTask(name, function):
+            start = time.time()
+            try:
+                function()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                completions.put((name, time.time()-start))
+           
+        while pending or running:
+            for name, (function, dependencies) in pending.items():
+                if errors or (maxConcurrency and len(running) >= maxConcurrency):
+                    break
+                elif dependencies.issubset(completed):
+                    print "Starting task " + name
+                    del pending[name]
+                    running.add(name)
+                    t = threading.Thread(target=runTask, args=(name, function))
+                    t.daemon = True
+                    t.start()
+            if not running:
+                break
+            name, duration = completions.get()
+            running.remove(name)
+            self.timings[name] = duration
+            if not errors:
+                completed.add(name)
+                print "Task %s completed in %.1f s"%(name, duration)
+        
+        if errors:
+            raise errors[0]
+        return self.timings
+        
+            
+                                   
+class CoProcess(object):
+    """Long-running process connected through line-buffered pipes.  The
+    process is started once and then reused for many calls, where each
+    input line sent to the process must produce exactly one output line
+    (which is the case for most Moses tokenisation and truecasing scripts
+    when run in unbuffered mode).
+
+    """
+
+    def __init__(self, script, quiet=True):
+        """Creates a new co-process for the script. The process itself is
+        only started upon the first call to process(...).
+
+        """
+        self.script = script
+        self.quiet = quiet
+        self.popen = None
+        self.lock = threading.Lock()
+
+
+    def start(self):
+        """Starts the process (if not already running).
+
+        """
+        if self.isAlive():
+            return
+        if not self.quiet:
+            print "Starting co-process " + self.script
+        self.popen = subprocess.Popen(self.script, shell=True, bufsize=1,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+    def isAlive(self):
+        """Returns True if the process is currently running, and False otherwise.
+
+        """
+        return self.popen is not None and self.popen.poll() is None
+
+
+    def process(self, text):
+        """Sends the text (one or more lines) to the process and returns the
+        corresponding output lines.
+
+        """
+        return "\n".join(self.processLines(text.strip("\n").split("\n")))
+
+
+    def processLines(self, lines):
+        """Sends the lines (without line breaks) to the process and returns
+        the list of corresponding output lines.
+
+        """
+        with self.lock:
+            self.start()
+            outputs = []
+            for line in lines:
+                self.popen.stdin.write(line + "\n")
+                self.popen.stdin.flush()
+                output = self.popen.stdout.readline()
+                if not output and not self.isAlive():
+                    raise RuntimeError("co-process " + self.script + " has terminated")
+                outputs.append(output.strip("\n"))
+        return outputs
+
+
+    def close(self):
+        """Closes the pipes and waits for the process to terminate.
+
+        """
+        with self.lock:
+            if self.isAlive():
+                self.popen.stdin.close()
+                self.popen.wait()
+            self.popen = None
+
 
- 
 
 def run(script, stdin=None, stdout=None):
     """Runs the script through the shell executor.
@@ -488,6 +1222,14 @@ def run_output(script, stdin=None):
     """
     return ShellExecutor(quiet=True).run_output(script, stdin)
 
+
+def getPipelineScript(scripts):
+    """Returns a single command chaining the scripts through pipes, which 
+    fails if any of the scripts fails.
+    
+    """
+    return "bash -o pipefail -c " + pipes.quote(" | ".join(scripts))
+
    
 def existsExecutable(command):
     """Returns true if the command is an executable that is found
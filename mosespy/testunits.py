@@ -34,17 +34,25 @@ __copyright__ = 'Copyright (c) 2014-2017 Pierre Lison'
 __license__ = 'MIT License'
 
 import sys
+import math
+import json
+import time
 import unittest
 import uuid
 import os
 import shutil 
+import Queue
 import mosespy.install as install
 import mosespy.system as system
 from mosespy.system import Path, ShellExecutor
 from mosespy.corpus import BasicCorpus, AlignedCorpus, CorpusProcessor, AlignedPair, AlignedReference
+from mosespy.corpus import ReferenceCorpus, PreprocessingCache
 from mosespy.experiment import Experiment, MosesConfig
 from mosespy.slurm import SlurmExperiment
 import mosespy.datadivision as datadivision
+import mosespy.scoring as scoring
+import mosespy.analyser as analyser
+import mosespy.phrasetable as phrasetable
 
 class Pipeline(unittest.TestCase):
     """Test suite for the MosesPy pipeline.
@@ -74,6 +82,9 @@ class Pipeline(unittest.TestCase):
         self.assertTrue(processor.truecaser.isModelTrained("fr"))
         self.assertFalse(processor.truecaser.isModelTrained("en"))
         self.assertIn(self.inFile.basename().addFlag("true"), os.listdir(self.tmpdir))
+        self.assertEqual(processor.trainTruecasingModels([self.inFile, self.outFile]), 
+                         [False, True])
+        self.assertTrue(processor.truecaser.isModelTrained("en"))
         
         revertCorpus = processor.revertCorpus(trueCorpus)
         revertLines = revertCorpus.readlines()
@@ -124,8 +135,376 @@ class Pipeline(unittest.TestCase):
             align = alignments[i]
             self.assertEqual(align.target,testlines[i].strip())
 
+
+
+    def test_coprocess(self):
+        """Tests the long-lived co-processes used for text processing.
+
+        """
+        coprocess = system.CoProcess("cat")
+        self.assertEqual(coprocess.process("qui êtes-vous ?\n"), "qui êtes-vous ?")
+        popen = coprocess.popen
+        self.assertEqual(coprocess.process("first line\nsecond line"),
+                         "first line\nsecond line")
+        self.assertIs(coprocess.popen, popen)
+        coprocess.close()
+        self.assertFalse(coprocess.isAlive())
+
+        processor = CorpusProcessor(self.tmpdir, ShellExecutor(), persistent=True)
+        self.assertEqual(processor.tokeniser.deescape("j&apos; ai &quot;compris&quot;"),
+                         "j' ai \"compris\"")
+        processor.close()
+
+
+    def test_executor(self):
+        """Tests the parallel execution of scripts with a bounded pool.
+
+        """
+        executor = ShellExecutor(quiet=True)
+        completed = []
+        outputs = executor.run_parallel(["echo %i"%i for i in range(0, 6)], 
+                                        stdouts=[True]*6, maxConcurrency=2,
+                                        callback=lambda t : completed.append(t.script))
+        self.assertEqual(outputs, [str(i) for i in range(0, 6)])
+        self.assertEqual(len(completed), 6)
+        outFile = Path(self.tmpdir + "/never.txt")
+        result = executor.run_parallel(["sleep 10 && touch " + outFile, "sleep 0.5 && false"])
+        self.assertFalse(result)
+        self.assertEqual(executor.run_pipeline(["cat", "tr a-z A-Z"], "ab\ncd\n", True), "AB\nCD")
+        self.assertFalse(executor.run_pipeline(["false", "cat"]))
+        task = executor.submit("echo done", stdout=True)
+        self.assertEqual(task.wait(), "done")
+        self.assertTrue(task.isSuccessful())
+        time.sleep(0.5)
+        self.assertFalse(outFile.exists())
+        env = dict(system.getEnv(), MOSESPY_VAR="scoped")
+        self.assertEqual(executor.run_parallel(["echo $MOSESPY_VAR"]*2, stdouts=[True]*2,
+                                               env=env), ["scoped"]*2)
+        self.assertNotIn("MOSESPY_VAR", system.getEnv())
+        
+        
+    def test_taskgraph(self):
+        """Tests the concurrent execution of interdependent tasks.
+        
+        """
+        order = []
+        graph = system.TaskGraph()
+        graph.addTask("a", lambda : (time.sleep(0.5), order.append("a")))
+        graph.addTask("b", lambda : (time.sleep(0.5), order.append("b")))
+        graph.addTask("c", lambda : order.append("c"), ["a", "b"])
+        self.assertRaises(RuntimeError, graph.addTask, "d", lambda : None, ["e"])
+        start = time.time()
+        timings = graph.run()
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(order[-1], "c")
+        self.assertEqual(set(timings.keys()), set(["a", "b", "c"]))
+        self.assertGreaterEqual(timings["a"], 0.5)
+        
+        def fail():
+            raise RuntimeError("failed task")
+        graph = system.TaskGraph()
+        graph.addTask("a", fail)
+        graph.addTask("b", lambda : order.append("b2"), ["a"])
+        self.assertRaises(RuntimeError, graph.run)
+        self.assertNotIn("b2", order)
+        
+    
+    def test_eventloop(self):
+        """Tests the execution of scripts through a shared event loop.
+
+        """
+        executor = system.EventLoopExecutor(quiet=True)
+        self.assertEqual(executor.run_output("cat", "qui êtes-vous ?\n"*5000), 
+                         ("qui êtes-vous ?\n"*5000).strip())
+        self.assertTrue(executor.run("true"))
+        self.assertFalse(executor.run("sleep 10", timeout=0.2))
+        outputs = executor.run_parallel(["echo %i"%i for i in range(0, 20)], 
+                                        stdouts=[True]*20, maxConcurrency=5)
+        self.assertEqual(outputs, [str(i) for i in range(0, 20)])
+        chunks = []
+        task = executor.submit("echo a; sleep 0.2; echo b", stdout=True, 
+                               outputCallback=lambda t, c : chunks.append(c))
+        self.assertEqual(task.wait(), "a\nb")
+        self.assertEqual(chunks, ["a\n", "b\n"])
+        executor.run("echo test", stdout=self.tmpdir + "/test.txt")
+        self.assertEqual(Path(self.tmpdir + "/test.txt").read(), "test\n")
+        self.assertFalse(executor.run_parallel(["sleep 10", "false"]))
+        errors = Queue.Queue()
+        def nestedRun(_):
+            try:
+                executor.run("true")
+            except RuntimeError as e:
+                errors.put(e)
+        executor.submit("true", callback=nestedRun)
+        self.assertIsInstance(errors.get(timeout=10), RuntimeError)
+        executor.close()
+        
+        
+    def test_sharding(self):
+        """Tests the sharded processing of corpora.
+        
+        """
+        corpus = BasicCorpus(self.inFile)
+        byteRanges = corpus.getByteRanges(5)
+        self.assertEqual(len(byteRanges), 5)
+        self.assertEqual(byteRanges[0][0], 0)
+        self.assertEqual(byteRanges[-1][1], corpus.getSize())
+        content = corpus.read()
+        for start, _ in byteRanges[1:]:
+            self.assertEqual(content[start-1], "\n")
+        
+        processor = CorpusProcessor(self.tmpdir, ShellExecutor(quiet=True), nbShards=7)
+        outFile = Path(self.tmpdir + "/sharded.fr")
+        self.assertTrue(processor._runPipeline(["tr a-z A-Z", "sed s/E/e/g"], corpus, outFile))
+        self.assertEqual(outFile.read(), system.run_output("tr a-z A-Z < %s | sed s/E/e/g"%corpus) + "\n")
+        self.assertFalse([f for f in Path(self.tmpdir).listdir() if ".shard" in f])
+
+        def failingProcess(rawCorpus):
+            if rawCorpus == self.outFile:
+                raise ValueError("unexpected content")
+            return rawCorpus
+        processor.processCorpus = failingProcess
+        trainedCorpora = []
+        processor.trainTruecasingModel = lambda rawCorpus: trainedCorpora.append(rawCorpus)
+        self.assertRaises(ValueError, processor.processCorpora, [self.inFile, self.outFile])
+        processor.processCorpus = lambda rawCorpus: rawCorpus
+        processor.processCorpora([self.inFile, self.inFile + "2", self.outFile])
+        self.assertEqual(sorted(trainedCorpora), sorted([self.inFile, self.outFile]*2))
+
+        
+    def test_cache(self):
+        """Tests the cache of preprocessed corpora.
+        
+        """
+        cache = PreprocessingCache(self.tmpdir + "/cache", maxSize=2*self.inFile.getSize())
+        key1 = cache.getKey(self.inFile, "fr", ["normalise", "tokenise"])
+        self.assertEqual(key1, cache.getKey(Path(self.inFile), "fr", ["normalise", "tokenise"]))
+        key2 = cache.getKey(self.inFile, "fr", ["normalise", "tokenise", "truecase"], self.outFile)
+        self.assertNotEqual(key1, key2)
+        self.assertFalse(cache.get(key1, self.tmpdir + "/restored.fr"))
+        cache.put(key1, self.inFile)
+        cache.put(key2, self.inFile)
+        self.assertTrue(cache.get(key1, self.tmpdir + "/restored.fr"))
+        self.assertEqual(Path(self.tmpdir + "/restored.fr").read(), self.inFile.read())
+        os.utime(self.tmpdir + "/cache/" + key2, (0, 0))
+        cache.put("key3", self.outFile)
+        self.assertTrue(cache.get(key1, self.tmpdir + "/restored.fr"))
+        self.assertFalse(cache.get(key2, self.tmpdir + "/restored.fr"))
+        partialFile = Path(self.tmpdir + "/cache/key4.tmp")
+        partialFile.write(self.inFile.read())
+        os.utime(partialFile, (0, 0))
+        cache.put("key5", self.outFile)
+        self.assertTrue(partialFile.exists())
+        
+        
+    def test_iteration(self):
+        """Tests the streaming iteration over (basic and aligned) corpora.
+
+        """
+        self.assertEqual(list(self.inFile.iterlines()), self.inFile.readlines())
+        chunks = list(self.inFile.iterchunks(30))
+        self.assertEqual([len(c) for c in chunks], [30, 30, 30, 10])
+        self.assertEqual(chunks[1][0], self.inFile.readlines()[30])
+
+        acorpus = AlignedCorpus(self.inFile.getStem(), "fr", "en")
+        pairs = list(acorpus.iterlines())
+        self.assertEqual(len(pairs), 100)
+        self.assertEqual(pairs[50], (self.inFile.readlines()[50], self.outFile.readlines()[50]))
+        alignments = acorpus.getAlignments()
+        self.assertEqual(alignments[3].source, self.inFile.readlines()[3].strip())
+        self.assertEqual(alignments[3].target, self.outFile.readlines()[3].strip())
+
+        histories = BasicCorpus(self.outFile).getHistories(2)
+        self.assertEqual(histories[0], [])
+        self.assertEqual(histories[5], [l.strip("\n") for l in self.outFile.readlines()[3:5]])
+
+
+    def test_filtering(self):
+        """Tests the filtering of development and test sentences out of other corpora.
+
+        """
+        lines = self.outFile.readlines()
+        toRemove1 = Path(self.tmpdir + "/toremove1.en").writelines(lines[20:30])
+        toRemove2 = Path(self.tmpdir + "/toremove2.en").writelines(lines[60:65])
+        processor = CorpusProcessor(self.tmpdir)
+        filtered = processor.filterOutLines(self.outFile, toRemove1, toRemove2)
+        filteredLines = filtered.readlines()
+        self.assertLessEqual(len(filteredLines), 85)
+        for i in range(0, len(lines)):
+            if lines[i] not in lines[20:30] + lines[60:65]:
+                self.assertIn(lines[i], filteredLines)
+        self.assertNotIn(lines[25], filteredLines)
+        self.assertNotIn(lines[62], filteredLines)
+
+
+    def test_pruning(self):
+        """Tests the streaming pruning of phrase tables.
+        
+        """
+        lines = ["a ||| x ||| 0.5 0.5 0.6 0.5 ||| 0-0 ||| 10 10 10\n",
+                 "a ||| y ||| 0.5 0.5 0.3 0.5 ||| 0-0 ||| 10 10 5\n",
+                 "a ||| z ||| 0.5 0.5 0.00001 0.5 ||| 0-0 ||| 10 10 1\n",
+                 "b ||| y ||| 0.5 0.5 0.5 0.5 ||| 0-0 ||| 1 1 1\n",
+                 "c ||| x ||| 0.5 0.5 0.2 0.5 ||| 0-0 ||| 100 20 1\n",
+                 "c ||| z ||| 0.5 0.5 0.4 0.5 ||| 0-0 ||| 10 20 10\n"]
+        Path(self.tmpdir + "/pt").writelines(lines*5)
+        ShellExecutor().run("gzip " + self.tmpdir + "/pt")
+        
+        pruner = phrasetable.PhraseTablePruner(nbProcesses=2, chunkSize=50)
+        stats = pruner.prune(self.tmpdir + "/pt.gz", self.tmpdir + "/pruned.gz")
+        self.assertEqual((stats["total"], stats["kept"], stats["threshold"]), (30, 25, 5))
+        output = ShellExecutor().run_output("zcat " + self.tmpdir + "/pruned.gz")
+        self.assertEqual(output.split("\n"), [l.strip() for l in lines if "0.00001" not in l]*5)
+        
+        pruner = phrasetable.PhraseTablePruner(sigThreshold="a+e", nbSentences=1000,
+                                               maxTranslations=1, nbProcesses=1)
+        stats = pruner.prune(self.tmpdir + "/pt.gz", self.tmpdir + "/pruned.gz")
+        self.assertEqual((stats["kept"], stats["significance"], stats["topk"]), (10, 10, 5))
+        output = ShellExecutor().run_output("zcat " + self.tmpdir + "/pruned.gz")
+        self.assertEqual(output.split("\n"), [lines[0].strip(), lines[5].strip()]*5)
+        self.assertAlmostEqual(phrasetable.getSignificance(1, 1, 1, 1000), math.log(1000))
+        
+    
+    def test_phrasetable(self):
+        """Tests the lookups in phrase tables.
+        
+        """
+        lines = ["%s ||| %s ||| 0.1 0.2 %i 0.4 ||| 0-0\n"%(src, tgt, i) for i, (src, tgt) 
+                 in enumerate([(s, t) for s in ["a", "b", "b c", "c", "d e f"] 
+                               for t in ["x", "y z"]])]
+        Path(self.tmpdir + "/pt").writelines(sorted(lines))
+        ShellExecutor().run("gzip " + self.tmpdir + "/pt")
+        table = phrasetable.PhraseTable(self.tmpdir + "/pt.gz", cacheSize=2, blockSize=50)
+        self.assertGreater(len(table.keys), 2)
+        self.assertEqual(table.getTranslations("b"), [("x", [0.1, 0.2, 2, 0.4]), 
+                                                      ("y z", [0.1, 0.2, 3, 0.4])])
+        self.assertEqual(table.getTranslations("d e f")[1], ("y z", [0.1, 0.2, 9, 0.4]))
+        self.assertEqual(table.getTranslations("b c")[0][1][2], 4)
+        self.assertEqual(table.getTranslations("e"), [])
+        self.assertEqual(table.getTranslations("0"), [])
+        table2 = phrasetable.PhraseTable(self.tmpdir + "/pt.gz")
+        self.assertIs(table2.cache, table.cache)
+        self.assertEqual(table2.cache.entries.keys(), ["e", "0"])
+        os.utime(self.tmpdir + "/pt.gz", (time.time(), time.time() + 10))
+        table3 = phrasetable.PhraseTable(self.tmpdir + "/pt.gz")
+        self.assertIsNot(table3.cache, table.cache)
+        self.assertEqual(len([k for k in phrasetable._tables if k[0] == table.tablePath]), 1)
+        
+        Path(self.tmpdir + "/input.fr").writelines(["b c\n", "d e f g\n"])
+        phrases = phrasetable.getInputPhrases(self.tmpdir + "/input.fr")
+        self.assertIn("d e f", phrases)
+        self.assertEqual(table.writeSubset(phrases, self.tmpdir + "/subset.gz"), 8)
+        output = ShellExecutor().run_output("zcat " + self.tmpdir + "/subset.gz")
+        self.assertEqual(output.split("\n"), [l.strip() for l in sorted(lines) 
+                                              if not l.startswith("a ")])
+        
+        Path(self.tmpdir + "/pt2").writelines(sorted(lines, reverse=True))
+        self.assertRaises(RuntimeError, phrasetable.PhraseTable, self.tmpdir + "/pt2", 
+                          blockSize=50)
+        
+    
+    def test_phrasetypes(self):
+        """Tests the replacement of phrase tables in configuration files.
+        
+        """
+        iniFile = Path(self.tmpdir + "/moses.ini")
+        iniFile.writelines(["[feature]\n", "PhraseDictionaryMemory name=TranslationModel0"
+                            + " num-features=4 path=/tmp/phrase-table.gz input-factor=0\n",
+                            "\n", "[weight]\n", "TranslationModel0= 0.2 0.2 0.2 0.2\n"])
+        config = MosesConfig(iniFile)
+        Path(self.tmpdir + "/pt.minphr").write("")
+        config.replacePhraseTable(self.tmpdir + "/pt.minphr")
+        self.assertIn("PhraseDictionaryCompact name=TranslationModel0", iniFile.read())
+        self.assertEqual(config.getPhraseTable(), self.tmpdir + "/pt.minphr")
+        config.replacePhraseTable(self.tmpdir)
+        self.assertIn("ProbingPT name=TranslationModel0", iniFile.read())
+        config.replacePhraseTable(self.tmpdir + "/pt.gz")
+        self.assertIn("PhraseDictionaryMemory name=TranslationModel0", iniFile.read())
+        
+        Path(self.tmpdir + "/pt").writelines(["a ||| x ||| 0.5 0.5 0.6 0.5 ||| 0-0\n"])
+        ShellExecutor().run("gzip " + self.tmpdir + "/pt")
+        self.assertEqual(phrasetable.getNbScores(self.tmpdir + "/pt.gz"), 4)
+        self.assertTrue(phrasetable.isBinarised(self.tmpdir + "/pt.minphr"))
+        self.assertTrue(phrasetable.isBinarised(self.tmpdir))
+        self.assertFalse(phrasetable.isBinarised(self.tmpdir + "/pt.gz"))
+        self.assertRaises(RuntimeError, phrasetable.PhraseTable, self.tmpdir + "/pt.minphr")
         
     
+    def test_scoring(self):
+        """Tests the computation of BLEU, chrF and TER scores.
+
+        """
+        Path(self.tmpdir + "/eval.fr").writelines(self.inFile.readlines()[0:20])
+        Path(self.tmpdir + "/eval.en").writelines(self.outFile.readlines()[0:20])
+        Path(self.tmpdir + "/eval.translated.en").writelines(self.outFile.readlines()[0:20])
+        refCorpus = ReferenceCorpus(self.tmpdir + "/eval", "fr", "en")
+        refCorpus.addTranslation(self.tmpdir + "/eval.translated.en")
+        processor = CorpusProcessor(self.tmpdir)
+        bleu, description = processor.getBleuScore(refCorpus)
+        self.assertAlmostEqual(bleu, 100.0)
+        self.assertTrue(description.startswith("BLEU = 100.00, 100.0/100.0/100.0/100.0"))
+        self.assertFalse(scoring.getStatistics(refCorpus)._terStats)
+        scores = processor.getScores(refCorpus)
+        self.assertAlmostEqual(scores["chrF"], 100.0)
+        self.assertAlmostEqual(scores["TER"], 0.0)
+
+        stats = scoring.ScoringStatistics()
+        stats.addSentence("the cat sat on the mat today", ["the cat is on the mat today"])
+        stats.addSentence("d e a b c", ["a b c d e", "x y"])
+        self.assertEqual(stats.bleuStats[0], [7, 7, 6, 7, 4, 6, 2, 5, 1, 4])
+        self.assertEqual(stats.terStats[1], [1, 3.5])
+        self.assertAlmostEqual(stats.ter(), 200.0/10.5)
+        self.assertGreater(stats.chrF(), 50)
+        self.assertEqual(scoring._lowercase("\xc3\x89T\xc3\x89"), "\xc3\xa9t\xc3\xa9")
+
+        statsFile = scoring.getStatistics(refCorpus).saveBleuStatistics(self.tmpdir + "/eval.stats")
+        reloaded = scoring.loadBleuStatistics(statsFile)
+        self.assertEqual(len(reloaded), 20)
+        self.assertAlmostEqual(reloaded.bleu(), 100.0)
+        Path(self.tmpdir + "/eval.translated.en").writelines(["wrong\n"]*10 + 
+                                                            self.outFile.readlines()[10:20])
+        refCorpus.addTranslation(self.tmpdir + "/eval.translated.en")
+        comparison = scoring.pairedBootstrap(reloaded, scoring.getStatistics(refCorpus), 200, 1)
+        translationPath = refCorpus.getTranslationCorpus().getAbsolute()
+        self.assertEqual(len([k for k in scoring._cache if translationPath in k]), 1)
+        self.assertEqual(comparison["wins"], 1.0)
+        self.assertLess(comparison["pvalue"], 0.05)
+        self.assertGreater(comparison["interval"][0], 0)
+
+
+    def test_editgrid(self):
+        """Tests the edit distances computed by the analyser.
+        
+        """
+        grid = analyser.EditGrid("the cat sat on the mat", "The cat was on mat")
+        self.assertAlmostEqual(grid.wer, 200.0/6)
+        self.assertEqual([t.edit for t in grid.refTokens], ['g','g','s','g','d','g'])
+        self.assertEqual([t.edit for t in grid.actualTokens], ['g','g','s','g','g'])
+        banded = analyser.EditGrid("the cat sat on the mat", "The cat was on mat", band=1)
+        self.assertEqual(banded.wer, grid.wer)
+        self.assertEqual(analyser.EditGrid("a b c d", "d c b a", band=0).wer, 100.0)
+        
+        Path(self.tmpdir + "/eval.fr").writelines(self.inFile.readlines()[0:50])
+        Path(self.tmpdir + "/eval.en").writelines(self.outFile.readlines()[0:50])
+        Path(self.tmpdir + "/eval.translated.en").writelines(self.outFile.readlines()[1:51])
+        refCorpus = ReferenceCorpus(self.tmpdir + "/eval", "fr", "en")
+        refCorpus.addTranslation(self.tmpdir + "/eval.translated.en")
+        chunks = list(analyser._iterChunks(refCorpus, refCorpus, analyser._generateXMLChunk, 
+                                           nbProcesses=2, chunkSize=20))
+        self.assertEqual([length for _, length in chunks], [20, 20, 10])
+        alignPairs = zip(refCorpus.getAlignments(), refCorpus.getAlignments())
+        self.assertEqual("".join([c for c, _ in chunks]), analyser._generateXMLChunk(alignPairs))
+        shardIndex = analyser._writeJSONShards(refCorpus, refCorpus, nbProcesses=1, chunkSize=20)
+        self.assertEqual(shardIndex["nbPairs"], 50)
+        self.assertEqual([shard["first"] for shard in shardIndex["shards"]], [0, 20, 40])
+        shard = Path(self.tmpdir + "/eval.shards/00002.js").read().strip()
+        self.assertTrue(shard.startswith("analyserShard(2, ") and shard.endswith(");"))
+        rows = json.loads(shard[len("analyserShard(2, "):-2])
+        self.assertEqual(len(rows), 10)
+        self.assertTrue(rows[0]["pair"].startswith("<pair>"))
+        self.assertEqual(len(rows[0]["references"][0]), 4)
+
+
     def test_split(self):
         """Tests the methods to split aligned data in splits of equal size.
         
@@ -175,6 +554,18 @@ class Pipeline(unittest.TestCase):
         self.assertAlmostEqual(result2["logprob"], -8.35604, 3)
         self.assertEqual(result2["OOVs"], 3)
         self.assertTrue(exp.lm)
+        self.assertEqual(exp.lmStats["format"], "probing")
+        self.assertEqual(exp.lmStats["size"], exp.lm[0].getSize())
+        
+        exp2 = Experiment("test2", "fr", "en")
+        exp2.trainLanguageModel(self.outFile, preprocess=True, binaryFormat=
+                                {"type":"trie", "probBits":8, "backoffBits":8})
+        self.assertEqual(exp2.lmStats["format"], "-b 8 -q 8 trie")
+        self.assertLess(exp2.lmStats["size"], exp.lmStats["size"])
+        result3 = exp2.queryLanguageModel("Where is it ?")
+        self.assertAlmostEqual(result3["logprob"], -6.29391, 1)
+        self.assertRaises(RuntimeError, exp2.trainLanguageModel, self.outFile, 
+                          binaryFormat={"type":"probing", "probBits":8})
         
     
     def test_translationmodel(self):
@@ -200,6 +591,38 @@ class Pipeline(unittest.TestCase):
         self.assertLessEqual(newSize/1000, initSize/1000)
         
     
+    def test_checkpoints(self):
+        """Tests the resumption of experiments from their recorded checkpoints.
+        
+        """
+        install.expDir = self.tmpdir + "/"
+        exp = Experiment("test", "fr", "en")
+        exp.trainLanguageModel(self.outFile, preprocess=True)
+        exp.trainTranslationModel(self.inFile.getStem(), pruning=False)
+        self.assertIn("translationmodel", exp.checkpoints)
+        modTime = os.path.getmtime(exp.tm + "/phrase-table.gz")
+        
+        exp2 = Experiment("test")
+        self.assertEqual(exp2.checkpoints, exp.checkpoints)
+        exp2.trainLanguageModel(self.outFile, preprocess=True)
+        exp2.trainTranslationModel(self.inFile.getStem(), pruning=False)
+        self.assertEqual(os.path.getmtime(exp.tm + "/phrase-table.gz"), modTime)
+        
+        Path(exp.tm + "/moses.ini").remove()
+        exp2.trainTranslationModel(self.inFile.getStem(), pruning=False)
+        self.assertEqual(os.path.getmtime(exp.tm + "/phrase-table.gz"), modTime)
+        self.assertTrue(Path(exp.tm + "/moses.ini").exists())
+
+        exp2.trainTranslationModel(self.inFile.getStem())
+        self.assertFalse(Path(exp.tm + "/phrase-table.gz").exists())
+        modTime = os.path.getmtime(exp.tm + "/phrase-table.reduced.gz")
+        lexTime = os.path.getmtime(exp.tm + "/lex.f2e")
+        exp2.binariseModel()
+        exp2.trainTranslationModel(self.inFile.getStem())
+        self.assertEqual(os.path.getmtime(exp.tm + "/phrase-table.reduced.gz"), modTime)
+        self.assertEqual(os.path.getmtime(exp.tm + "/lex.f2e"), lexTime)
+        
+    
     def test_tuning(self):
         """Tests the methods to tune the parameters of a translation configuration.
         